@@ -0,0 +1,145 @@
+"""
+Admission control for orders: per-client rate limits and idempotent submits.
+
+A guest tapping "mix" again and again shouldn't cost the Pi a recipe lookup,
+file loads and an availability check per tap. Order routes check, before any
+of that:
+
+- an idempotency key, so a double tap, a resubmitted form or a retried API
+  call maps to the order the first request placed instead of a new one
+- a token bucket per client, so one tablet can't flood the queue
+
+Both are small in-memory tables with bounded size; they hold nothing that
+must survive a restart.
+"""
+import time
+import threading
+from collections import OrderedDict
+
+
+class RateLimiter:
+    """Token bucket per client: a steady rate with room for a short burst."""
+    
+    def __init__(self, rate, burst, max_clients=1024):
+        """
+        Args:
+            rate (float): Tokens added per second
+            burst (int): Bucket size, the most requests admitted at once
+            max_clients (int): Buckets kept; the least recently used go first
+        """
+        self.rate = float(rate)
+        self.burst = float(burst)
+        self.max_clients = max_clients
+        self.lock = threading.Lock()
+        self.buckets = OrderedDict()  # client -> [tokens, last update]
+    
+    def take(self, client, now=None):
+        """
+        Take a token for a request.
+        
+        Args:
+            client (str): Client key, e.g. its address
+            now (float): Current time.monotonic()
+        
+        Returns:
+            float: 0 if the request is admitted, else seconds until it would be
+        """
+        now = time.monotonic() if now is None else now
+        with self.lock:
+            bucket = self.buckets.pop(client, None)
+            if bucket is None:
+                bucket = [self.burst, now]
+            else:
+                bucket[0] = min(self.burst, bucket[0] + (now - bucket[1]) * self.rate)
+                bucket[1] = now
+            self.buckets[client] = bucket
+            if len(self.buckets) > self.max_clients:
+                self.buckets.popitem(last=False)
+            
+            if bucket[0] >= 1.0:
+                bucket[0] -= 1.0
+                return 0.0
+            return (1.0 - bucket[0]) / self.rate
+
+
+class _Submission:
+    """One idempotency key: the request placing it, then its order ID."""
+    
+    __slots__ = ('done', 'value', 'expires')
+    
+    def __init__(self, expires):
+        self.done = threading.Event()
+        self.value = None
+        self.expires = expires
+
+
+class IdempotencyCache:
+    """
+    Idempotency keys mapped to the orders they placed.
+    
+    The first request with a key owns it until it finishes or aborts;
+    requests with the same key meanwhile wait for its result, so a double
+    tap that arrives while the first tap is still being checked is merged
+    too.
+    """
+    
+    def __init__(self, max_entries=2048):
+        self.max_entries = max_entries
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()  # key -> _Submission, oldest first
+    
+    def begin(self, key, ttl, wait=2.0):
+        """
+        Claim a key, or get what the request that claimed it placed.
+        
+        Args:
+            key (str): Idempotency key
+            ttl (float): Seconds the key is remembered
+            wait (float): Longest wait for a request still placing the key
+        
+        Returns:
+            tuple: (True, None) if the caller owns the key and must call
+                   finish() or abort(), else (False, the earlier result);
+                   the result is None if that request is still running
+        """
+        now = time.monotonic()
+        with self.lock:
+            while self.entries:
+                oldest = next(iter(self.entries.values()))
+                if oldest.expires > now and len(self.entries) < self.max_entries:
+                    break
+                self.entries.popitem(last=False)
+            entry = self.entries.get(key)
+            if entry is None or entry.expires <= now:
+                self.entries[key] = _Submission(now + ttl)
+                self.entries.move_to_end(key)
+                return True, None
+        
+        entry.done.wait(wait)
+        if entry.done.is_set() and entry.value is None:
+            # The first request placed nothing; this one gets to try
+            return self.begin(key, ttl, 0.0)
+        return False, entry.value
+    
+    def get(self, key):
+        """What a key placed, or None if it is unknown, expired or still being placed."""
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None or entry.expires <= time.monotonic():
+                return None
+            return entry.value
+    
+    def finish(self, key, value):
+        """Record what a claimed key placed and wake requests waiting on it."""
+        with self.lock:
+            entry = self.entries.get(key)
+        if entry is not None:
+            entry.value = value
+            entry.done.set()
+    
+    def abort(self, key):
+        """Release a claimed key that placed nothing."""
+        with self.lock:
+            entry = self.entries.pop(key, None)
+        if entry is not None:
+            entry.done.set()
@@ -1,65 +1,112 @@
+import io
 import os
+import gzip
+import json
+import math
+import base64
+import bisect
 import time
-import threading
+import uuid
+import hashlib
 import logging
+import threading
 from datetime import datetime, timedelta
-from flask import Flask, render_template, request, redirect, url_for, flash, jsonify
+from functools import wraps
+from flask import (
+    Flask, render_template, request, redirect, url_for, flash, jsonify, session, make_response,
+    send_from_directory, Response, stream_with_context
+)
 from flask_socketio import SocketIO, emit
-
-try:
-    import RPi.GPIO as GPIO
-except ImportError:
-    # For development environments without GPIO
-    GPIO = None
-    logging.warning("GPIO not available - running in simulation mode")
+from markupsafe import Markup
 
 from config import Config
+from models import BottleVolume, NO_BOTTLE
+from pump_controller import (
+    PumpController, ControllerClient, ControllerError, PumpBusyError, OrderRejected, DuplicateOrder
+)
+from logging_pipeline import setup_logging
+from assets import file_hash, hashed_name, split_hashed_name, gzipped_file
+from recipe_search import RecipeSearchIndex
+from depletion import DepletionForecaster
+from usage_store import UsageStore, RESOLUTIONS as USAGE_RESOLUTIONS
+from profiling import Profiler
+from admission import RateLimiter
+from render_cache import FragmentCache
+from reconciliation import reconcile, set_baseline, clear_flag, get_drift_report
+from recipe_io import import_recipes, export_recipes, detect_format, FORMATS as RECIPE_PACK_FORMATS
 from utils import (
-    load_hose_assignments, save_hose_assignments, load_pump_calibrations, save_pump_calibration,
+    load_hose_assignments, save_hose_assignments, load_pump_calibrations, save_pump_calibration, save_pump_calibrations,
     load_hose_statuses, save_hose_statuses, load_bottle_volumes, save_bottle_volumes,
-    update_remaining_volume, load_all_recipes, save_all_recipes, get_recipe_by_id,
-    get_available_drinks, get_density, add_density, suggest_substitutes, is_ingredient_available,
-    get_all_ingredients, load_json, save_json, get_ingredient_usage_stats, update_ingredient_usage,
-    save_maintenance_log, load_maintenance_log, DENSITY_FILE
+    load_all_recipes, save_all_recipes, get_recipe_by_id, make_recipe,
+    get_available_drinks, get_density, add_density, suggest_substitutes, recipe_ingredients,
+    get_all_ingredients, load_json, save_json, get_ingredient_usage_stats,
+    save_maintenance_log, load_maintenance_log, get_maintenance_history_page, start_usage_compactor,
+    get_state_version, get_available_ingredient_ids, get_drink_popularity,
+    get_ingredient_ids, get_pumps_by_ingredient, get_ingredient_registry, add_ingredient_alias, add_state_listener,
+    DENSITY_FILE
 )
 
 app = Flask(__name__)
 app.config.from_object(Config)
-socketio = SocketIO(app, cors_allowed_origins="*")
+app.permanent_session_lifetime = Config.SESSION_LIFETIME
+socketio = SocketIO(app, cors_allowed_origins="*", async_mode=Config.SOCKETIO_ASYNC_MODE)
 
 # Configure logging
-os.makedirs("logs", exist_ok=True)
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.FileHandler("logs/app.log"), 
-        logging.StreamHandler()
-    ]
-)
-
-# GPIO Setup
-PUMP_GPIO_PINS = {1: 17, 2: 18, 3: 27, 4: 22, 5: 23, 6: 24, 7: 25, 8: 5}
-if GPIO:
-    try:
-        GPIO.setmode(GPIO.BCM)
-        for pin in PUMP_GPIO_PINS.values():
-            GPIO.setup(pin, GPIO.OUT)
-            GPIO.output(pin, GPIO.LOW)
-        logging.info("GPIO initialized successfully")
-    except Exception as e:
-        logging.error(f"Failed to initialize GPIO: {e}")
-        GPIO = None
-
-# Mixing lock and state
-mixing_lock = threading.Lock()
-is_mixing = False
-mixing_progress = 0.0
-last_error = None
-
-# Calibration & priming data
-CALIBRATION_DATA = {i: {"start_time": None, "last_run_time": 0.0} for i in range(1, 9)}
-PRIME_DATA = {i: {"start_time": None, "last_run_time": 0.0} for i in range(1, 9)}
+os.makedirs(Config.LOGS_DIR, exist_ok=True)
+log_buffer = setup_logging(Config.LOGGING_CONFIG)
+
+# Pump control. The controller owns GPIO and the pour state; with a socket
+# configured it runs as its own process so this app can use several workers.
+if Config.PUMP_CONTROLLER_SOCKET:
+    pumps = ControllerClient(Config.PUMP_CONTROLLER_SOCKET)
+else:
+    pumps = PumpController(Config.PUMP_GPIO_PINS, Config.CUP_STATIONS, Config.ORDER_QUEUE_LIMIT,
+                           simulation_speed=Config.PUMP_SIMULATION_SPEED, expanders=Config.GPIO_EXPANDERS,
+                           rate_limiter=RateLimiter(Config.MIX_RATE_PER_MINUTE / 60.0, Config.MIX_RATE_BURST),
+                           idempotency_ttl=Config.IDEMPOTENCY_TTL_SECONDS)
+pumps.add_listener(lambda event, data: socketio.emit(event, data))
+
+# Hose draw rates over recent pours, for time-to-empty and low stock alerts
+depletion = DepletionForecaster(Config.STOCK_RATE_WINDOWS, Config.LOW_STOCK_SECONDS, Config.LOW_STOCK_DRINKS)
+
+# Set after each pour. Listeners run on the pour thread before it frees
+# its pumps, so the forecast runs on a thread of its own, once for any
+# number of pours finished since the last run.
+low_stock_check = threading.Event()
+
+def push_low_stock_alerts():
+    """Tell the bar staff about hoses about to run dry, after each pour."""
+    while True:
+        low_stock_check.wait()
+        low_stock_check.clear()
+        try:
+            alerts = depletion.low_stock_alerts(load_bottle_volumes(), load_hose_assignments())
+            if alerts:
+                logging.warning(f"Low stock on hoses {', '.join(str(a['hose']) for a in alerts)}")
+                socketio.emit('low_stock', {'alerts': alerts})
+        except Exception:
+            logging.error("Error checking for low stock", exc_info=True)
+
+threading.Thread(target=push_low_stock_alerts, name="low-stock", daemon=True).start()
+pumps.add_listener(lambda event, data: low_stock_check.set() if event == 'mixing_complete' else None)
+
+# Usage journal aggregates are rebuilt here and compacted in the background,
+# by whichever process pours (the controller daemon compacts its own)
+if not Config.PUMP_CONTROLLER_SOCKET:
+    start_usage_compactor(Config.USAGE_COMPACT_INTERVAL_SECONDS)
+
+# Per-pour time series with rollups, for usage charts
+usage_store = UsageStore(raw_retention_days=Config.USAGE_RAW_RETENTION_DAYS,
+                         minute_retention_days=Config.USAGE_MINUTE_RETENTION_DAYS,
+                         hour_retention_days=Config.USAGE_HOUR_RETENTION_DAYS)
+usage_store.start_sync(Config.USAGE_STORE_SYNC_SECONDS)
+
+# On-demand profiling of requests and pours, armed from /api/profiling
+profiler = Profiler(app, Config.PROFILES_DIR, Config.PROFILES_KEPT, Config.PROFILE_MAX_REQUESTS)
+
+# Rendered main page fragments, dropped on every save
+fragments = FragmentCache()
+add_state_listener(fragments.invalidate)
 
 # PIN for settings access
 CORRECT_PIN = "1234"
@@ -78,7 +125,7 @@ def get_maintenance_status():
         current_time = datetime.now()
         
         status = {}
-        for pump_id in range(1, 9):
+        for pump_id in Config.PUMP_IDS:
             pump_str = str(pump_id)
             last_maintenance = None
             
@@ -117,29 +164,29 @@ def get_maintenance_status():
     except Exception as e:
         logging.error(f"Error in get_maintenance_status: {e}")
         # Return a safe fallback dictionary
-        return {i: {"needs_maintenance": False, "days_since_maintenance": None, "volume_dispensed": 0, "reason": None} for i in range(1, 9)}
+        return {i: {"needs_maintenance": False, "days_since_maintenance": None, "volume_dispensed": 0, "reason": None} for i in Config.PUMP_IDS}
 
 def get_smart_recommendations(limit=5):
     """Recommend drinks based on available ingredients and usage patterns."""
     try:
-        available_ingredients = set(ingredient.lower() for _, ingredient in load_hose_assignments().items())
+        available_ingredients = get_ingredient_ids(load_hose_assignments().values())
         recipes = load_all_recipes()
         
         # Score recipes based on ingredient match percentage
         scored_recipes = []
         for recipe in recipes:
-            recipe_ingredients = set(ing.lower() for ing in recipe['ingredients'].keys())
-            common_ingredients = recipe_ingredients.intersection(available_ingredients)
+            ingredient_ids = frozenset(recipe.ingredient_ids)
+            common_ingredients = ingredient_ids.intersection(available_ingredients)
             
             if not common_ingredients:
                 continue
                 
-            match_percentage = len(common_ingredients) / len(recipe_ingredients)
+            match_percentage = len(common_ingredients) / len(ingredient_ids)
             if match_percentage >= 0.5:  # At least 50% of ingredients are available
                 scored_recipes.append({
                     'recipe': recipe,
                     'score': match_percentage,
-                    'missing': len(recipe_ingredients) - len(common_ingredients)
+                    'missing': len(ingredient_ids) - len(common_ingredients)
                 })
         
         # Sort by score (descending) and then by missing ingredients (ascending)
@@ -151,91 +198,277 @@ def get_smart_recommendations(limit=5):
         logging.error(f"Error in get_smart_recommendations: {e}")
         return []
 
+def pin_required(view):
+    """Restrict a view to clients that have entered the settings PIN."""
+    @wraps(view)
+    def wrapped(*args, **kwargs):
+        if not session.get('pin_verified'):
+            return jsonify({'error': 'PIN required'}), 403
+        return view(*args, **kwargs)
+    return wrapped
+
+# Search index over the recipes; it follows drink_recipes.json on its own,
+# the recipe routes just update it right away
+recipe_index = RecipeSearchIndex()
+
+def mixing_status():
+    """Current pour state from the pump controller."""
+    try:
+        return pumps.status()
+    except ControllerError as e:
+        logging.error(f"Error getting mixing status: {e}")
+        return {'is_mixing': False, 'progress': 0.0, 'error': str(e), 'order_id': None, 'drink_name': None,
+                'orders': [], 'finished': [], 'queue_full': False, 'queue_eta_seconds': 0.0, 'eta_error': {}, 'stop_latency': {}, 'outputs': {}}
+
+def conditional_response(etag, build):
+    """
+    Answer with 304 if the client already holds etag, otherwise build the
+    response and tag it. build is only called when the body is needed.
+    An error response isn't tagged, so no client revalidates against it.
+    """
+    if request.if_none_match.contains_weak(etag):
+        response = app.response_class(status=304)
+    else:
+        response = make_response(build())
+        if response.status_code != 200:
+            return response
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
+
 # -------------------- Route Handlers --------------------
 
 @app.route('/')
 def main():
     """Main page displaying available drinks and hose status."""
-    try:
-        # Load basic data with individual try/except blocks
-        drinks = []
-        try:
-            drinks = get_available_drinks()
-        except Exception as e:
-            logging.error(f"Error getting available drinks: {e}")
-            
-        statuses = {}
-        try:
-            statuses = load_hose_statuses()
-        except Exception as e:
-            logging.error(f"Error loading hose statuses: {e}")
-            
-        volumes = {}
+    status = mixing_status()
+    # Pending flash messages are part of the page, so it can't be revalidated
+    if session.get('_flashes'):
+        return render_main(status)
+    etag = f"main-{get_state_version()}-{int(status['is_mixing'])}{int(status['queue_full'])}"
+    return conditional_response(etag, lambda: render_main(status, page_key=etag))
+
+DRINK_SORTS = ('name', 'popularity', 'availability')
+
+def get_drinks_page(sort='name', cursor=None, limit=Config.DRINKS_PAGE_SIZE, available_only=True):
+    """
+    Get one page of the drink list.
+    
+    Pages are keyed on the sort key of the last drink returned, so a page
+    stays correct when drinks are added or removed while the list is open.
+    
+    Args:
+        sort (str): 'name', 'popularity' (most poured first) or
+                    'availability' (makeable first, then most ingredients on hand)
+        cursor (str): next_cursor of the previous page, None for the first
+        limit (int): Drinks per page
+        available_only (bool): Only drinks that can be poured now
+        
+    Returns:
+        dict: 'drinks' (recipes with 'available' and 'orders') and
+              'next_cursor', None on the last page
+              
+    Raises:
+        ValueError: If sort or cursor is invalid
+    """
+    if sort not in DRINK_SORTS:
+        raise ValueError(f"Unknown sort: {sort}")
+    after = None
+    if cursor:
         try:
-            volumes = load_bottle_volumes()
-        except Exception as e:
-            logging.error(f"Error loading bottle volumes: {e}")
-            
-        assignments = {}
+            after = tuple(json.loads(base64.urlsafe_b64decode(cursor.encode('ascii'))))
+        except (ValueError, TypeError):
+            raise ValueError("Invalid cursor")
+    
+    available = get_available_ingredient_ids()
+    popularity = get_drink_popularity()
+    
+    keyed = []
+    for recipe in recipe_index.all_recipes():
+        ingredients = recipe_index.ingredient_ids(recipe['drink_id'])
+        on_hand = len(ingredients & available)
+        is_available = on_hand == len(ingredients)
+        if available_only and not is_available:
+            continue
+        name = recipe['drink_name'].lower()
+        if sort == 'popularity':
+            key = (-popularity.get(recipe['drink_id'], 0), name, recipe['drink_id'])
+        elif sort == 'availability':
+            key = (-round(on_hand / max(len(ingredients), 1), 4), name, recipe['drink_id'])
+        else:
+            key = (name, recipe['drink_id'])
+        keyed.append((key, recipe, is_available))
+    keyed.sort(key=lambda item: item[0])
+    
+    start = 0
+    if after is not None:
         try:
-            assignments = load_hose_assignments()
-        except Exception as e:
-            logging.error(f"Error loading hose assignments: {e}")
-        
-        # Create maintenance status manually - NO comprehensions here
-        maintenance_status = {}
-        for i in range(1, 9):
-            maintenance_status[i] = {
-                "needs_maintenance": False
-            }
-        maintenance_needed = False
-        
-        # Build hose_status object
-        hose_status = {}
-        for i in range(1, 9):
-            stat = statuses.get(i, True)
-            bottle = volumes.get(i, {})
-            remaining = bottle.get('remaining_volume_ml', 0)
-            total = bottle.get('total_volume_ml', 0)
-            percent = 0
-            if total > 0:
-                percent = int((remaining / total) * 100)
-            assigned_liquid = assignments.get(i, "")
-            hose_status[i] = {
-                'empty': stat, 
-                'remaining': remaining, 
-                'total': total, 
-                'percent': percent, 
-                'ingredient': assigned_liquid,
-                'maintenance': maintenance_status.get(i, {})
-            }
+            start = bisect.bisect_right([item[0] for item in keyed], after)
+        except TypeError:
+            raise ValueError("Invalid cursor")
+    page = keyed[start:start + limit]
+    
+    next_cursor = None
+    if start + limit < len(keyed):
+        next_cursor = base64.urlsafe_b64encode(json.dumps(page[-1][0]).encode('utf-8')).decode('ascii')
+    return {
+        'drinks': [dict(recipe, available=is_available, orders=popularity.get(recipe['drink_id'], 0))
+                   for _, recipe, is_available in page],
+        'next_cursor': next_cursor
+    }
+
+def render_main(status, page_key=None):
+    """
+    Render the main page from the current state.
+    
+    Args:
+        status (dict): Pour state, as mixing_status() gives it
+        page_key (str): Everything the page depends on; with it, the page
+                        is served from the render cache while the key holds
+    """
+    try:
+        if page_key is None:
+            return build_main_page(status)
+        return fragments.get('main_page', page_key, lambda: build_main_page(status))
+    except Exception as e:
+        logging.error(f"Error in main route: {e}")
+        # Not a page to cache or revalidate: a 500 gets no ETag
+        return f"Error: {str(e)}", 500
+
+def build_main_page(status):
+    """Render the main page around the cached hose panel and drink grid."""
+    version = get_state_version()
+    
+    hose_panel = fragments.get('hose_panel', version, render_hose_panel)
+    drink_grid, next_cursor = fragments.get('drink_grid', (version, status['queue_full']),
+                                            lambda: render_drink_grid(status['queue_full']))
+    
+    return render_template(
+        'main.html', 
+        hose_panel=hose_panel,
+        drink_grid=drink_grid,
+        # No recommendations for now, so the drinks are all in the grid
+        drinks=[],
+        next_cursor=next_cursor,
+        is_mixing=status['is_mixing'],
+        queue_full=status['queue_full'],
+        maintenance_needed=False,
+        recommendations=[]
+    )
+
+def render_hose_panel():
+    """Render the main page's hose panel from the saved state."""
+    # Load basic data with individual try/except blocks
+    statuses = {}
+    try:
+        statuses = load_hose_statuses()
+    except Exception as e:
+        logging.error(f"Error loading hose statuses: {e}")
         
-        # No recommendations for now
-        recommendations = []
+    volumes = {}
+    try:
+        volumes = load_bottle_volumes()
+    except Exception as e:
+        logging.error(f"Error loading bottle volumes: {e}")
         
-        return render_template(
-            'main.html', 
-            drinks=drinks, 
-            hose_status=hose_status, 
-            is_mixing=is_mixing,
-            maintenance_needed=maintenance_needed,
-            recommendations=recommendations
-        )
+    assignments = {}
+    try:
+        assignments = load_hose_assignments()
     except Exception as e:
-        logging.error(f"Error in main route: {e}")
-        # Simpler error handling
-        return f"Error: {str(e)}"
+        logging.error(f"Error loading hose assignments: {e}")
+    
+    # Create maintenance status manually - NO comprehensions here
+    maintenance_status = {}
+    for i in Config.PUMP_IDS:
+        maintenance_status[i] = {
+            "needs_maintenance": False
+        }
+    
+    # Build hose_status object
+    hose_status = {}
+    for i in Config.PUMP_IDS:
+        stat = statuses.get(i, True)
+        bottle = volumes.get(i, NO_BOTTLE)
+        remaining = bottle.remaining_volume_ml
+        total = bottle.total_volume_ml
+        percent = bottle.percent
+        assigned_liquid = assignments.get(i, "")
+        hose_status[i] = {
+            'empty': stat, 
+            'remaining': remaining, 
+            'total': total, 
+            'percent': percent, 
+            'ingredient': assigned_liquid,
+            'maintenance': maintenance_status.get(i, {})
+        }
+    
+    return Markup(render_template('hose_panel.html', hose_status=hose_status))
+
+def render_drink_grid(queue_full):
+    """
+    Render the first screen of drink cards.
+    
+    Returns:
+        tuple: (card HTML, cursor of the next page or None)
+    """
+    drinks = []
+    next_cursor = None
+    try:
+        # Only the first screen; the rest is fetched as the guest scrolls
+        first_page = get_drinks_page()
+        drinks, next_cursor = first_page['drinks'], first_page['next_cursor']
+    except Exception as e:
+        logging.error(f"Error getting available drinks: {e}")
+    return Markup(render_template('drink_cards.html', drinks=drinks, queue_full=queue_full)), next_cursor
+
+def too_many_requests(message, retry_after, as_json=False):
+    """A 429 response telling the client when to retry, as JSON or the error page."""
+    seconds = max(1, math.ceil(retry_after))
+    if as_json:
+        response = jsonify({'error': message, 'retry_after': seconds})
+    else:
+        response = make_response(render_template('error.html', error=message))
+    response.status_code = 429
+    response.headers['Retry-After'] = str(seconds)
+    return response
+
+def queue_retry_after():
+    """Seconds until a full order queue likely has room: when the first pour ends."""
+    etas = [o['eta_seconds'] for o in mixing_status()['orders']
+            if o['state'] == 'pouring' and o['eta_seconds'] is not None]
+    return min(etas) if etas else Config.QUEUE_FULL_RETRY_SECONDS
+
+def client_id():
+    """
+    Who is ordering, for rate limits and double taps: the client's address,
+    or its X-Client-Id header where Config.TRUST_CLIENT_ID_HEADER allows it.
+    """
+    if Config.TRUST_CLIENT_ID_HEADER and request.headers.get('X-Client-Id'):
+        return request.headers['X-Client-Id']
+    return request.remote_addr or 'unknown'
 
 @app.route('/mix/<int:drink_id>', methods=['POST'])
 def mix_drink_route(drink_id):
     """Handle request to mix a specific drink."""
-    global is_mixing, mixing_progress, last_error
-    
-    if is_mixing:
-        flash("A drink is already being dispensed")
-        return redirect(url_for('main'))
+    client = client_id()
+    # Order forms carry a key per page view; without one, the same drink and
+    # size from the same client a moment apart is taken as a double tap
+    key = request.form.get('idempotency_key') or request.headers.get('Idempotency-Key')
+    if key:
+        key, ttl = f"{client}:{key}", Config.IDEMPOTENCY_TTL_SECONDS
+    else:
+        key, ttl = f"{client}:{drink_id}:{request.form.get('size', 375)}", Config.DOUBLE_TAP_SECONDS
     
     try:
+        # Repeats and clients over their rate are turned away before any lookups
+        admission = pumps.admit(client, key)
+        if admission['order_id']:
+            return redirect(url_for('mix_progress', order=admission['order_id']))
+        retry_after = admission['retry_after']
+        if retry_after:
+            return too_many_requests("You're ordering faster than drinks can be poured, please wait a moment",
+                                     retry_after)
+        
         total_volume = float(request.form.get('size', 375))
         recipe = get_recipe_by_id(drink_id)
         
@@ -244,7 +477,8 @@ def mix_drink_route(drink_id):
             return redirect(url_for('main'))
         
         # Check for unavailable ingredients and suggest substitutes
-        unavailable = [ing for ing in recipe['ingredients'] if not is_ingredient_available(ing)]
+        available = get_available_ingredient_ids()
+        unavailable = [name for name, ingredient_id, _ in recipe_ingredients(recipe) if ingredient_id not in available]
         if unavailable:
             substitutes = {ing: suggest_substitutes(ing) for ing in unavailable}
             
@@ -258,152 +492,43 @@ def mix_drink_route(drink_id):
             )
         
         # Check low volumes before starting
-        hose_assignments = load_hose_assignments()
+        pumps_by_ingredient = get_pumps_by_ingredient(load_hose_assignments())
         bottle_volumes = load_bottle_volumes()
         
-        for ingredient, percentage in recipe['ingredients'].items():
-            pump_id = next((hid for hid, bev in hose_assignments.items() 
-                          if bev.lower() == ingredient.lower()), None)
+        for ingredient, ingredient_id, percentage in recipe_ingredients(recipe):
+            pump_id = pumps_by_ingredient.get(ingredient_id)
             if pump_id:
                 required_volume = total_volume * (percentage / 100.0)
-                remaining = bottle_volumes.get(pump_id, {}).get('remaining_volume_ml', 0)
+                remaining = bottle_volumes.get(pump_id, NO_BOTTLE).remaining_volume_ml
                 if remaining < required_volume:
                     flash(f"Warning: Low volume for {ingredient}. Please refill hose {pump_id}.")
         
-        with mixing_lock:
-            is_mixing = True
-            mixing_progress = 0.0
-            last_error = None
+        # Mixing runs on the pump controller's thread
+        order_id = pumps.pour(recipe, total_volume, idempotency_key=key, key_ttl=ttl)
         
-        # Start mixing in a separate thread
-        threading.Thread(target=mix_drink_thread, args=(drink_id, total_volume)).start()
-        
-        return redirect(url_for('mix_progress'))
+        return redirect(url_for('mix_progress', order=order_id))
     
+    except PumpBusyError:
+        return too_many_requests("Too many drinks are waiting, please try again shortly", queue_retry_after())
+    except DuplicateOrder:
+        flash("Your order is already being placed")
+        return redirect(url_for('main'))
+    except OrderRejected:
+        flash("This drink's ingredients don't all reach the same cup station")
+        return redirect(url_for('main'))
     except Exception as e:
         logging.error(f"Error in mix_drink_route: {e}")
         flash(f"An error occurred: {str(e)}")
         return redirect(url_for('main'))
-    
+
 @app.route('/mix_progress')
 def mix_progress():
-    """Display mixing progress page."""
-    if not is_mixing:
+    """Display the progress page of one order."""
+    order_id = request.args.get('order')
+    order = next((o for o in mixing_status()['orders'] if o['order_id'] == order_id), None)
+    if not order:
         return redirect(url_for('main'))
-    return render_template('mixing_progress_full.html')
-
-def mix_drink_thread(drink_id, total_volume):
-    """Thread function to handle the drink mixing process."""
-    global is_mixing, mixing_progress, last_error
-    
-    try:
-        recipe = get_recipe_by_id(drink_id)
-        if recipe is None:
-            last_error = "Recipe not found"
-            socketio.emit('mixing_error', {'error': last_error})
-            return
-
-        hose_assignments = load_hose_assignments()
-        calibrations = load_pump_calibrations()
-        bottle_volumes = load_bottle_volumes()
-
-        total_ingredients = len(recipe['ingredients'])
-        completed = 0
-        
-        socketio.emit('mixing_start', {'drink_name': recipe['drink_name']})
-        
-        # Convert percentage to volume for each ingredient
-        for ingredient, percentage in recipe['ingredients'].items():
-            pump_id = next((hid for hid, bev in hose_assignments.items() 
-                          if bev.lower() == ingredient.lower()), None)
-            
-            if not pump_id:
-                logging.error(f"Ingredient {ingredient} not assigned")
-                continue
-                
-            required_volume = total_volume * (percentage / 100.0)
-            flow_rate = calibrations.get(pump_id, 10.0)
-            remaining = bottle_volumes.get(pump_id, {}).get('remaining_volume_ml', 0)
-            
-            if remaining < required_volume:
-                last_error = f"Insufficient volume for {ingredient}. Please refill hose {pump_id}."
-                socketio.emit('mixing_error', {'error': last_error})
-                break
-                
-            dispense_time = required_volume / flow_rate
-            
-            # Activate pump and handle potential errors
-            try:
-                activate_pump(pump_id, dispense_time)
-                update_remaining_volume(pump_id, required_volume)
-                update_ingredient_usage(pump_id, required_volume)
-                
-                completed += 1
-                mixing_progress = completed / total_ingredients
-                socketio.emit('mixing_progress', {'progress': mixing_progress})
-                
-                # Small delay between ingredients
-                time.sleep(0.5)
-                
-            except Exception as e:
-                last_error = f"Error dispensing {ingredient}: {str(e)}"
-                logging.error(f"Pump error: {last_error}")
-                socketio.emit('mixing_error', {'error': last_error})
-                break
-        
-        socketio.emit('mixing_complete')
-        
-    except Exception as e:
-        last_error = f"Error mixing drink {drink_id}: {str(e)}"
-        logging.error(last_error)
-        socketio.emit('mixing_error', {'error': last_error})
-        
-    finally:
-        with mixing_lock:
-            is_mixing = False
-            mixing_progress = 0.0
-
-def activate_pump(pump_id, duration):
-    """Activate a pump for a specified duration."""
-    if not GPIO:
-        logging.warning(f"Simulating pump {pump_id} for {duration}s")
-        time.sleep(duration)
-        return
-        
-    pin = PUMP_GPIO_PINS.get(pump_id)
-    if not pin:
-        logging.error(f"No GPIO pin for pump {pump_id}")
-        return
-        
-    try:
-        GPIO.output(pin, GPIO.HIGH)
-        time.sleep(duration)
-        GPIO.output(pin, GPIO.LOW)
-    except Exception as e:
-        # Ensure pump is turned off even if there's an error
-        try:
-            GPIO.output(pin, GPIO.LOW)
-        except:
-            pass
-        logging.error(f"GPIO error for pump {pump_id}: {e}")
-        raise
-
-def activate_pump_raw(pump_id, on=True):
-    """Directly activate or deactivate a pump."""
-    if not GPIO:
-        logging.warning(f"Simulating pump {pump_id} -> {'ON' if on else 'OFF'}")
-        return
-        
-    pin = PUMP_GPIO_PINS.get(pump_id)
-    if not pin:
-        logging.error(f"No GPIO pin for pump {pump_id}")
-        return
-        
-    try:
-        GPIO.output(pin, GPIO.HIGH if on else GPIO.LOW)
-    except Exception as e:
-        logging.error(f"GPIO error for pump {pump_id}: {e}")
-        raise
+    return render_template('mixing_progress_full.html', order=order)
 
 # -------------------- Recipe Management Routes --------------------
 
@@ -440,15 +565,11 @@ def add_recipe():
             if not (95 <= total_percentage <= 105):
                 flash(f"Warning: Total ingredient percentage is {total_percentage}%, not 100%")
             
-            new_recipe = {
-                'drink_id': drink_id, 
-                'drink_name': drink_name, 
-                'ingredients': ingredients, 
-                'notes': notes
-            }
+            new_recipe = make_recipe(drink_id, drink_name, ingredients, notes)
             
             recipes.append(new_recipe)
             save_all_recipes(recipes)
+            recipe_index.upsert(new_recipe)
             flash("Recipe added successfully")
             
             return redirect(url_for('recipes'))
@@ -468,16 +589,14 @@ def add_recipe():
 def edit_recipe(drink_id):
     """Edit an existing recipe."""
     recipes = load_all_recipes()
-    recipe = next((r for r in recipes if r['drink_id'] == drink_id), None)
+    index = next((i for i, r in enumerate(recipes) if r['drink_id'] == drink_id), None)
     
-    if not recipe:
+    if index is None:
         flash("Recipe not found")
         return redirect(url_for('recipes'))
         
     if request.method == 'POST':
         try:
-            recipe['drink_name'] = request.form.get('drink_name')
-            
             new_ingredients = {}
             for i in range(1, 6):
                 ing = request.form.get(f'ingredient_{i}')
@@ -494,10 +613,10 @@ def edit_recipe(drink_id):
             if not (95 <= total_percentage <= 105):
                 flash(f"Warning: Total ingredient percentage is {total_percentage}%, not 100%")
                 
-            recipe['ingredients'] = new_ingredients
-            recipe['notes'] = request.form.get('notes', '')
-            
+            recipes[index] = make_recipe(drink_id, request.form.get('drink_name'), new_ingredients,
+                                         request.form.get('notes', ''))
             save_all_recipes(recipes)
+            recipe_index.upsert(recipes[index])
             flash("Recipe updated successfully")
             
             return redirect(url_for('recipes'))
@@ -509,7 +628,7 @@ def edit_recipe(drink_id):
     return render_template(
         'recipe_form.html', 
         action='Edit', 
-        recipe=recipe, 
+        recipe=recipes[index], 
         available_ingredients=get_all_ingredients()
     )
 
@@ -520,6 +639,7 @@ def delete_recipe(drink_id):
         recipes = load_all_recipes()
         recipes = [r for r in recipes if r['drink_id'] != drink_id]
         save_all_recipes(recipes)
+        recipe_index.remove(drink_id)
         flash("Recipe deleted successfully")
     except Exception as e:
         logging.error(f"Error deleting recipe: {e}")
@@ -527,18 +647,90 @@ def delete_recipe(drink_id):
         
     return redirect(url_for('recipes'))
 
+@app.route('/recipes/import', methods=['POST'])
+@pin_required
+def import_recipe_pack():
+    """
+    Merge a JSON Lines or CSV recipe pack into the catalog.
+    
+    Accepts a 'file' upload from the recipes page, which redirects back with
+    a summary, or the pack as the raw request body, which answers with the
+    summary as JSON.
+    """
+    on_duplicate = request.values.get('on_duplicate', 'update')
+    upload = request.files.get('file')
+    try:
+        if upload:
+            fmt = request.values.get('format') or detect_format(upload.filename)
+            stream = io.TextIOWrapper(upload.stream, encoding='utf-8-sig', newline='')
+        else:
+            fmt = request.args.get('format') or ('csv' if request.mimetype == 'text/csv' else 'jsonl')
+            stream = io.TextIOWrapper(request.stream, encoding='utf-8-sig', newline='')
+        summary = import_recipes(stream, fmt, on_duplicate)
+        recipe_index.sync()
+    except ValueError as e:
+        if upload:
+            flash(f"Error importing recipes: {str(e)}")
+            return redirect(url_for('recipes'))
+        return jsonify({'error': str(e)}), 400
+    
+    logging.info(f"Recipe import: {summary['added']} added, {summary['updated']} updated, "
+                 f"{summary['skipped']} skipped, {summary['invalid']} invalid")
+    if not upload:
+        return jsonify(summary)
+    
+    flash(f"Imported recipes: {summary['added']} added, {summary['updated']} updated, "
+          f"{summary['skipped']} skipped, {summary['invalid']} invalid")
+    for error in summary['errors'][:5]:
+        flash(f"Line {error['line']}: {error['error']}")
+    return redirect(url_for('recipes'))
+
+@app.route('/recipes/export')
+def export_recipe_pack():
+    """Download the recipe catalog as a JSON Lines or CSV recipe pack."""
+    fmt = request.args.get('format', 'jsonl')
+    if fmt not in RECIPE_PACK_FORMATS:
+        return jsonify({'error': f"Unknown format: {fmt}"}), 400
+    mimetype = 'text/csv' if fmt == 'csv' else 'application/x-ndjson'
+    response = Response(stream_with_context(export_recipes(fmt)), mimetype=mimetype)
+    response.headers['Content-Disposition'] = f'attachment; filename="recipes.{fmt}"'
+    return response
+
 # -------------------- Substitution Handling --------------------
 
 @app.route('/mix_with_substitutes', methods=['POST'])
 def mix_with_substitutes():
     """Handle mixing a drink with ingredient substitutions."""
-    global is_mixing, mixing_progress
+    client = client_id()
     
-    if is_mixing:
-        flash("A drink is already being dispensed")
-        return redirect(url_for('main'))
+    # Collect all form data for substitutions
+    substitutions = {}
+    for field, value in request.form.items():
+        if field.startswith('substitute_') and value:
+            # Get original ingredient name from the field
+            original_ingredient = field[len('substitute_'):].replace('_', ' ')
+            substitutions[original_ingredient] = value
+    
+    # Keyed like mix_drink_route; without a form key, the substitutions
+    # are part of what makes a repeat the same order
+    key = request.form.get('idempotency_key') or request.headers.get('Idempotency-Key')
+    if key:
+        key, ttl = f"{client}:{key}", Config.IDEMPOTENCY_TTL_SECONDS
+    else:
+        swaps = ','.join(f"{k}={v}" for k, v in sorted(substitutions.items()))
+        key = f"{client}:{request.form.get('drink_id')}:{request.form.get('size', 375)}:{swaps}"
+        ttl = Config.DOUBLE_TAP_SECONDS
     
     try:
+        # Repeats and clients over their rate are turned away before any lookups
+        admission = pumps.admit(client, key)
+        if admission['order_id']:
+            return redirect(url_for('mix_progress', order=admission['order_id']))
+        retry_after = admission['retry_after']
+        if retry_after:
+            return too_many_requests("You're ordering faster than drinks can be poured, please wait a moment",
+                                     retry_after)
+        
         drink_id = int(request.form.get('drink_id'))
         total_volume = float(request.form.get('size', 375))
         
@@ -547,139 +739,61 @@ def mix_with_substitutes():
             flash("Recipe not found")
             return redirect(url_for('main'))
         
-        # Create a new recipe object based on the original
-        recipe = {
-            'drink_id': original_recipe['drink_id'],
-            'drink_name': original_recipe['drink_name'],
-            'ingredients': {},
-            'notes': original_recipe['notes']
-        }
-        
-        # Collect all form data for substitutions
-        substitutions = {}
-        for key, value in request.form.items():
-            if key.startswith('substitute_') and value:
-                # Get original ingredient name from the key
-                original_ingredient = key[len('substitute_'):].replace('_', ' ')
-                substitutions[original_ingredient] = value
+        # Ingredients of the modified recipe; the cached original is shared
+        ingredients = {}
         
         # Process all ingredients, using substitutes or skipping as needed
         total_percentage = 0
-        for ingredient, percentage in original_recipe['ingredients'].items():
+        available = get_available_ingredient_ids()
+        for ingredient, ingredient_id, percentage in recipe_ingredients(original_recipe):
             if ingredient in substitutions:
                 # Use the substitute
                 substitute = substitutions[ingredient]
-                recipe['ingredients'][substitute] = percentage
+                ingredients[substitute] = percentage
                 total_percentage += percentage
-            elif is_ingredient_available(ingredient):
+            elif ingredient_id in available:
                 # Original ingredient is available
-                recipe['ingredients'][ingredient] = percentage
+                ingredients[ingredient] = percentage
                 total_percentage += percentage
             # If not available and no substitute, skip this ingredient
         
         # If total percentage is not 100%, adjust all percentages
         if total_percentage > 0 and total_percentage != 100:
             scale_factor = 100 / total_percentage
-            for ingredient, percentage in recipe['ingredients'].items():
-                recipe['ingredients'][ingredient] = percentage * scale_factor
+            for ingredient, percentage in ingredients.items():
+                ingredients[ingredient] = percentage * scale_factor
         
+        notes = original_recipe['notes']
         # Log the substitutions
         if substitutions:
-            logging.info(f"Drink {recipe['drink_name']} mixed with substitutions: {substitutions}")
+            logging.info(f"Drink {original_recipe['drink_name']} mixed with substitutions: {substitutions}")
             
             # Add a note about substitutions
-            if recipe['notes']:
-                recipe['notes'] += " (with substitutions)"
+            if notes:
+                notes += " (with substitutions)"
             else:
-                recipe['notes'] = "Made with substitutions"
+                notes = "Made with substitutions"
         
-        # Start mixing
-        with mixing_lock:
-            is_mixing = True
-            mixing_progress = 0.0
+        recipe = make_recipe(original_recipe['drink_id'], original_recipe['drink_name'], ingredients, notes)
         
-        # Use a custom thread for the modified recipe
-        threading.Thread(target=mix_drink_thread_custom, args=(recipe, total_volume)).start()
+        # Start mixing the modified recipe
+        order_id = pumps.pour(recipe, total_volume, idempotency_key=key, key_ttl=ttl)
         
-        return redirect(url_for('mix_progress'))
+        return redirect(url_for('mix_progress', order=order_id))
         
+    except PumpBusyError:
+        return too_many_requests("Too many drinks are waiting, please try again shortly", queue_retry_after())
+    except DuplicateOrder:
+        flash("Your order is already being placed")
+        return redirect(url_for('main'))
+    except OrderRejected:
+        flash("This drink's ingredients don't all reach the same cup station")
+        return redirect(url_for('main'))
     except Exception as e:
         logging.error(f"Error in mix_with_substitutes: {e}")
         flash(f"An error occurred: {str(e)}")
         return redirect(url_for('main'))
 
-def mix_drink_thread_custom(recipe, total_volume):
-    """Thread function to handle mixing a custom recipe with substitutions."""
-    global is_mixing, mixing_progress, last_error
-    
-    try:
-        if not recipe or not recipe.get('ingredients'):
-            last_error = "Recipe not found or empty"
-            socketio.emit('mixing_error', {'error': last_error})
-            return
-
-        hose_assignments = load_hose_assignments()
-        calibrations = load_pump_calibrations()
-        bottle_volumes = load_bottle_volumes()
-
-        total_ingredients = len(recipe['ingredients'])
-        completed = 0
-        
-        socketio.emit('mixing_start', {'drink_name': recipe['drink_name']})
-        
-        # Convert percentage to volume for each ingredient
-        for ingredient, percentage in recipe['ingredients'].items():
-            pump_id = next((hid for hid, bev in hose_assignments.items() 
-                          if bev.lower() == ingredient.lower()), None)
-            
-            if not pump_id:
-                logging.error(f"Ingredient {ingredient} not assigned")
-                socketio.emit('mixing_progress', {'progress': (completed / total_ingredients)})
-                completed += 1
-                continue
-                
-            required_volume = total_volume * (percentage / 100.0)
-            flow_rate = calibrations.get(pump_id, 10.0)
-            remaining = bottle_volumes.get(pump_id, {}).get('remaining_volume_ml', 0)
-            
-            if remaining < required_volume:
-                last_error = f"Insufficient volume for {ingredient}. Please refill hose {pump_id}."
-                socketio.emit('mixing_error', {'error': last_error})
-                break
-                
-            dispense_time = required_volume / flow_rate
-            
-            # Activate pump and handle potential errors
-            try:
-                activate_pump(pump_id, dispense_time)
-                update_remaining_volume(pump_id, required_volume)
-                update_ingredient_usage(pump_id, required_volume)
-                
-                completed += 1
-                mixing_progress = completed / total_ingredients
-                socketio.emit('mixing_progress', {'progress': mixing_progress})
-                
-                # Small delay between ingredients
-                time.sleep(0.5)
-                
-            except Exception as e:
-                last_error = f"Error dispensing {ingredient}: {str(e)}"
-                logging.error(f"Pump error: {last_error}")
-                socketio.emit('mixing_error', {'error': last_error})
-                break
-        
-        socketio.emit('mixing_complete')
-        
-    except Exception as e:
-        last_error = f"Error mixing custom drink: {str(e)}"
-        logging.error(last_error)
-        socketio.emit('mixing_error', {'error': last_error})
-        
-    finally:
-        with mixing_lock:
-            is_mixing = False
-            mixing_progress = 0.0
-
 # -------------------- PIN Entry for Settings --------------------
 
 @app.route('/pin', methods=['GET', 'POST'])
@@ -688,6 +802,8 @@ def pin_entry():
     if request.method == 'POST':
         pin = request.form.get('pin')
         if pin == CORRECT_PIN:
+            session.permanent = True
+            session['pin_verified'] = True
             return redirect(url_for('settings'))
         flash("Incorrect PIN")
     return render_template('pin_entry.html')
@@ -718,7 +834,7 @@ def hose_assignment():
     if request.method == 'POST':
         try:
             assignments = {}
-            for i in range(1, 9):
+            for i in Config.PUMP_IDS:
                 selected_ingredient = request.form.get(f'hose_{i}', '')
                 assignments[i] = selected_ingredient
             save_hose_assignments(assignments)
@@ -744,7 +860,7 @@ def hose_status_update():
     if request.method == 'POST':
         try:
             statuses = {}
-            for i in range(1, 9):
+            for i in Config.PUMP_IDS:
                 statuses[i] = request.form.get(f'hose_{i}') == 'on'
             save_hose_statuses(statuses)
             flash("Hose statuses updated")
@@ -763,10 +879,12 @@ def bottle_volumes():
     """Configure bottle volumes for each hose."""
     if request.method == 'POST':
         try:
+            previous = load_bottle_volumes()
             volumes = {}
-            for i in range(1, 9):
+            for i in Config.PUMP_IDS:
                 total = request.form.get(f'total_{i}')
                 remaining = request.form.get(f'remaining_{i}')
+                observed = request.form.get(f'observed_{i}', '').strip()
                 try:
                     total = int(total)
                     remaining = int(remaining)
@@ -784,7 +902,23 @@ def bottle_volumes():
                 except:
                     total = 0
                     remaining = 0
-                volumes[i] = {'total_volume_ml': total, 'remaining_volume_ml': remaining}
+                volumes[i] = BottleVolume(total, remaining)
+                
+                # What was really left in the old bottle checks the pump's calibration
+                if observed:
+                    try:
+                        record = reconcile(i, previous.get(i, NO_BOTTLE).remaining_volume_ml, float(observed),
+                                           Config.RECONCILE_MIN_VOLUME_ML, Config.RECONCILE_DEADBAND,
+                                           Config.RECONCILE_MAX_ADJUST, Config.RECONCILE_GAIN)
+                        if record['action'] == 'adjusted':
+                            flash(f"Pump {i} was off by {record['drift']:+.0%}, calibration adjusted to "
+                                  f"{record['calibration_after']:.2f} ml/s")
+                        elif record['action'] == 'flagged':
+                            flash(f"Pump {i} was off by {record['drift']:+.0%}, please calibrate it by hand")
+                    except ValueError:
+                        flash(f"Warning: Measured volume for hose {i} was not a number, not reconciled")
+                if observed or volumes[i] != previous.get(i):
+                    set_baseline(i, remaining)
             save_bottle_volumes(volumes)
             flash("Bottle volumes updated")
             return redirect(url_for('settings'))
@@ -836,20 +970,21 @@ def add_ingredient():
 
 @app.route('/maintenance')
 def maintenance():
-    """View maintenance status and logs."""
+    """View maintenance status and a page of the maintenance history."""
+    page = request.args.get('page', 1, type=int)
     try:
         maintenance_status = get_maintenance_status()
-        maintenance_log = load_maintenance_log()
+        history = get_maintenance_history_page(page, Config.MAINTENANCE_HISTORY_PAGE_SIZE)
     except Exception as e:
         logging.error(f"Error loading maintenance data: {e}")
-        maintenance_status = {i: {"needs_maintenance": False} for i in range(1, 9)}
-        maintenance_log = {}
+        maintenance_status = {i: {"needs_maintenance": False} for i in Config.PUMP_IDS}
+        history = {'entries': [], 'page': 1, 'per_page': Config.MAINTENANCE_HISTORY_PAGE_SIZE, 'has_more': False}
         flash("Error loading maintenance data")
         
     return render_template(
         'maintenance.html', 
         maintenance_status=maintenance_status,
-        maintenance_log=maintenance_log
+        history=history
     )
 
 @app.route('/log_maintenance', methods=['POST'])
@@ -863,7 +998,12 @@ def log_maintenance():
             flash("Pump ID is required")
             return redirect(url_for('maintenance'))
             
-        save_maintenance_log(pump_id, notes)
+        save_maintenance_log(
+            pump_id, notes,
+            history_limit=Config.MAINTENANCE_HISTORY_LIMIT,
+            segment_size=Config.MAINTENANCE_ARCHIVE_SEGMENT_SIZE,
+            segments_kept=Config.MAINTENANCE_ARCHIVE_SEGMENTS
+        )
         flash(f"Maintenance for pump {pump_id} logged successfully")
     except Exception as e:
         logging.error(f"Error logging maintenance: {e}")
@@ -882,14 +1022,17 @@ def calibration():
     
     return render_template('calibration.html', 
                           hose_assignments=hose_assignments,
-                          pump_calibrations=pump_calibrations)
+                          pump_calibrations=pump_calibrations,
+                          drift_flags=get_drift_report()['flags'],
+                          calibration_cycle=pumps.calibration_status(),
+                          cycle_seconds=Config.CALIBRATION_CYCLE_SECONDS,
+                          max_cycle_seconds=Config.CALIBRATION_MAX_SECONDS)
 
 @app.route('/start_pump/<int:pump_id>', methods=['POST'])
 def start_pump(pump_id):
     """Start a pump for calibration."""
     try:
-        CALIBRATION_DATA[pump_id]["start_time"] = time.time()
-        activate_pump_raw(pump_id, on=True)
+        pumps.start_run(pump_id, 'calibration')
         return "Pump started"
     except Exception as e:
         logging.error(f"Error starting pump {pump_id}: {e}")
@@ -899,21 +1042,15 @@ def start_pump(pump_id):
 def stop_pump(pump_id):
     """Stop a pump after calibration."""
     try:
-        start_t = CALIBRATION_DATA[pump_id].get("start_time")
-        if start_t is None:
+        duration = pumps.stop_run(pump_id, 'calibration')
+        if duration is None:
             return "Pump was not started", 400
-            
-        duration = time.time() - start_t
-        CALIBRATION_DATA[pump_id]["last_run_time"] = duration
-        CALIBRATION_DATA[pump_id]["start_time"] = None
-        
-        activate_pump_raw(pump_id, on=False)
         return f"{duration:.2f}"
     except Exception as e:
         logging.error(f"Error stopping pump {pump_id}: {e}")
         # Make sure pump is off in case of error
         try:
-            activate_pump_raw(pump_id, on=False)
+            pumps.set_pump(pump_id, on=False)
         except:
             pass
         return str(e), 500
@@ -924,7 +1061,7 @@ def calibrate_pump():
     try:
         pump_id = int(request.form.get("pump_id"))
         dispensed_volume = float(request.form.get("dispensed_volume", 0))
-        duration = CALIBRATION_DATA[pump_id]["last_run_time"]
+        duration = pumps.take_last_run(pump_id, 'calibration')
         
         if duration <= 0:
             flash("No valid pump run time recorded.")
@@ -932,7 +1069,7 @@ def calibrate_pump():
             
         flow_rate = dispensed_volume / duration
         save_pump_calibration(pump_id, flow_rate)
-        CALIBRATION_DATA[pump_id]["last_run_time"] = 0
+        clear_flag(pump_id)
         
         flash(f"Pump {pump_id} calibrated to {flow_rate:.2f} ml/s")
     except Exception as e:
@@ -941,12 +1078,72 @@ def calibrate_pump():
         
     return redirect(url_for('calibration'))
 
+@app.route('/calibration/cycle', methods=['POST'])
+def start_calibration_cycle():
+    """Run the selected pumps together for one server-timed calibration cycle."""
+    try:
+        pump_ids = [int(p) for p in request.form.getlist('pump_ids')]
+        seconds = float(request.form.get('seconds', Config.CALIBRATION_CYCLE_SECONDS))
+        if not 0 < seconds <= Config.CALIBRATION_MAX_SECONDS:
+            flash(f"Run time must be between 0 and {Config.CALIBRATION_MAX_SECONDS} seconds")
+            return redirect(url_for('calibration'))
+        
+        pumps.run_calibration(pump_ids, seconds)
+        flash(f"Running pumps {', '.join(map(str, pump_ids))} for {seconds:g} seconds")
+    except PumpBusyError as e:
+        flash(str(e))
+    except Exception as e:
+        logging.error(f"Error starting calibration cycle: {e}")
+        flash(f"Error starting calibration cycle: {str(e)}")
+    
+    return redirect(url_for('calibration'))
+
+@app.route('/api/calibration/cycle')
+def api_calibration_cycle():
+    """Get the running or last calibration cycle."""
+    return jsonify(pumps.calibration_status())
+
+@app.route('/calibration/cycle/results', methods=['POST'])
+def save_calibration_cycle():
+    """Fit and save the flow rates of every pump in the last calibration cycle."""
+    try:
+        cycle = pumps.calibration_status()
+        if cycle is None or cycle['state'] == 'running':
+            flash("No finished calibration cycle to save.")
+            return redirect(url_for('calibration'))
+        
+        flow_rates = {}
+        for pump_id in cycle['pumps']:
+            volume = request.form.get(f"volume_{pump_id}", '').strip()
+            if not volume:
+                # Left blank: keep the pump's current calibration
+                continue
+            duration = pumps.take_last_run(pump_id, 'calibration')
+            if duration <= 0:
+                flash(f"No valid run time recorded for pump {pump_id}.")
+                continue
+            flow_rates[pump_id] = float(volume) / duration
+        
+        if not flow_rates:
+            flash("No volumes entered, nothing saved.")
+            return redirect(url_for('calibration'))
+        
+        save_pump_calibrations(flow_rates)
+        for pump_id in flow_rates:
+            clear_flag(pump_id)
+        flash("Calibrated " + ", ".join(f"pump {pump_id} to {rate:.2f} ml/s"
+                                       for pump_id, rate in sorted(flow_rates.items())))
+    except Exception as e:
+        logging.error(f"Error saving calibration cycle: {e}")
+        flash(f"Error saving calibration cycle: {str(e)}")
+    
+    return redirect(url_for('calibration'))
+
 @app.route('/start_prime/<int:pump_id>', methods=['POST'])
 def start_prime(pump_id):
     """Start priming a pump."""
     try:
-        PRIME_DATA[pump_id]["start_time"] = time.time()
-        activate_pump_raw(pump_id, on=True)
+        pumps.start_run(pump_id, 'prime')
         return "Prime started"
     except Exception as e:
         logging.error(f"Error starting prime for pump {pump_id}: {e}")
@@ -956,21 +1153,15 @@ def start_prime(pump_id):
 def stop_prime(pump_id):
     """Stop priming a pump."""
     try:
-        start_t = PRIME_DATA[pump_id].get("start_time")
-        if start_t is None:
+        duration = pumps.stop_run(pump_id, 'prime')
+        if duration is None:
             return "Prime was not started", 400
-            
-        duration = time.time() - start_t
-        PRIME_DATA[pump_id]["last_run_time"] = duration
-        PRIME_DATA[pump_id]["start_time"] = None
-        
-        activate_pump_raw(pump_id, on=False)
         return f"{duration:.2f}"
     except Exception as e:
         logging.error(f"Error stopping prime for pump {pump_id}: {e}")
         # Make sure pump is off in case of error
         try:
-            activate_pump_raw(pump_id, on=False)
+            pumps.set_pump(pump_id, on=False)
         except:
             pass
         return str(e), 500
@@ -980,8 +1171,7 @@ def prime_hose():
     """Log a priming operation."""
     try:
         pump_id = int(request.form.get("pump_id"))
-        duration = PRIME_DATA[pump_id]["last_run_time"]
-        PRIME_DATA[pump_id]["last_run_time"] = 0
+        duration = pumps.take_last_run(pump_id, 'prime')
         flash(f"Hose {pump_id} primed for {duration:.2f} seconds")
     except Exception as e:
         logging.error(f"Error priming hose: {e}")
@@ -994,28 +1184,297 @@ def prime_hose():
 @app.route('/api/mixing_status')
 def api_mixing_status():
     """Get current mixing status as JSON."""
+    status = mixing_status()
+    snapshot = (status['is_mixing'], status['progress'], status['error'])
+    # md5, not hash(): string hashes differ between processes
+    etag = f"mixing-{hashlib.md5(json.dumps(snapshot).encode()).hexdigest()[:12]}"
+    return conditional_response(etag, lambda: jsonify({
+        'is_mixing': snapshot[0],
+        'progress': snapshot[1],
+        'error': snapshot[2]
+    }))
+
+@app.route('/api/drinks')
+def api_drinks():
+    """
+    Get a page of the drink list as JSON.
+    
+    Query parameters: sort (name, popularity or availability), cursor (the
+    next_cursor of the previous page), limit, and available=0 to include
+    drinks that can't be poured right now.
+    """
+    etag = f"drinks-{get_state_version()}-{hashlib.md5(request.query_string).hexdigest()[:8]}"
+    return conditional_response(etag, lambda: drinks_page_response('json'))
+
+@app.route('/drinks/cards')
+def drink_cards():
+    """Get a page of the drink list as drink cards for the main page."""
+    queue_full = int(mixing_status()['queue_full'])
+    etag = f"cards-{get_state_version()}-{queue_full}-{hashlib.md5(request.query_string).hexdigest()[:8]}"
+    return conditional_response(etag, lambda: drinks_page_response('html'))
+
+def drinks_page_response(fmt):
+    """Build a drink list page from the request arguments, as JSON or cards."""
+    limit = max(1, min(request.args.get('limit', Config.DRINKS_PAGE_SIZE, type=int), Config.DRINKS_PAGE_MAX))
+    try:
+        page = get_drinks_page(
+            sort=request.args.get('sort', 'name'),
+            cursor=request.args.get('cursor'),
+            limit=limit,
+            available_only=request.args.get('available', '1').lower() not in ('0', 'false', 'no')
+        )
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    if fmt == 'json':
+        return jsonify(page)
+    response = make_response(render_template(
+        'drink_cards.html', drinks=page['drinks'], queue_full=mixing_status()['queue_full']))
+    if page['next_cursor']:
+        response.headers['X-Next-Cursor'] = page['next_cursor']
+    return response
+
+@app.route('/api/ingredients')
+def api_ingredients():
+    """Get the ingredient registry: IDs, canonical names and aliases."""
+    etag = f"ingredients-{get_state_version()}"
+    return conditional_response(etag, lambda: jsonify(get_ingredient_registry()))
+
+@app.route('/api/ingredients/<int:ingredient_id>/aliases', methods=['POST'])
+@pin_required
+def api_add_ingredient_alias(ingredient_id):
+    """Make another name, e.g. a brand, resolve to an ingredient."""
+    alias = ((request.get_json(silent=True) or {}).get('alias') or '').strip()
+    if not alias:
+        return jsonify({'error': 'alias is required'}), 400
+    try:
+        add_ingredient_alias(ingredient_id, alias)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 409
+    recipe_index.reindex_ingredients()
+    return jsonify(next(i for i in get_ingredient_registry() if i['id'] == ingredient_id))
+
+@app.route('/api/recipes/search')
+def api_recipe_search():
+    """
+    Search recipes by name, ingredient and notes.
+    
+    Query parameters: q (free text, typos allowed), makeable=1 for drinks
+    that can be poured now, contains=<ingredient> (repeatable) and limit.
+    """
+    limit = max(1, min(request.args.get('limit', 20, type=int), 100))
+    return jsonify(recipe_index.search(
+        request.args.get('q', ''),
+        makeable=request.args.get('makeable', '').lower() in ('1', 'true', 'yes'),
+        contains=request.args.getlist('contains'),
+        limit=limit
+    ))
+
+@app.route('/api/queue')
+def api_queue():
+    """Get queued and pouring orders with their predicted wait and finish times."""
+    status = mixing_status()
+    # ETAs count down, so this is never cached
     return jsonify({
-        'is_mixing': is_mixing,
-        'progress': mixing_progress,
-        'error': last_error
+        'orders': status['orders'],
+        'queue_full': status['queue_full'],
+        'queue_eta_seconds': status['queue_eta_seconds'],
+        'eta_error': status['eta_error'],
+        'stop_latency': status['stop_latency'],
+        'outputs': status['outputs']
     })
 
+@app.route('/api/calibration/drift')
+def api_calibration_drift():
+    """Get refill reconciliations and the pumps flagged for a manual calibration."""
+    pump_id = request.args.get('pump_id', type=int)
+    limit = min(request.args.get('limit', 20, type=int), 200)
+    return jsonify(get_drift_report(pump_id, limit))
+
+@app.route('/api/orders/<order_id>/cancel', methods=['POST'])
+@pin_required
+def api_cancel_order(order_id):
+    """Cancel a queued or pouring order; a pouring one stops at once."""
+    try:
+        if not pumps.cancel(order_id):
+            return jsonify({'error': 'Order not found'}), 404
+    except ControllerError as e:
+        logging.error(f"Error cancelling order {order_id}: {e}")
+        return jsonify({'error': str(e)}), 503
+    return jsonify({'order_id': order_id, 'cancelled': True})
+
+@app.route('/api/mix/<int:drink_id>', methods=['POST'])
+def api_mix(drink_id):
+    """
+    Start mixing a drink from a JSON request, e.g. from a fleet coordinator.
+    
+    The order_id in the request, or an Idempotency-Key header, makes the
+    request safe to retry: a repeat answers with the order already placed.
+    """
+    data = request.get_json(silent=True) or {}
+    try:
+        total_volume = float(data.get('size', 375))
+    except (TypeError, ValueError):
+        return jsonify({'error': 'Invalid size'}), 400
+    order_id = data.get('order_id') or uuid.uuid4().hex
+    key = data.get('order_id') or request.headers.get('Idempotency-Key')
+    key = f"api:{key}" if key else None
+    
+    try:
+        if key:
+            placed = pumps.admit(None, key)['order_id']
+            if placed:
+                return jsonify({'order_id': placed, 'duplicate': True}), 202
+        return api_place_order(drink_id, total_volume, order_id, key)
+    except DuplicateOrder as e:
+        return jsonify({'error': str(e)}), 409
+    except ControllerError as e:
+        logging.error(f"Error placing API order: {e}")
+        return jsonify({'error': str(e)}), 503
+
+def api_place_order(drink_id, total_volume, order_id, key=None):
+    """Check and queue an API order. Returns (JSON response, status code)."""
+    recipe = get_recipe_by_id(drink_id)
+    if not recipe:
+        return jsonify({'error': 'Recipe not found'}), 404
+    
+    available = get_available_ingredient_ids()
+    unavailable = [name for name, ingredient_id, _ in recipe_ingredients(recipe) if ingredient_id not in available]
+    if unavailable:
+        return jsonify({'error': 'Ingredients unavailable', 'unavailable': unavailable}), 422
+    
+    pumps_by_ingredient = get_pumps_by_ingredient(load_hose_assignments())
+    bottle_volumes = load_bottle_volumes()
+    for ingredient, ingredient_id, percentage in recipe_ingredients(recipe):
+        pump_id = pumps_by_ingredient.get(ingredient_id)
+        required_volume = total_volume * (percentage / 100.0)
+        if bottle_volumes.get(pump_id, NO_BOTTLE).remaining_volume_ml < required_volume:
+            return jsonify({'error': f"Insufficient volume for {ingredient}", 'unavailable': [ingredient]}), 422
+    
+    try:
+        placed = pumps.pour(recipe, total_volume, order_id, idempotency_key=key)
+    except PumpBusyError:
+        response = too_many_requests('The order queue is full', queue_retry_after(), as_json=True)
+        return response, 429
+    except OrderRejected as e:
+        return jsonify({'error': str(e)}), 422
+    if placed != order_id:
+        return jsonify({'order_id': placed, 'duplicate': True}), 202
+    return jsonify({'order_id': order_id, 'drink_name': recipe['drink_name']}), 202
+
+@app.route('/api/unit_status')
+def api_unit_status():
+    """Get the state a fleet coordinator routes on: busy flag, hoses and makeable drinks."""
+    status = mixing_status()
+    orders = ''.join(o['order_id'] + o['state'] for o in status['orders'] + status['finished'])
+    etag = f"unit-{get_state_version()}-{hashlib.md5(orders.encode()).hexdigest()[:12]}"
+    return conditional_response(etag, build_unit_status)
+
+def build_unit_status():
+    """Build the unit status JSON response from the current state."""
+    status = mixing_status()
+    return jsonify({
+        'name': Config.UNIT_NAME,
+        'is_mixing': status['is_mixing'],
+        'progress': status['progress'],
+        'error': status['error'],
+        'queued': sum(1 for o in status['orders'] if o['state'] == 'queued'),
+        # Queued and pouring orders, then the outcome of recent ones, so a
+        # coordinator can follow the orders it sent
+        'orders': [{'order_id': o['order_id'], 'state': o['state'], 'error': None} for o in status['orders']]
+                  + status['finished'],
+        'queue_full': status['queue_full'],
+        # Orders the unit pours side by side; a coordinator sends it this many at most
+        'stations': len(Config.CUP_STATIONS),
+        'hoses': build_hose_status().get_json(),
+        'available_drinks': [r['drink_id'] for r in get_available_drinks()]
+    })
+
+def parse_time_range():
+    """
+    Read 'start' and 'end' query arguments, as ISO datetimes or epoch
+    seconds; the last 24 hours by default.
+    
+    Returns:
+        tuple: (start, end) in epoch seconds
+    """
+    def parse(name, default):
+        value = request.args.get(name)
+        if not value:
+            return default
+        try:
+            return float(value)
+        except ValueError:
+            return datetime.fromisoformat(value).timestamp()
+    
+    end = parse('end', time.time())
+    start = parse('start', end - 86400)
+    if start >= end:
+        raise ValueError("start must be before end")
+    return start, end
+
+@app.route('/api/usage/series')
+def api_usage_series():
+    """Get drinks poured or ml dispensed per minute, hour or day over a time range."""
+    try:
+        start, end = parse_time_range()
+        resolution = request.args.get('resolution')
+        if resolution and resolution not in USAGE_RESOLUTIONS:
+            raise ValueError(f"resolution must be one of {', '.join(USAGE_RESOLUTIONS)}")
+        return jsonify(usage_store.series(
+            start, end, resolution,
+            metric=request.args.get('metric', 'orders'),
+            pump=request.args.get('pump_id', type=int),
+            drink_id=request.args.get('drink_id', type=int)
+        ))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+@app.route('/api/usage/top_drinks')
+def api_usage_top_drinks():
+    """Get the most poured drinks over a time range."""
+    try:
+        start, end = parse_time_range()
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    limit = min(request.args.get('limit', 10, type=int), 100)
+    
+    drinks = []
+    for drink_id, orders in usage_store.top_drinks(start, end, limit):
+        recipe = get_recipe_by_id(drink_id)
+        drinks.append({'drink_id': drink_id, 'drink_name': recipe['drink_name'] if recipe else None,
+                       'orders': orders})
+    return jsonify({'start': start, 'end': end, 'drinks': drinks})
+
+@app.route('/api/maintenance_history')
+def api_maintenance_history():
+    """Get a page of maintenance history as JSON."""
+    page = request.args.get('page', 1, type=int)
+    per_page = min(request.args.get('per_page', Config.MAINTENANCE_HISTORY_PAGE_SIZE, type=int), 100)
+    pump_id = request.args.get('pump_id')
+    return jsonify(get_maintenance_history_page(page, per_page, pump_id))
+
 @app.route('/api/hose_status')
 def api_hose_status():
-    """Get current hose status as JSON."""
+    """Get current hose status and stock forecast as JSON."""
+    # Forecasts drift as the rate windows slide, so they are fresh to the minute
+    etag = f"hoses-{get_state_version()}-{int(time.time() // 60)}"
+    return conditional_response(etag, build_hose_status)
+
+def build_hose_status():
+    """Build the hose status JSON response from the saved state."""
     statuses = load_hose_statuses()
     volumes = load_bottle_volumes()
     assignments = load_hose_assignments()
+    forecast = depletion.hose_forecast(volumes)
     
     hose_status = {}
-    for i in range(1, 9):
+    for i in Config.PUMP_IDS:
         stat = statuses.get(i, True)
-        bottle = volumes.get(i, {})
-        remaining = bottle.get('remaining_volume_ml', 0)
-        total = bottle.get('total_volume_ml', 0)
-        percent = 0
-        if total > 0:
-            percent = int((remaining / total) * 100)
+        bottle = volumes.get(i, NO_BOTTLE)
+        remaining = bottle.remaining_volume_ml
+        total = bottle.total_volume_ml
+        percent = bottle.percent
         assigned_liquid = assignments.get(i, "")
         
         hose_status[i] = {
@@ -1023,39 +1482,186 @@ def api_hose_status():
             'remaining': remaining, 
             'total': total, 
             'percent': percent, 
-            'ingredient': assigned_liquid
+            'ingredient': assigned_liquid,
+            'ml_per_hour': forecast.get(i, {}).get('ml_per_hour', 0.0),
+            'empty_in_seconds': forecast.get(i, {}).get('empty_in_seconds'),
+            'drinks_left': forecast.get(i, {}).get('drinks_left')
         }
         
     return jsonify(hose_status)
 
+@app.route('/api/stock_forecast')
+def api_stock_forecast():
+    """Get time-to-empty per hose and drinks left per recipe as JSON."""
+    try:
+        size = float(request.args.get('size', Config.DEFAULT_DRINK_SIZE_ML))
+    except ValueError:
+        return jsonify({'error': 'Invalid size'}), 400
+    limit = min(request.args.get('limit', 50, type=int), Config.DRINKS_PAGE_MAX)
+    
+    volumes = load_bottle_volumes()
+    hoses = depletion.hose_forecast(volumes)
+    drinks = depletion.recipe_forecast(recipe_index.all_recipes(), get_pumps_by_ingredient(load_hose_assignments()),
+                                       volumes, size, hoses)
+    return jsonify({'size': size, 'hoses': hoses, 'drinks': drinks[:limit], 'total': len(drinks)})
+
+@app.route('/api/logs')
+@pin_required
+def api_logs():
+    """Get recent log records from the in-memory buffer as JSON."""
+    limit = request.args.get('limit', 100, type=int)
+    level = request.args.get('level')
+    records = log_buffer.get_records(limit=limit, min_level=level) if log_buffer else []
+    return jsonify({'records': records})
+
+@app.route('/api/profiling', methods=['GET', 'POST'])
+@pin_required
+def api_profiling():
+    """
+    Arm a profiling run, or get the armed run and the saved ones.
+    
+    POST takes mode ('sample' or 'cprofile') and either requests (profile
+    that many requests) or target=pour (profile the next pour), as JSON or
+    form fields.
+    """
+    if request.method == 'GET':
+        return jsonify(profiler.status())
+    
+    params = request.get_json(silent=True) or request.form
+    target = params.get('target', 'requests')
+    try:
+        if target == 'pour':
+            if not isinstance(pumps, PumpController):
+                return jsonify({'error': "Pours run in the pump controller daemon and can't be profiled here"}), 409
+            run = profiler.arm(params.get('mode', 'sample'), pumps=pumps,
+                               interval=Config.PROFILE_SAMPLE_INTERVAL_MS / 1000.0)
+        elif target == 'requests':
+            run = profiler.arm(params.get('mode', 'sample'), requests=int(params.get('requests', 20)),
+                               interval=Config.PROFILE_SAMPLE_INTERVAL_MS / 1000.0)
+        else:
+            return jsonify({'error': f"Unknown profiling target: {target}"}), 400
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 409 if profiler.run else 400
+    return jsonify({'armed': run}), 202
+
+@app.route('/api/profiling/stop', methods=['POST'])
+@pin_required
+def api_profiling_stop():
+    """End the armed profiling run early and save what it collected."""
+    run = profiler.stop()
+    if run is None:
+        return jsonify({'error': 'No profiling run is armed'}), 404
+    return jsonify({'stopped': run, 'last_result': profiler.last_result})
+
+@app.route('/api/profiling/<path:filename>')
+@pin_required
+def api_profiling_download(filename):
+    """Download a saved profile: .collapsed stacks, .txt summary or .prof stats."""
+    return send_from_directory(Config.PROFILES_DIR, filename, as_attachment=True)
+
 # -------------------- Emergency Stop --------------------
 
 @app.route('/emergency_stop', methods=['POST'])
 def emergency_stop():
     """Emergency stop for all pumps."""
-    global is_mixing, mixing_progress, last_error
-    
     try:
-        # Stop all pumps
-        if GPIO:
-            for pin in PUMP_GPIO_PINS.values():
-                try:
-                    GPIO.output(pin, GPIO.LOW)
-                except Exception as e:
-                    logging.error(f"Error turning off pin {pin}: {e}")
+        # Stop all pumps and reset mixing state
+        result = pumps.emergency_stop()
         
-        # Reset mixing state
-        with mixing_lock:
-            is_mixing = False
-            mixing_progress = 0.0
-            last_error = "Emergency stop activated"
-            
-        flash("Emergency stop activated - all pumps stopped")
+        flash(f"Emergency stop activated - all pumps stopped in {result['latency_ms']:.0f} ms")
         return redirect(url_for('main'))
     except Exception as e:
         logging.error(f"Error in emergency stop: {e}")
         return str(e), 500
 
+# -------------------- Static Assets --------------------
+
+# Assets the service worker caches up front so the kiosk shell renders offline
+SHELL_ASSETS = [
+    'css/mixer-ui.css', 'css/style.css', 'js/script.js',
+    'vendor/socket.io-4.8.1.min.js', 'vendor/alpine-3.14.9.min.js'
+]
+
+@app.template_global()
+def pump_ids():
+    """IDs of the unit's pumps, for templates listing every hose."""
+    return Config.PUMP_IDS
+
+@app.template_global()
+def asset_url(filename):
+    """URL of a static file with its content hash in the name."""
+    hashed = hashed_name(app.static_folder, filename)
+    if hashed is None:
+        return url_for('static', filename=filename)
+    return url_for('hashed_asset', filename=hashed)
+
+def accepts_gzip():
+    """Whether the client accepts gzip-encoded responses."""
+    return request.accept_encodings['gzip'] > 0
+
+@app.route('/assets/<path:filename>')
+def hashed_asset(filename):
+    """Serve a content-hashed static file with far-future cache headers."""
+    real_name, digest = split_hashed_name(filename)
+    response = send_from_directory(app.static_folder, real_name)
+    
+    path = os.path.join(app.static_folder, real_name)
+    compressible = (response.mimetype in Config.COMPRESS_MIMETYPES
+                    and os.path.getsize(path) >= Config.COMPRESS_MIN_SIZE)
+    if compressible and accepts_gzip() and response.status_code == 200:
+        # Each asset is compressed once and then served from memory
+        response.close()
+        compressed = gzipped_file(path, Config.COMPRESS_LEVEL)
+        response = app.response_class(compressed, mimetype=response.mimetype)
+        response.headers['Content-Encoding'] = 'gzip'
+        response.set_etag(f"{file_hash(path)}-gz")
+        response.make_conditional(request)
+    if compressible:
+        response.vary.add('Accept-Encoding')
+    
+    if digest and digest == file_hash(path):
+        response.cache_control.no_cache = None
+        response.cache_control.public = True
+        response.cache_control.max_age = Config.ASSET_MAX_AGE
+        response.cache_control.immutable = True
+    return response
+
+@app.route('/sw.js')
+def service_worker():
+    """Service worker script, served from the root so it controls every page."""
+    shell_assets = [asset_url(filename) for filename in SHELL_ASSETS]
+    version = hashlib.md5('|'.join(shell_assets).encode()).hexdigest()[:10]
+    response = make_response(render_template('sw.js', shell_assets=shell_assets, version=version))
+    response.mimetype = 'application/javascript'
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
+
+@app.after_request
+def compress_response(response):
+    """Gzip HTML, JSON and text responses above the size threshold."""
+    if (response.direct_passthrough or response.is_streamed
+            or response.status_code != 200
+            or 'Content-Encoding' in response.headers
+            or response.mimetype not in Config.COMPRESS_MIMETYPES):
+        return response
+    
+    response.vary.add('Accept-Encoding')
+    if not accepts_gzip():
+        return response
+    
+    data = response.get_data()
+    if len(data) < Config.COMPRESS_MIN_SIZE:
+        return response
+    
+    response.set_data(gzip.compress(data, compresslevel=Config.COMPRESS_LEVEL))
+    response.headers['Content-Encoding'] = 'gzip'
+    
+    # The compressed body is a different representation of the same state
+    etag, weak = response.get_etag()
+    if etag and not weak:
+        response.set_etag(etag, weak=True)
+    return response
+
 # -------------------- Error Routes --------------------
 
 @app.route('/error')
@@ -1079,12 +1685,12 @@ def internal_server_error(e):
 if __name__ == '__main__':
     try:
         # Make sure data directory exists
-        os.makedirs("data", exist_ok=True)
+        os.makedirs(Config.DATA_DIR, exist_ok=True)
         logging.info("Starting Smart Drink Mixer application")
-        socketio.run(app, host='0.0.0.0', port=5000, debug=Config.DEBUG)
+        socketio.run(app, host=Config.HOST, port=Config.PORT, debug=Config.DEBUG,
+                     allow_unsafe_werkzeug=socketio.async_mode == 'threading')
     except Exception as e:
         logging.critical(f"Failed to start application: {e}")
     finally:
         # Clean up GPIO on exit
-        if GPIO:
-            GPIO.cleanup()
\ No newline at end of file
+        pumps.close()
\ No newline at end of file
@@ -0,0 +1,99 @@
+import os
+import gzip
+import hashlib
+import threading
+
+# Cache of content hashes: {path: (mtime, hash)}
+_hash_cache = {}
+_hash_lock = threading.Lock()
+
+# Cache of gzipped static files: {path: (mtime, compressed bytes)}
+_gzip_cache = {}
+
+def file_hash(path):
+    """
+    Get a short content hash for a file, cached until the file changes.
+    
+    Args:
+        path (str): Absolute path of the file
+        
+    Returns:
+        str: First 10 hex digits of the file's MD5, or None if it doesn't exist
+    """
+    try:
+        mtime = os.path.getmtime(path)
+    except OSError:
+        return None
+    
+    with _hash_lock:
+        cached = _hash_cache.get(path)
+        if cached and cached[0] == mtime:
+            return cached[1]
+    
+    with open(path, 'rb') as f:
+        digest = hashlib.md5(f.read()).hexdigest()[:10]
+    with _hash_lock:
+        _hash_cache[path] = (mtime, digest)
+    return digest
+
+def hashed_name(static_folder, filename):
+    """
+    Insert the content hash of a static file into its name,
+    e.g. 'js/script.js' -> 'js/script.3f2a9c01de.js'.
+    
+    Args:
+        static_folder (str): Static folder of the app
+        filename (str): Path relative to the static folder
+        
+    Returns:
+        str: Hashed file name, or None if the file doesn't exist
+    """
+    digest = file_hash(os.path.join(static_folder, filename))
+    if digest is None:
+        return None
+    base, ext = os.path.splitext(filename)
+    return f"{base}.{digest}{ext}"
+
+def split_hashed_name(hashed):
+    """
+    Split a hashed file name back into the real name and the hash.
+    
+    Args:
+        hashed (str): Name produced by hashed_name
+        
+    Returns:
+        tuple: (filename, hash), or (hashed, None) if it carries no hash
+    """
+    base, ext = os.path.splitext(hashed)
+    stem, dot, digest = base.rpartition('.')
+    if not dot or len(digest) != 10:
+        return hashed, None
+    return stem + ext, digest
+
+def gzipped_file(path, level=6):
+    """
+    Get the gzip-compressed content of a static file, compressing it only
+    the first time it is requested or after it changes.
+    
+    Args:
+        path (str): Absolute path of the file
+        level (int): gzip compression level
+        
+    Returns:
+        bytes: Compressed content, or None if the file doesn't exist
+    """
+    try:
+        mtime = os.path.getmtime(path)
+    except OSError:
+        return None
+    
+    with _hash_lock:
+        cached = _gzip_cache.get(path)
+        if cached and cached[0] == mtime:
+            return cached[1]
+    
+    with open(path, 'rb') as f:
+        compressed = gzip.compress(f.read(), compresslevel=level, mtime=0)
+    with _hash_lock:
+        _gzip_cache[path] = (mtime, compressed)
+    return compressed
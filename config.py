@@ -16,23 +16,111 @@ class Config:
     # Server settings
     HOST = os.environ.get('HOST', '0.0.0.0')
     PORT = int(os.environ.get('PORT', 5000))
+    UNIT_NAME = os.environ.get('UNIT_NAME', f"mixer-{PORT}")
+    ASSET_MAX_AGE = 365 * 24 * 3600  # Cache lifetime for content-hashed static files
+    
+    # Response compression settings
+    COMPRESS_MIN_SIZE = 500  # Bytes; smaller responses are sent as-is
+    COMPRESS_LEVEL = 6
+    COMPRESS_MIMETYPES = (
+        'text/html', 'text/css', 'text/plain', 'application/json',
+        'application/javascript', 'text/javascript'
+    )
+    
+    # Drink list settings
+    DRINKS_PAGE_SIZE = 12  # Drink cards rendered with the main page; more load on scroll
+    DRINKS_PAGE_MAX = 100  # Largest page /api/drinks returns
     
     # Security settings
     DEFAULT_PIN = "1234"  # PIN for settings access
     SESSION_LIFETIME = timedelta(hours=1)
     
     # Hardware settings
+    # Pump outputs, the one place the pumps are listed: pump ID -> BCM pin
+    # on the Pi, or 'expander:pin' for a pin (0-15) on a GPIO expander below,
+    # e.g. 16 more pumps on one board: {9: 'x1:0', 10: 'x1:1', ..., 24: 'x1:15'}
     PUMP_GPIO_PINS = {1: 17, 2: 18, 3: 27, 4: 22, 5: 23, 6: 24, 7: 25, 8: 5}
-    PUMP_COUNT = 8
+    # I2C GPIO expanders by name, e.g. {'x1': {'type': 'mcp23017', 'bus': 1, 'address': 0x20}};
+    # type 'simulated' keeps the outputs in memory, for development
+    GPIO_EXPANDERS = {}
+    PUMP_IDS = sorted(PUMP_GPIO_PINS)
+    PUMP_COUNT = len(PUMP_IDS)
+    # Cup stations and the pumps whose nozzles reach each of them. Orders
+    # with no pump in common pour at the same time on different stations,
+    # e.g. {1: [1, 2, 3, 4], 2: [5, 6, 7, 8]}
+    CUP_STATIONS = {1: PUMP_IDS}
+    ORDER_QUEUE_LIMIT = 10  # Orders waiting for a station before new ones are refused
+    # Unix socket of a separate pump controller process (pump_controller.py);
+    # when unset the pumps are driven from inside the web app
+    PUMP_CONTROLLER_SOCKET = os.environ.get('PUMP_CONTROLLER_SOCKET')
+    # Without GPIO, simulated pours run this many times faster (loadtest.py)
+    PUMP_SIMULATION_SPEED = float(os.environ.get('PUMP_SIMULATION_SPEED', 1.0))
+    # Socket.IO server mode, picked from what is installed when unset. Pump
+    # events are emitted from pour threads, which without monkey patching only
+    # reach clients in 'threading' mode (loadtest.py --start uses it)
+    SOCKETIO_ASYNC_MODE = os.environ.get('SOCKETIO_ASYNC_MODE') or None
+    
+    # Admission control settings (admission.py)
+    MIX_RATE_PER_MINUTE = 6  # Orders one client may place per minute, on average
+    MIX_RATE_BURST = 3  # Orders one client may place in quick succession
+    IDEMPOTENCY_TTL_SECONDS = 300  # How long an idempotency key maps to its order
+    DOUBLE_TAP_SECONDS = 3  # The same drink and size from one client this close together is one order
+    QUEUE_FULL_RETRY_SECONDS = 15  # Retry-After for a full queue when no pour has an ETA
+    # Key clients by their X-Client-Id header instead of their address; only
+    # for test rigs (loadtest.py) where many clients share one address
+    TRUST_CLIENT_ID_HEADER = os.environ.get('MIXER_TRUST_CLIENT_ID', '').lower() in ('true', '1')
+    
+    # Fleet coordinator settings (coordinator.py)
+    FLEET_UNITS = [u.strip() for u in os.environ.get('FLEET_UNITS', '').split(',') if u.strip()]
+    FLEET_POLL_INTERVAL_SECONDS = 2.0
+    FLEET_REQUEST_TIMEOUT_SECONDS = 3.0
+    FLEET_ORDER_HISTORY = 500  # Finished orders kept for status lookups
+    FLEET_ORDER_TIMEOUT_SECONDS = 60.0  # Orders on a unit that stopped answering fail after this
     
     # Maintenance settings
     MAINTENANCE_INTERVAL_DAYS = 30
     PUMP_USAGE_THRESHOLD_ML = 5000  # ML of liquid pumped before maintenance recommended
+    MAINTENANCE_HISTORY_LIMIT = 20  # Entries kept per pump before archiving
+    MAINTENANCE_ARCHIVE_SEGMENT_SIZE = 500  # Entries per archive segment file
+    MAINTENANCE_ARCHIVE_SEGMENTS = 20  # Archive segment files retained
+    MAINTENANCE_HISTORY_PAGE_SIZE = 20
+    
+    # Stock forecast settings (depletion.py)
+    STOCK_RATE_WINDOWS = (900, 7200)  # Rolling windows in seconds for hose draw rates
+    LOW_STOCK_SECONDS = 1800  # Alert when a hose will run dry sooner than this
+    LOW_STOCK_DRINKS = 5  # or has this few pours left
+    DEFAULT_DRINK_SIZE_ML = 375  # Size used for per-recipe forecasts
+    
+    # Automated calibration settings
+    CALIBRATION_CYCLE_SECONDS = 10  # Default run time of a calibration cycle
+    CALIBRATION_MAX_SECONDS = 60  # Longest calibration cycle allowed
+    
+    # Calibration reconciliation settings (reconciliation.py)
+    RECONCILE_MIN_VOLUME_ML = 250  # Least volume poured from a bottle before its refill is trusted
+    RECONCILE_DEADBAND = 0.03  # Flow rate drift ignored as measurement noise
+    RECONCILE_MAX_ADJUST = 0.25  # Larger drift flags the pump instead of adjusting it
+    RECONCILE_GAIN = 0.5  # Fraction of the drift corrected per refill
+    
+    # Usage journal settings
+    USAGE_COMPACT_INTERVAL_SECONDS = 300  # How often the usage journal is snapshotted
+    
+    # Usage time series settings (usage_store.py)
+    USAGE_STORE_SYNC_SECONDS = 60  # How often the store catches up with the journal
+    USAGE_RAW_RETENTION_DAYS = 30  # Individual pours kept
+    USAGE_MINUTE_RETENTION_DAYS = 14  # Minute rollups kept; hour rollups below, day rollups forever
+    USAGE_HOUR_RETENTION_DAYS = 400
+    
+    # On-demand profiling settings (profiling.py)
+    PROFILE_SAMPLE_INTERVAL_MS = 5  # Stack sampling interval
+    PROFILE_MAX_REQUESTS = 1000  # Most requests one profiling run may cover
+    PROFILES_KEPT = 20  # Profiling runs kept in logs/profiles
     
     # Path settings
     BASE_DIR = os.path.abspath(os.path.dirname(__file__))
-    DATA_DIR = os.path.join(BASE_DIR, 'data')
-    LOGS_DIR = os.path.join(BASE_DIR, 'logs')
+    # Overridable so several units can run side by side from one checkout
+    DATA_DIR = os.environ.get('MIXER_DATA_DIR') or os.path.join(BASE_DIR, 'data')
+    LOGS_DIR = os.environ.get('MIXER_LOGS_DIR') or os.path.join(BASE_DIR, 'logs')
+    PROFILES_DIR = os.path.join(LOGS_DIR, 'profiles')
     
     # File paths (avoid hardcoding in multiple places)
     @property
@@ -66,10 +154,19 @@ class Config:
     @property
     def MAINTENANCE_LOG_FILE(self):
         return os.path.join(self.DATA_DIR, 'maintenance_log.json')
+        
+    @property
+    def USAGE_JOURNAL_FILE(self):
+        return os.path.join(self.DATA_DIR, 'usage_journal.jsonl')
+    
+    # Logging configuration (applied through logging_pipeline.setup_logging)
+    LOG_MAX_BYTES = 1024 * 1024
+    LOG_BACKUP_COUNT = 5
+    LOG_BUFFER_SIZE = 500  # Recent records kept in memory for /api/logs
     
-    # Logging configuration
     LOGGING_CONFIG = {
         'version': 1,
+        'disable_existing_loggers': False,
         'formatters': {
             'default': {
                 'format': '%(asctime)s - %(levelname)s - %(message)s',
@@ -82,15 +179,22 @@ class Config:
                 'level': logging.INFO,
             },
             'file': {
-                'class': 'logging.FileHandler',
+                'class': 'logging.handlers.RotatingFileHandler',
                 'formatter': 'default',
                 'level': logging.INFO,
                 'filename': os.path.join(LOGS_DIR, 'app.log'),
+                'maxBytes': LOG_MAX_BYTES,
+                'backupCount': LOG_BACKUP_COUNT,
+            },
+            'buffer': {
+                'class': 'logging_pipeline.RingBufferHandler',
+                'level': logging.DEBUG,
+                'capacity': LOG_BUFFER_SIZE,
             },
         },
         'root': {
             'level': logging.INFO,
-            'handlers': ['console', 'file'],
+            'handlers': ['console', 'file', 'buffer'],
         },
     }
 
@@ -0,0 +1,447 @@
+"""
+Fleet coordinator: accepts orders centrally and routes each one to the
+least-loaded mixer unit that can make the drink.
+
+Every unit is a normal app.py instance. The coordinator polls each unit's
+/api/unit_status for its orders, hoses and makeable drinks, and starts
+pours through /api/mix/<drink_id>. A unit is sent up to one order per cup
+station, so its stations pour side by side; the rest wait here, where any
+unit that frees up can take them. To try it locally with simulated GPIO:
+
+    MIXER_DATA_DIR=/tmp/unit1 PORT=5001 python app.py
+    MIXER_DATA_DIR=/tmp/unit2 PORT=5002 python app.py
+    python coordinator.py --port 6000 --unit http://127.0.0.1:5001 --unit http://127.0.0.1:5002
+"""
+import json
+import time
+import uuid
+import logging
+import argparse
+import threading
+import urllib.error
+import urllib.request
+from collections import OrderedDict
+from datetime import datetime
+from flask import Flask, request, jsonify
+
+from config import Config
+
+
+class Unit:
+    """A mixer unit as last seen by the coordinator."""
+    
+    def __init__(self, url):
+        self.url = url.rstrip('/')
+        self.status = None
+        self.etag = None
+        self.online = False
+        self.last_seen = None
+        self.answered_at = time.monotonic()  # Last time the unit answered a request
+        # Orders sent to the unit and not finished: {order_id: monotonic time sent}
+        self.in_flight = OrderedDict()
+        self.resend = set()  # In-flight orders that went unanswered and the unit doesn't list
+        self.orders_dispatched = 0
+    
+    @property
+    def is_mixing(self):
+        return bool(self.status and self.status.get('is_mixing')) or bool(self.in_flight)
+    
+    @property
+    def load(self):
+        """Orders queued or pouring on the unit, including ones it doesn't list yet."""
+        active = {o['order_id'] for o in (self.status or {}).get('orders', []) if o['state'] not in ('done', 'failed')}
+        return len(active | set(self.in_flight))
+    
+    @property
+    def capacity(self):
+        """Orders the unit can pour at once: one per cup station."""
+        return max(1, int((self.status or {}).get('stations') or 1))
+    
+    @property
+    def has_room(self):
+        return not (self.status or {}).get('queue_full') and self.load < self.capacity
+    
+    def can_make(self, drink_id):
+        return self.online and self.status is not None and drink_id in self.status.get('available_drinks', [])
+    
+    def to_dict(self):
+        return {
+            'url': self.url,
+            'name': self.status.get('name') if self.status else None,
+            'online': self.online,
+            'is_mixing': self.is_mixing,
+            'orders': list(self.in_flight),
+            'load': self.load,
+            'capacity': self.capacity,
+            'orders_dispatched': self.orders_dispatched,
+            'available_drinks': self.status.get('available_drinks', []) if self.status else [],
+            'hoses': self.status.get('hoses', {}) if self.status else {},
+            'last_seen': self.last_seen
+        }
+
+
+class Coordinator:
+    """Queue of orders and the units they are routed to."""
+    
+    def __init__(self, unit_urls, poll_interval=2.0, timeout=3.0, history=500, order_timeout=60.0):
+        """
+        Args:
+            unit_urls (list): Base URLs of the mixer units
+            poll_interval (float): Seconds between status polls
+            timeout (float): Seconds to wait for a unit's answer
+            history (int): Finished orders kept for status lookups
+            order_timeout (float): An order sent to a unit fails when the unit
+                                   hasn't answered for this long since
+        """
+        self.units = [Unit(url) for url in unit_urls]
+        self.poll_interval = poll_interval
+        self.timeout = timeout
+        self.history = history
+        self.order_timeout = order_timeout
+        self.orders = OrderedDict()  # {order_id: order dict}, oldest first
+        self.pending = []  # Order IDs waiting for a free unit, oldest first
+        self.lock = threading.RLock()
+        self._thread = None
+    
+    # ---------- Unit communication ----------
+    
+    def _request(self, unit, path, payload=None, etag=None):
+        """Call a unit's API. Returns (status_code, json body or None, ETag)."""
+        headers = {'Accept': 'application/json'}
+        data = None
+        if payload is not None:
+            data = json.dumps(payload).encode('utf-8')
+            headers['Content-Type'] = 'application/json'
+        if etag:
+            headers['If-None-Match'] = etag
+        req = urllib.request.Request(unit.url + path, data=data, headers=headers,
+                                     method='POST' if payload is not None else 'GET')
+        try:
+            with urllib.request.urlopen(req, timeout=self.timeout) as resp:
+                body = resp.read()
+                return resp.status, json.loads(body) if body else None, resp.headers.get('ETag')
+        except urllib.error.HTTPError as e:
+            if e.code == 304:
+                return 304, None, etag
+            body = e.read()
+            try:
+                return e.code, json.loads(body) if body else None, None
+            except ValueError:
+                return e.code, None, None
+    
+    def refresh_unit(self, unit):
+        """Fetch a unit's status; an unchanged status costs the unit a 304."""
+        requested_at = time.monotonic()
+        try:
+            code, body, etag = self._request(unit, '/api/unit_status', etag=unit.etag)
+        except (OSError, ValueError) as e:
+            if unit.online:
+                logging.warning(f"Unit {unit.url} went offline: {e}")
+            unit.online = False
+            return
+        
+        with self.lock:
+            if code == 200:
+                unit.status, unit.etag = body, etag
+            elif code != 304:
+                unit.online = False
+                return
+            unit.online = True
+            unit.last_seen = datetime.now().isoformat()
+            unit.answered_at = time.monotonic()
+            
+            # Follow each order by its own state on the unit, not the unit's
+            # busy flag: a unit queues several orders
+            states = {o['order_id']: o for o in unit.status.get('orders', [])}
+            for order_id, sent_at in list(unit.in_flight.items()):
+                order = self.orders[order_id]
+                if order['status'] not in ('dispatched', 'unknown'):
+                    # A dispatch still in flight
+                    continue
+                state = states.get(order_id)
+                if state is not None:
+                    if state['state'] in ('done', 'failed'):
+                        self._finish(order, unit, state['state'], state['error'])
+                    else:
+                        order['status'] = 'dispatched'
+                elif requested_at > sent_at:
+                    if order['status'] == 'unknown':
+                        # The unit never got the order; send it there again
+                        unit.resend.add(order_id)
+                    else:
+                        self._finish(order, unit, 'failed', 'The unit lost the order')
+    
+    def expire_orders(self):
+        """
+        Fail orders whose unit stopped answering, so they don't hold its
+        place forever. The drink may or may not have poured.
+        """
+        now = time.monotonic()
+        with self.lock:
+            for unit in self.units:
+                if now - unit.answered_at <= self.order_timeout:
+                    continue
+                for order_id, sent_at in list(unit.in_flight.items()):
+                    order = self.orders[order_id]
+                    if order['status'] in ('dispatched', 'unknown') and now - sent_at > self.order_timeout:
+                        logging.warning(f"Order {order_id} timed out on {unit.url}, which stopped answering")
+                        self._finish(order, unit, 'failed',
+                                     f"Unit {unit.url} stopped answering; the drink may not have been poured")
+    
+    def _finish(self, order, unit, status, error=None):
+        """Record an order's outcome and free its place on the unit. Call with the lock held."""
+        order['status'] = status
+        order['error'] = error
+        order['finished_at'] = datetime.now().isoformat()
+        unit.in_flight.pop(order['order_id'], None)
+        unit.resend.discard(order['order_id'])
+    
+    # ---------- Orders ----------
+    
+    def submit(self, drink_id, size):
+        """
+        Accept an order. It is dispatched at once if a capable unit is idle,
+        queued if all capable units are busy, and rejected if none can make it.
+        
+        Returns:
+            dict: The order
+        """
+        order = {
+            'order_id': uuid.uuid4().hex,
+            'drink_id': drink_id,
+            'size': size,
+            'status': 'queued',
+            'unit': None,
+            'error': None,
+            'created_at': datetime.now().isoformat(),
+            'finished_at': None
+        }
+        with self.lock:
+            if not any(u.can_make(drink_id) for u in self.units):
+                order['status'] = 'rejected'
+                order['error'] = 'No unit can make this drink'
+            else:
+                self.pending.append(order['order_id'])
+            self._remember(order)
+        self.dispatch_pending()
+        with self.lock:
+            return dict(order)
+    
+    def _remember(self, order):
+        self.orders[order['order_id']] = order
+        # Drop the oldest finished orders; open ones are kept wherever they are
+        excess = len(self.orders) - self.history
+        for order_id in list(self.orders):
+            if excess <= 0:
+                break
+            if self.orders[order_id]['status'] not in ('queued', 'sending', 'dispatched', 'unknown'):
+                del self.orders[order_id]
+                excess -= 1
+    
+    def _choose_unit(self, drink_id, exclude=()):
+        """Unit with a free cup station that can make the drink and has the fewest orders, or None."""
+        candidates = [u for u in self.units
+                      if u.can_make(drink_id) and u.has_room and u not in exclude]
+        if not candidates:
+            return None
+        return min(candidates, key=lambda u: (u.load, u.orders_dispatched))
+    
+    def dispatch_pending(self):
+        """
+        Send queued orders, oldest first, to units with room that can make them.
+        
+        The HTTP calls are made outside the lock; meanwhile the order and
+        its unit are marked 'sending', so no other caller picks them.
+        """
+        declined = {}  # Order ID -> units that declined it in this call
+        while True:
+            claims = self._claim_dispatches(declined)
+            if not claims:
+                return
+            for order, unit in claims:
+                if not self._dispatch(order, unit):
+                    declined.setdefault(order['order_id'], []).append(unit)
+    
+    def _claim_dispatches(self, declined):
+        """Pair pending orders with units and mark them 'sending'. Returns [(order, unit)]."""
+        claims = []
+        with self.lock:
+            # An order whose dispatch went unanswered only ever goes back to
+            # the same unit with the same ID, which the unit deduplicates
+            for unit in self.units:
+                if not unit.online:
+                    continue
+                for order_id in unit.resend:
+                    order = self.orders[order_id]
+                    order['status'] = 'sending'
+                    claims.append((order, unit))
+                unit.resend.clear()
+            
+            for order_id in list(self.pending):
+                order = self.orders[order_id]
+                if not any(u.can_make(order['drink_id']) for u in self.units):
+                    # Stock ran out everywhere while the order was waiting
+                    order['status'] = 'rejected'
+                    order['error'] = 'No unit can make this drink'
+                    self.pending.remove(order_id)
+                    continue
+                
+                unit = self._choose_unit(order['drink_id'], exclude=declined.get(order_id, ()))
+                if unit is None:
+                    continue
+                order['status'] = 'sending'
+                unit.in_flight[order_id] = time.monotonic()
+                self.pending.remove(order_id)
+                claims.append((order, unit))
+        return claims
+    
+    def _dispatch(self, order, unit):
+        """Start a claimed order on a unit. Returns True unless the unit declined it."""
+        resend = order['unit'] == unit.url
+        try:
+            code, body, _ = self._request(unit, f"/api/mix/{order['drink_id']}",
+                                          payload={'size': order['size'], 'order_id': order['order_id']})
+        except (OSError, ValueError) as e:
+            logging.warning(f"Dispatch of order {order['order_id']} to {unit.url} failed: {e}")
+            code, body = None, None
+        
+        with self.lock:
+            unit.etag = None  # Force a full status refresh on the next poll
+            if code is None:
+                # The unit may have placed the order before the call failed;
+                # its status tells once it answers again
+                order['status'] = 'unknown'
+                order['unit'] = unit.url
+                unit.online = False
+                unit.in_flight[order['order_id']] = time.monotonic()
+                if not resend:
+                    unit.orders_dispatched += 1
+                return True
+            
+            if code == 202:
+                order['status'] = 'dispatched'
+                order['unit'] = unit.url
+                unit.answered_at = unit.in_flight[order['order_id']] = time.monotonic()
+                if not resend:
+                    unit.orders_dispatched += 1
+                logging.info(f"Order {order['order_id']} (drink {order['drink_id']}) sent to {unit.url}")
+                return True
+            
+            logging.info(f"Unit {unit.url} declined order {order['order_id']}: {code} {body}")
+            unit.answered_at = time.monotonic()
+            if code in (409, 429) and unit.status:
+                # Full until its next status says otherwise
+                unit.status['queue_full'] = True
+            elif code in (404, 422) and unit.status:
+                unit.status['available_drinks'] = [d for d in unit.status.get('available_drinks', [])
+                                                   if d != order['drink_id']]
+            
+            if resend and code in (409, 429):
+                # Busy, perhaps still placing the first attempt; ask again later
+                order['status'] = 'unknown'
+                unit.in_flight[order['order_id']] = time.monotonic()
+                return True
+            if resend:
+                self._finish(order, unit, 'failed',
+                             (body or {}).get('error') or f"Unit declined the order ({code})")
+                return True
+            
+            # Declined outright: back in line, in arrival order, for another unit
+            unit.in_flight.pop(order['order_id'], None)
+            order['status'] = 'queued'
+            self.pending.append(order['order_id'])
+            position = {order_id: i for i, order_id in enumerate(self.orders)}
+            self.pending.sort(key=position.get)
+            return False
+    
+    def get_order(self, order_id):
+        with self.lock:
+            order = self.orders.get(order_id)
+            return dict(order) if order else None
+    
+    # ---------- Background polling ----------
+    
+    def poll_once(self):
+        for unit in self.units:
+            self.refresh_unit(unit)
+        self.expire_orders()
+        self.dispatch_pending()
+    
+    def start(self):
+        """Poll units once, then keep polling and dispatching in the background."""
+        self.poll_once()
+        
+        def poller():
+            while True:
+                time.sleep(self.poll_interval)
+                try:
+                    self.poll_once()
+                except Exception:
+                    logging.error("Error polling fleet units", exc_info=True)
+        
+        self._thread = threading.Thread(target=poller, name="fleet-poller", daemon=True)
+        self._thread.start()
+
+
+def create_app(coordinator):
+    """Create the coordinator's HTTP API."""
+    app = Flask(__name__)
+    
+    @app.route('/api/orders', methods=['POST'])
+    def submit_order():
+        """Accept an order and route it to a unit."""
+        data = request.get_json(silent=True) or request.form
+        try:
+            drink_id = int(data.get('drink_id'))
+            size = float(data.get('size', 375))
+        except (TypeError, ValueError):
+            return jsonify({'error': 'drink_id and size must be numbers'}), 400
+        
+        order = coordinator.submit(drink_id, size)
+        return jsonify(order), 409 if order['status'] == 'rejected' else 202
+    
+    @app.route('/api/orders')
+    def list_orders():
+        """List recent orders, newest first."""
+        with coordinator.lock:
+            orders = [dict(o) for o in reversed(coordinator.orders.values())]
+        return jsonify({'orders': orders, 'pending': len(coordinator.pending)})
+    
+    @app.route('/api/orders/<order_id>')
+    def get_order(order_id):
+        """Get the status of one order."""
+        order = coordinator.get_order(order_id)
+        if order is None:
+            return jsonify({'error': 'Order not found'}), 404
+        return jsonify(order)
+    
+    @app.route('/api/units')
+    def list_units():
+        """List the units with their last known state."""
+        with coordinator.lock:
+            return jsonify({'units': [u.to_dict() for u in coordinator.units]})
+    
+    return app
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Route drink orders across several mixer units")
+    parser.add_argument('--unit', action='append', default=[], help="Base URL of a mixer unit (repeatable)")
+    parser.add_argument('--host', default=Config.HOST)
+    parser.add_argument('--port', type=int, default=6000)
+    args = parser.parse_args()
+    
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    units = args.unit or Config.FLEET_UNITS
+    if not units:
+        parser.error("no units given; use --unit or set FLEET_UNITS")
+    
+    coordinator = Coordinator(
+        units,
+        poll_interval=Config.FLEET_POLL_INTERVAL_SECONDS,
+        timeout=Config.FLEET_REQUEST_TIMEOUT_SECONDS,
+        history=Config.FLEET_ORDER_HISTORY,
+        order_timeout=Config.FLEET_ORDER_TIMEOUT_SECONDS
+    )
+    coordinator.start()
+    create_app(coordinator).run(host=args.host, port=args.port, threaded=True)
@@ -0,0 +1,193 @@
+"""
+Stock depletion forecasts per hose and per recipe.
+
+Each hose's draw rate comes from the usage journal over rolling windows:
+a short one that catches a rush at peak and a long one for steady trade.
+The higher of the two is used, so a busy half hour isn't averaged away by a
+quiet afternoon. From the rate and the bottle level follow the time until
+the hose runs dry and, with the hose's recent pour sizes, the drinks left.
+"""
+import time
+import threading
+from collections import deque
+from datetime import datetime
+
+from utils import read_usage_journal
+
+# Recent pours per hose used for the average pour size
+POUR_SIZE_SAMPLES = 50
+
+
+class DepletionForecaster:
+    """Predict when hoses run dry from recent dispense rates."""
+    
+    def __init__(self, windows=(900, 7200), low_stock_seconds=1800, low_stock_drinks=5):
+        """
+        Args:
+            windows (tuple): Rolling window lengths in seconds
+            low_stock_seconds (float): Alert when a hose is predicted to run
+                                       dry sooner than this
+            low_stock_drinks (int): Alert when a hose has this few pours left
+        """
+        self.windows = tuple(sorted(windows))
+        self.low_stock_seconds = low_stock_seconds
+        self.low_stock_drinks = low_stock_drinks
+        self.lock = threading.Lock()
+        self.journal_offset = 0
+        
+        self.dispenses = {}   # pump ID -> deque of (epoch seconds, ml) within the longest window
+        self.pour_sizes = {}  # pump ID -> deque of recent pour volumes in ml
+        self.alerted = set()  # Pumps with a low stock alert out, until they recover
+    
+    def sync(self):
+        """Fold dispenses journaled since the last sync into the windows."""
+        with self.lock:
+            events, self.journal_offset = read_usage_journal(self.journal_offset)
+            for event in events:
+                if event.get('cancelled'):
+                    continue
+                try:
+                    ts = datetime.fromisoformat(event['ts']).timestamp()
+                    pump_id = int(event['pump'])
+                    ml = float(event['ml'])
+                except (KeyError, TypeError, ValueError):
+                    continue
+                self.dispenses.setdefault(pump_id, deque()).append((ts, ml))
+                self.pour_sizes.setdefault(pump_id, deque(maxlen=POUR_SIZE_SAMPLES)).append(ml)
+            
+            horizon = time.time() - self.windows[-1]
+            for dispenses in self.dispenses.values():
+                while dispenses and dispenses[0][0] < horizon:
+                    dispenses.popleft()
+    
+    def _rate(self, pump_id, now):
+        """Draw rate of a hose in ml/s: the highest over the windows."""
+        dispenses = self.dispenses.get(pump_id)
+        if not dispenses:
+            return 0.0
+        rate = 0.0
+        for window in self.windows:
+            start = now - window
+            volume = 0.0
+            for ts, ml in reversed(dispenses):
+                if ts < start:
+                    break
+                volume += ml
+            rate = max(rate, volume / window)
+        return rate
+    
+    def hose_forecast(self, volumes, now=None):
+        """
+        Forecast every hose that has a bottle.
+        
+        Args:
+            volumes (dict): Hose ID to BottleVolume
+            now (float): Current time.time()
+        
+        Returns:
+            dict: Hose ID to ml_per_hour, empty_in_seconds (None while the
+                  hose isn't being drawn from) and drinks_left (None until
+                  it has poured)
+        """
+        self.sync()
+        now = now or time.time()
+        forecast = {}
+        with self.lock:
+            for hose_id, bottle in volumes.items():
+                rate = self._rate(hose_id, now)
+                sizes = self.pour_sizes.get(hose_id)
+                average_pour = sum(sizes) / len(sizes) if sizes else None
+                remaining = bottle.remaining_volume_ml
+                forecast[hose_id] = {
+                    'ml_per_hour': round(rate * 3600, 1),
+                    'empty_in_seconds': round(remaining / rate) if rate > 0 else None,
+                    'drinks_left': int(remaining // average_pour) if average_pour else None
+                }
+        return forecast
+    
+    def recipe_forecast(self, recipes, pumps_by_ingredient, volumes, size_ml, hose_forecast=None):
+        """
+        Forecast how many of each recipe can still be poured.
+        
+        Args:
+            recipes (list): Recipes to forecast
+            pumps_by_ingredient (dict): Ingredient ID to pump ID
+            volumes (dict): Hose ID to BottleVolume
+            size_ml (float): Drink size
+            hose_forecast (dict): Result of hose_forecast, if already at hand
+        
+        Returns:
+            list: drink_id, drink_name, drinks_left, the ingredient that runs
+                  out first, and empty_in_seconds of the first hose to run
+                  dry; fewest drinks left first. Recipes with an ingredient
+                  not on a hose are left out.
+        """
+        if hose_forecast is None:
+            hose_forecast = self.hose_forecast(volumes)
+        
+        result = []
+        for recipe in recipes:
+            drinks_left = None
+            limited_by = None
+            empty_in = []
+            for name, ingredient_id, percentage in zip(recipe.ingredient_names, recipe.ingredient_ids,
+                                                       recipe.percentages):
+                pump_id = pumps_by_ingredient.get(ingredient_id)
+                if pump_id is None:
+                    break
+                needed = size_ml * percentage / 100.0
+                if needed <= 0:
+                    continue
+                bottle = volumes.get(pump_id)
+                left = int(bottle.remaining_volume_ml // needed) if bottle else 0
+                if drinks_left is None or left < drinks_left:
+                    drinks_left, limited_by = left, name
+                hose = hose_forecast.get(pump_id)
+                if hose and hose['empty_in_seconds'] is not None:
+                    empty_in.append(hose['empty_in_seconds'])
+            else:
+                if drinks_left is not None:
+                    result.append({
+                        'drink_id': recipe.drink_id,
+                        'drink_name': recipe.drink_name,
+                        'drinks_left': drinks_left,
+                        'limited_by': limited_by,
+                        'empty_in_seconds': min(empty_in) if empty_in else None
+                    })
+        result.sort(key=lambda r: (r['drinks_left'], r['drink_name'].lower()))
+        return result
+    
+    def low_stock_alerts(self, volumes, assignments, hose_forecast=None):
+        """
+        Hoses that just became low on stock.
+        
+        A hose is alerted once, and again only after it was refilled or
+        its forecast recovered.
+        
+        Args:
+            volumes (dict): Hose ID to BottleVolume
+            assignments (dict): Hose ID to ingredient name
+            hose_forecast (dict): Result of hose_forecast, if already at hand
+        
+        Returns:
+            list: New alerts with hose, ingredient, remaining ml and forecast
+        """
+        if hose_forecast is None:
+            hose_forecast = self.hose_forecast(volumes)
+        
+        alerts = []
+        with self.lock:
+            for hose_id, forecast in hose_forecast.items():
+                empty_in = forecast['empty_in_seconds']
+                drinks_left = forecast['drinks_left']
+                low = ((empty_in is not None and empty_in <= self.low_stock_seconds)
+                       or (drinks_left is not None and drinks_left <= self.low_stock_drinks))
+                if not low:
+                    self.alerted.discard(hose_id)
+                    continue
+                if hose_id in self.alerted:
+                    continue
+                self.alerted.add(hose_id)
+                alerts.append(dict(forecast, hose=hose_id, ingredient=assignments.get(hose_id, ''),
+                                   remaining=volumes[hose_id].remaining_volume_ml))
+        return alerts
@@ -0,0 +1,188 @@
+"""
+Pour time estimates for orders and the order queue.
+
+An order's pour plan is one step per ingredient: the planned pump run time
+(volume / calibrated flow rate) plus the pause between ingredients. Each step
+is scaled by how long that pump has actually run compared to its plan in past
+pours, and the pause is learned from how long whole orders took, so the
+estimates follow the machine rather than the calibration sheet.
+"""
+
+import logging
+import threading
+
+from utils import recipe_ingredients, fold_run_ratio, RUN_RATIO_SMOOTHING
+
+
+class PourEstimator:
+    """
+    Predict pour durations from calibrations and observed pump run times.
+    
+    Also keeps the error of its own order predictions, so how far off the
+    ETAs are can be watched over time.
+    """
+    
+    def __init__(self, step_gap_seconds=0.5, smoothing=RUN_RATIO_SMOOTHING):
+        self.smoothing = smoothing
+        self.lock = threading.Lock()
+        
+        # Observed / planned run time per pump, as a moving average
+        self.pump_ratios = {}
+        # Time per step on top of the pump run: the pause and file writes
+        self.step_overhead = step_gap_seconds
+        
+        # Prediction error of finished orders, in seconds
+        self.error_count = 0
+        self.error_abs_total = 0.0
+        self.error_total = 0.0
+        self.last_error = None
+    
+    def _smooth(self, old, new):
+        return new if old is None else old + self.smoothing * (new - old)
+    
+    def load_history(self, ratios):
+        """
+        Start from the pump run ratios learned from past pours.
+        
+        Args:
+            ratios (dict): Run ratio by pump ID, as kept with the usage
+                           statistics (utils.get_pump_run_ratios)
+        """
+        with self.lock:
+            self.pump_ratios.update(ratios)
+    
+    def observe_dispense(self, pump_id, planned_seconds, actual_seconds):
+        """Update a pump's run ratio from one dispense."""
+        if not pump_id:
+            return
+        with self.lock:
+            ratio = fold_run_ratio(self.pump_ratios.get(pump_id), planned_seconds, actual_seconds, self.smoothing)
+            if ratio is not None:
+                self.pump_ratios[pump_id] = ratio
+    
+    def plan(self, recipe, total_volume, pumps_by_ingredient, calibrations):
+        """
+        Build the pour plan of a recipe.
+        
+        Args:
+            recipe (dict): Recipe with 'ingredients' percentages
+            total_volume (float): Drink size in ml
+            pumps_by_ingredient (dict): Ingredient ID to pump ID
+            calibrations (dict): Pump ID to flow rate in ml/s
+        
+        Returns:
+            list: (pump_id, planned_seconds) per ingredient; pump_id is None
+                  for ingredients that aren't assigned to a pump
+        """
+        steps = []
+        for _, ingredient_id, percentage in recipe_ingredients(recipe):
+            pump_id = pumps_by_ingredient.get(ingredient_id)
+            if not pump_id:
+                steps.append((None, 0.0))
+                continue
+            required_volume = total_volume * (percentage / 100.0)
+            steps.append((pump_id, required_volume / calibrations.get(pump_id, 10.0)))
+        return steps
+    
+    def step_seconds(self, step):
+        """Predicted duration of one plan step."""
+        pump_id, planned_seconds = step
+        if pump_id is None:
+            return 0.0
+        with self.lock:
+            return planned_seconds * self.pump_ratios.get(pump_id, 1.0) + self.step_overhead
+    
+    def estimate(self, steps):
+        """Predicted duration in seconds of a whole pour plan."""
+        return sum(self.step_seconds(step) for step in steps)
+    
+    def record_order(self, steps, predicted_seconds, actual_seconds, pump_seconds):
+        """
+        Learn from a finished order and track the prediction error.
+        
+        Args:
+            steps (list): The order's pour plan
+            predicted_seconds (float): Duration predicted when it started
+            actual_seconds (float): Measured duration of the whole order
+            pump_seconds (float): Time the pumps were actually running
+        """
+        poured_steps = sum(1 for pump_id, _ in steps if pump_id is not None)
+        error = actual_seconds - predicted_seconds
+        with self.lock:
+            if poured_steps:
+                overhead = max(0.0, (actual_seconds - pump_seconds) / poured_steps)
+                self.step_overhead = self._smooth(self.step_overhead, overhead)
+            self.error_count += 1
+            self.error_abs_total += abs(error)
+            self.error_total += error
+            self.last_error = error
+        logging.info(f"Pour took {actual_seconds:.1f}s, predicted {predicted_seconds:.1f}s")
+    
+    def metrics(self):
+        """
+        Get the ETA prediction error.
+        
+        Returns:
+            dict: Number of orders measured, mean absolute error and mean
+                  error (positive when pours run late), and the last error
+        """
+        with self.lock:
+            count = self.error_count
+            return {
+                'orders': count,
+                'mean_abs_error_seconds': round(self.error_abs_total / count, 2) if count else None,
+                'mean_error_seconds': round(self.error_total / count, 2) if count else None,
+                'last_error_seconds': round(self.last_error, 2) if self.last_error is not None else None
+            }
+
+
+def forecast(orders, stations, now):
+    """
+    Predict when each queued or pouring order will start and finish.
+    
+    Replays the controller's scheduling: orders start in arrival order on the
+    first cup station that reaches their pumps, once those pumps are free.
+    
+    Args:
+        orders (list): Order dicts in arrival order, each with 'state',
+                       'pumps', 'estimate' and, when pouring, 'started_at'
+                       and 'station'
+        stations (dict): Station ID to the set of pumps it reaches
+        now (float): Current time.monotonic()
+    
+    Returns:
+        dict: Order ID to (seconds until it starts, seconds until it is done)
+    """
+    pump_free = {}
+    station_free = {}
+    result = {}
+    
+    for order in orders:
+        if order['state'] != 'pouring':
+            continue
+        elapsed = now - order['started_at']
+        # An order running over its estimate is assumed to be nearly done
+        done = now + max(order['estimate'] - elapsed, 0.5)
+        for pump_id in order['pumps']:
+            pump_free[pump_id] = done
+        station_free[order['station']] = done
+        result[order['order_id']] = (0.0, done - now)
+    
+    for order in orders:
+        if order['state'] != 'queued':
+            continue
+        ready = max([now] + [pump_free.get(pump_id, now) for pump_id in order['pumps']])
+        candidates = [max(ready, station_free.get(sid, now)) for sid, station_pumps in sorted(stations.items())
+                      if order['pumps'] <= station_pumps]
+        if not candidates:
+            continue
+        start = min(candidates)
+        station = next(sid for sid, station_pumps in sorted(stations.items())
+                       if order['pumps'] <= station_pumps and max(ready, station_free.get(sid, now)) == start)
+        done = start + order['estimate']
+        for pump_id in order['pumps']:
+            pump_free[pump_id] = done
+        station_free[station] = done
+        result[order['order_id']] = (start - now, done - now)
+    
+    return result
@@ -0,0 +1,504 @@
+"""
+Load generator for the mixer: many tablets browsing and ordering at once.
+
+Each simulated tablet loads the main page and polls /api/hose_status the
+way the kiosk does, while orders arrive by a chosen pattern and are placed
+through /mix/<drink_id>. Socket.IO clients listen for the mixing events,
+which is also how orders are followed to completion. At the end it reports
+throughput, latency percentiles and error rates per endpoint, and what
+became of every order: poured, failed, refused (queue full, rate limited
+or drink not available) or dropped (accepted but never finished).
+
+Against a unit that is already running:
+
+    python loadtest.py --url http://127.0.0.1:5000 --pattern burst --tablets 30
+
+Or let it start one on a copy of the data, with simulated pumps 20x faster:
+
+    python loadtest.py --start --speed 20 --pattern last-call --duration 120 --rate 0.5
+
+Arrival patterns:
+    steady     orders arrive at random at --rate per second
+    burst      --burst-size orders at once, every --burst-interval seconds
+    last-call  --rate for most of the run, then --last-call-factor times
+               that over the final --last-call-share of it
+"""
+import os
+import re
+import sys
+import json
+import time
+import uuid
+import random
+import shutil
+import socket
+import argparse
+import tempfile
+import threading
+import subprocess
+import urllib.error
+import urllib.parse
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+from config import Config
+
+try:
+    import socketio
+except ImportError:
+    # Without the Socket.IO client, orders can be placed but not followed
+    socketio = None
+
+PATTERNS = ('steady', 'burst', 'last-call')
+
+
+# -------------------- Arrival patterns --------------------
+
+def arrival_times(pattern, duration, rate=1.0, burst_size=30, burst_interval=60.0,
+                  last_call_share=0.2, last_call_factor=5.0, rng=random):
+    """
+    Times in seconds from the start at which orders arrive.
+    
+    Args:
+        pattern (str): 'steady', 'burst' or 'last-call'
+        duration (float): Length of the run
+        rate (float): Orders per second ('steady' and 'last-call')
+        burst_size (int): Orders per burst
+        burst_interval (float): Seconds between bursts
+        last_call_share (float): Final fraction of the run at the last call rate
+        last_call_factor (float): Last call rate as a multiple of rate
+        rng: Random number source
+    
+    Returns:
+        list: Sorted arrival times
+    """
+    if pattern not in PATTERNS:
+        raise ValueError(f"Unknown arrival pattern: {pattern}")
+    
+    if pattern == 'burst':
+        times = []
+        start = 0.0
+        while start < duration:
+            # Everyone taps within a second of each other
+            times.extend(start + rng.random() for _ in range(burst_size))
+            start += burst_interval
+        return sorted(times)
+    
+    last_call_start = duration * (1.0 - last_call_share) if pattern == 'last-call' else duration
+    times = []
+    t = 0.0
+    while True:
+        current_rate = rate if t < last_call_start else rate * last_call_factor
+        t += rng.expovariate(current_rate)
+        if t >= duration:
+            return times
+        times.append(t)
+
+
+# -------------------- Measurements --------------------
+
+def percentile(sorted_values, p):
+    """Nearest-rank percentile of sorted values, None if there are none."""
+    if not sorted_values:
+        return None
+    index = max(0, min(len(sorted_values) - 1, int(round(p / 100.0 * len(sorted_values))) - 1))
+    return sorted_values[index]
+
+
+class Recorder:
+    """Collects request timings and order outcomes from all client threads."""
+    
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.requests = {}  # endpoint -> list of (seconds, ok)
+        self.orders = {}    # order ID -> {'accepted_at', 'finished_at', 'outcome'}
+        self.refused = 0
+        self.order_errors = 0
+        self.schedule_lag = []
+        self.events = {}    # event name -> count, summed over socket clients
+        self.socket_errors = 0
+    
+    def request(self, endpoint, seconds, ok):
+        with self.lock:
+            self.requests.setdefault(endpoint, []).append((seconds, ok))
+    
+    def order_accepted(self, order_id):
+        with self.lock:
+            self.orders.setdefault(order_id, {'outcome': None, 'finished_at': None})['accepted_at'] = time.monotonic()
+    
+    def order_event(self, event, data):
+        with self.lock:
+            self.events[event] = self.events.get(event, 0) + 1
+            order_id = (data or {}).get('order_id') if isinstance(data, dict) else None
+            if not order_id or event not in ('mixing_error', 'mixing_complete'):
+                return
+            order = self.orders.setdefault(order_id, {'accepted_at': None, 'outcome': None, 'finished_at': None})
+            if order['outcome'] is not None:
+                # Every socket client hears every event; the first one counts
+                return
+            # The controller sends mixing_complete after mixing_error too
+            order['outcome'] = 'failed' if event == 'mixing_error' else 'poured'
+            order['finished_at'] = time.monotonic()
+    
+    def open_orders(self):
+        with self.lock:
+            return sum(1 for o in self.orders.values() if o.get('accepted_at') and o['outcome'] is None)
+    
+    def report(self, elapsed, tracking):
+        """
+        Summarize the run.
+        
+        Args:
+            elapsed (float): Length of the run in seconds
+            tracking (bool): Whether orders were followed over Socket.IO
+        
+        Returns:
+            dict: Per endpoint and order statistics
+        """
+        def millis(value):
+            return round(value * 1000, 1) if value is not None else None
+        
+        with self.lock:
+            endpoints = {}
+            for endpoint, samples in sorted(self.requests.items()):
+                durations = sorted(seconds for seconds, _ in samples)
+                errors = sum(1 for _, ok in samples if not ok)
+                endpoints[endpoint] = {
+                    'requests': len(samples),
+                    'per_second': round(len(samples) / elapsed, 2),
+                    'error_rate': round(errors / len(samples), 4),
+                    'p50_ms': millis(percentile(durations, 50)),
+                    'p95_ms': millis(percentile(durations, 95)),
+                    'p99_ms': millis(percentile(durations, 99)),
+                    'max_ms': millis(durations[-1])
+                }
+            
+            accepted = [o for o in self.orders.values() if o.get('accepted_at')]
+            poured = [o for o in accepted if o['outcome'] == 'poured']
+            order_seconds = sorted(o['finished_at'] - o['accepted_at'] for o in poured)
+            lag = sorted(self.schedule_lag)
+            orders = {
+                'submitted': len(accepted) + self.refused + self.order_errors,
+                'accepted': len(accepted),
+                'refused': self.refused,
+                'request_errors': self.order_errors,
+                'poured': len(poured) if tracking else None,
+                'failed': sum(1 for o in accepted if o['outcome'] == 'failed') if tracking else None,
+                'dropped': sum(1 for o in accepted if o['outcome'] is None) if tracking else None,
+                'poured_per_minute': round(len(poured) * 60 / elapsed, 2) if tracking else None,
+                'order_p50_s': round(percentile(order_seconds, 50), 2) if order_seconds else None,
+                'order_p95_s': round(percentile(order_seconds, 95), 2) if order_seconds else None,
+                'order_max_s': round(order_seconds[-1], 2) if order_seconds else None,
+                'schedule_lag_p95_ms': millis(percentile(lag, 95))
+            }
+            return {
+                'elapsed_seconds': round(elapsed, 1),
+                'endpoints': endpoints,
+                'orders': orders,
+                'socket_events': dict(self.events),
+                'socket_errors': self.socket_errors
+            }
+
+
+# -------------------- Clients --------------------
+
+class _NoRedirect(urllib.request.HTTPRedirectHandler):
+    """Hand redirects back to the caller; where /mix redirects to is the answer."""
+    
+    def redirect_request(self, req, fp, code, msg, headers, newurl):
+        return None
+
+
+class Tablet:
+    """One kiosk tablet: HTTP only, like the browser on it."""
+    
+    def __init__(self, base_url, recorder, timeout=10.0, client_id=None):
+        """
+        Args:
+            base_url (str): Unit to test
+            recorder (Recorder): Where timings and outcomes go
+            timeout (float): Request timeout in seconds
+            client_id (str): Sent as X-Client-Id, which a unit started with
+                             --start keys rate limits on; all tablets share
+                             one address
+        """
+        self.base_url = base_url.rstrip('/')
+        self.recorder = recorder
+        self.timeout = timeout
+        self.client_id = client_id or uuid.uuid4().hex[:8]
+        self.opener = urllib.request.build_opener(_NoRedirect)
+        self.etags = {}
+    
+    def get(self, path, endpoint=None, conditional=False):
+        """GET a page, timing it; with conditional, revalidate like a browser cache."""
+        headers = {'X-Client-Id': self.client_id}
+        if conditional and path in self.etags:
+            headers['If-None-Match'] = self.etags[path]
+        req = urllib.request.Request(self.base_url + path, headers=headers)
+        started = time.monotonic()
+        ok = True
+        try:
+            with self.opener.open(req, timeout=self.timeout) as resp:
+                resp.read()
+                if resp.headers.get('ETag'):
+                    self.etags[path] = resp.headers['ETag']
+        except urllib.error.HTTPError as e:
+            ok = e.code == 304
+        except OSError:
+            ok = False
+        self.recorder.request(endpoint or path, time.monotonic() - started, ok)
+    
+    def order(self, drink_id, size):
+        """Place an order through the kiosk form, timing it and recording the outcome."""
+        # A key per order, as the kiosk page sends one per page view
+        data = urllib.parse.urlencode({'size': size, 'idempotency_key': uuid.uuid4().hex}).encode()
+        req = urllib.request.Request(f"{self.base_url}/mix/{drink_id}", data=data, method='POST',
+                                     headers={'X-Client-Id': self.client_id})
+        started = time.monotonic()
+        location = None
+        ok = True
+        refused = False
+        try:
+            with self.opener.open(req, timeout=self.timeout) as resp:
+                resp.read()
+                location = resp.headers.get('Location')
+        except urllib.error.HTTPError as e:
+            location = e.headers.get('Location') if 300 <= e.code < 400 else None
+            # 429 is the unit declining: queue full or the tablet over its rate
+            refused = e.code == 429
+            ok = location is not None or refused
+        except OSError:
+            ok = False
+        self.recorder.request('POST /mix/<id>', time.monotonic() - started, ok)
+        
+        match = re.search(r'[?&]order=([^&]+)', location or '')
+        with self.recorder.lock:
+            if not ok:
+                self.recorder.order_errors += 1
+            elif refused or not match:
+                # Back to the main page with a flash, or a 429: queue full,
+                # rate limited or drink unavailable
+                self.recorder.refused += 1
+        if match:
+            self.recorder.order_accepted(urllib.parse.unquote(match.group(1)))
+
+
+def connect_socket_client(base_url, recorder):
+    """A Socket.IO client recording every mixing event it hears."""
+    client = socketio.Client(reconnection=True)
+    
+    for event in ('mixing_start', 'mixing_progress', 'mixing_complete', 'mixing_error',
+                  'queue_status', 'low_stock'):
+        client.on(event, lambda data=None, event=event: recorder.order_event(event, data))
+    
+    started = time.monotonic()
+    try:
+        client.connect(base_url, wait_timeout=10)
+        recorder.request('socket.io connect', time.monotonic() - started, True)
+    except Exception:
+        recorder.request('socket.io connect', time.monotonic() - started, False)
+        with recorder.lock:
+            recorder.socket_errors += 1
+        return None
+    return client
+
+
+# -------------------- Running --------------------
+
+def start_app(data_dir, port, speed, fill_ml):
+    """
+    Start app.py on a copy of the data, with simulated pumps.
+    
+    Returns:
+        tuple: (process, base URL, temporary directory)
+    """
+    workdir = tempfile.mkdtemp(prefix='mixer-loadtest-')
+    unit_data = os.path.join(workdir, 'data')
+    shutil.copytree(data_dir, unit_data)
+    if fill_ml:
+        # Bottles big enough that a long run doesn't just measure empty hoses
+        with open(os.path.join(unit_data, 'bottle_volumes.json'), 'w') as f:
+            json.dump({str(i): {'total_volume_ml': fill_ml, 'remaining_volume_ml': fill_ml} for i in Config.PUMP_IDS}, f)
+    
+    # Every tablet connects from 127.0.0.1, so the unit keys them by
+    # X-Client-Id; threading mode, so events from pour threads reach the
+    # socket clients without monkey patching
+    env = dict(os.environ, PORT=str(port), MIXER_DATA_DIR=unit_data,
+               MIXER_LOGS_DIR=os.path.join(workdir, 'logs'), PUMP_SIMULATION_SPEED=str(speed),
+               MIXER_TRUST_CLIENT_ID='1', SOCKETIO_ASYNC_MODE='threading')
+    env.pop('PUMP_CONTROLLER_SOCKET', None)
+    process = subprocess.Popen([sys.executable, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'app.py')],
+                               env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    
+    base_url = f"http://127.0.0.1:{port}"
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"app.py exited with code {process.returncode}")
+        try:
+            with urllib.request.urlopen(base_url + '/api/hose_status', timeout=1):
+                return process, base_url, workdir
+        except OSError:
+            time.sleep(0.2)
+    process.terminate()
+    raise RuntimeError("app.py did not start within 30 seconds")
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+def makeable_drinks(base_url):
+    """IDs of the drinks the unit can make right now."""
+    with urllib.request.urlopen(base_url + '/api/drinks?limit=100', timeout=10) as resp:
+        return [d['drink_id'] for d in json.load(resp)['drinks']]
+
+def run(base_url, arrivals, tablets=30, sockets=5, browse_interval=5.0, size=375, drain_seconds=60.0,
+        drink_ids=None, rng=random, log=print):
+    """
+    Drive a unit with browsing tablets, socket clients and orders.
+    
+    Args:
+        base_url (str): Unit to test
+        arrivals (list): Order arrival times in seconds from the start
+        tablets (int): Concurrent HTTP clients browsing and ordering
+        sockets (int): Concurrent Socket.IO clients
+        browse_interval (float): Seconds between each tablet's hose status polls
+        size (float): Drink size ordered
+        drain_seconds (float): How long to wait for accepted orders to finish
+                               after the last arrival
+        drink_ids (list): Drinks to order; everything makeable by default
+        rng: Random number source
+        log: Progress output
+    
+    Returns:
+        dict: The report from Recorder.report
+    """
+    recorder = Recorder()
+    drink_ids = drink_ids or makeable_drinks(base_url)
+    if not drink_ids:
+        raise RuntimeError("The unit can't make any drinks")
+    
+    clients = []
+    if socketio is None:
+        log("python-socketio is not installed: orders are placed but not followed")
+    else:
+        for _ in range(sockets):
+            client = connect_socket_client(base_url, recorder)
+            if client:
+                clients.append(client)
+    tracking = bool(clients)
+    
+    stop = threading.Event()
+    pool = [Tablet(base_url, recorder, client_id=f"tablet-{i + 1}") for i in range(tablets)]
+    
+    def browse(tablet):
+        tablet.get('/', 'GET /')
+        # Tablets don't poll in lockstep
+        stop.wait(rng.random() * browse_interval)
+        while not stop.is_set():
+            tablet.get('/api/hose_status', 'GET /api/hose_status', conditional=True)
+            stop.wait(browse_interval)
+    
+    browsers = [threading.Thread(target=browse, args=(t,), daemon=True) for t in pool]
+    for thread in browsers:
+        thread.start()
+    
+    log(f"{len(arrivals)} orders over {arrivals[-1] if arrivals else 0:.0f}s from {tablets} tablets, "
+        f"{len(clients)} socket clients")
+    started = time.monotonic()
+    with ThreadPoolExecutor(max_workers=tablets) as executor:
+        for i, at in enumerate(arrivals):
+            delay = started + at - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            tablet = pool[i % tablets]
+            scheduled = started + at
+            
+            def place(tablet=tablet, scheduled=scheduled):
+                with recorder.lock:
+                    recorder.schedule_lag.append(time.monotonic() - scheduled)
+                tablet.order(rng.choice(drink_ids), size)
+            
+            executor.submit(place)
+    
+    if tracking:
+        deadline = time.monotonic() + drain_seconds
+        while recorder.open_orders() and time.monotonic() < deadline:
+            time.sleep(0.25)
+    elapsed = time.monotonic() - started
+    
+    stop.set()
+    for thread in browsers:
+        thread.join(timeout=browse_interval + 10)
+    for client in clients:
+        client.disconnect()
+    return recorder.report(elapsed, tracking)
+
+def print_report(report):
+    print(f"\nRun took {report['elapsed_seconds']}s")
+    print(f"{'endpoint':<26}{'requests':>9}{'req/s':>8}{'errors':>8}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'max ms':>9}")
+    for endpoint, stats in report['endpoints'].items():
+        print(f"{endpoint:<26}{stats['requests']:>9}{stats['per_second']:>8}{stats['error_rate']:>8.1%}"
+              f"{stats['p50_ms']:>9}{stats['p95_ms']:>9}{stats['p99_ms']:>9}{stats['max_ms']:>9}")
+    print("\nOrders:")
+    for key, value in report['orders'].items():
+        print(f"  {key:<22}{value}")
+    if report['socket_errors']:
+        print(f"\nSocket.IO clients that failed to connect: {report['socket_errors']}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Load test a mixer unit with simulated tablets")
+    target = parser.add_mutually_exclusive_group(required=True)
+    target.add_argument('--url', help="Unit that is already running")
+    target.add_argument('--start', action='store_true',
+                        help="Start app.py on a copy of the data with simulated pumps")
+    parser.add_argument('--data-dir', default=os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data'),
+                        help="Data copied for --start")
+    parser.add_argument('--speed', type=float, default=10.0, help="Simulated pump speed-up for --start")
+    parser.add_argument('--fill-ml', type=int, default=100000,
+                        help="Bottle volume for every hose with --start; 0 keeps the copied volumes")
+    parser.add_argument('--pattern', choices=PATTERNS, default='steady')
+    parser.add_argument('--duration', type=float, default=60.0, help="Seconds orders keep arriving")
+    parser.add_argument('--rate', type=float, default=0.2, help="Orders per second")
+    parser.add_argument('--burst-size', type=int, default=30)
+    parser.add_argument('--burst-interval', type=float, default=60.0)
+    parser.add_argument('--last-call-share', type=float, default=0.2)
+    parser.add_argument('--last-call-factor', type=float, default=5.0)
+    parser.add_argument('--tablets', type=int, default=30)
+    parser.add_argument('--sockets', type=int, default=5)
+    parser.add_argument('--browse-interval', type=float, default=5.0)
+    parser.add_argument('--size', type=float, default=375)
+    parser.add_argument('--drain', type=float, default=120.0,
+                        help="Seconds to wait for accepted orders to finish")
+    parser.add_argument('--seed', type=int, help="Random seed, for repeatable runs")
+    parser.add_argument('--json', help="Also write the report to this file")
+    args = parser.parse_args()
+    
+    rng = random.Random(args.seed)
+    arrivals = arrival_times(args.pattern, args.duration, args.rate, args.burst_size, args.burst_interval,
+                             args.last_call_share, args.last_call_factor, rng)
+    
+    process = workdir = None
+    try:
+        if args.start:
+            process, base_url, workdir = start_app(args.data_dir, free_port(), args.speed, args.fill_ml)
+            print(f"Started app.py at {base_url} (data in {workdir})")
+        else:
+            base_url = args.url
+        report = run(base_url, arrivals, args.tablets, args.sockets, args.browse_interval, args.size,
+                     args.drain, rng=rng)
+    finally:
+        if process:
+            process.terminate()
+            process.wait(timeout=10)
+        if workdir:
+            shutil.rmtree(workdir, ignore_errors=True)
+    
+    print_report(report)
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(report, f, indent=2)
+    dropped = report['orders']['dropped']
+    sys.exit(1 if dropped else 0)
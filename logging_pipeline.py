@@ -0,0 +1,86 @@
+import atexit
+import logging
+import logging.config
+import logging.handlers
+import queue
+from collections import deque
+from datetime import datetime
+
+
+class RingBufferHandler(logging.Handler):
+    """Keep the most recent log records in memory."""
+    
+    def __init__(self, capacity=500):
+        super().__init__()
+        self.records = deque(maxlen=capacity)
+    
+    def emit(self, record):
+        try:
+            self.records.append({
+                'time': datetime.fromtimestamp(record.created).isoformat(),
+                'level': record.levelname,
+                'logger': record.name,
+                'thread': record.threadName,
+                'message': record.getMessage()
+            })
+        except Exception:
+            self.handleError(record)
+    
+    def get_records(self, limit=None, min_level=None):
+        """
+        Get buffered records, oldest first.
+        
+        Args:
+            limit (int): Maximum number of (most recent) records to return
+            min_level (str): Optional minimum level name, e.g. 'WARNING'
+            
+        Returns:
+            list: Record dictionaries
+        """
+        records = list(self.records)
+        if min_level:
+            threshold = logging.getLevelName(min_level.upper())
+            if isinstance(threshold, int):
+                records = [r for r in records if logging.getLevelName(r['level']) >= threshold]
+        if limit:
+            records = records[-limit:]
+        return records
+
+
+_listener = None
+
+
+def setup_logging(logging_config):
+    """
+    Configure logging from a dictConfig dictionary, then move the root
+    handlers behind a QueueHandler so callers only pay for a queue put.
+    
+    The configured handlers (console, rotating file, ring buffer) run on a
+    QueueListener thread, so a slow SD card write never blocks the pump
+    thread or a request handler.
+    
+    Args:
+        logging_config (dict): logging.config.dictConfig configuration
+        
+    Returns:
+        RingBufferHandler: The in-memory buffer of recent records, or None
+    """
+    global _listener
+    
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+    
+    logging.config.dictConfig(logging_config)
+    root = logging.getLogger()
+    handlers = list(root.handlers)
+    for handler in handlers:
+        root.removeHandler(handler)
+    
+    log_queue = queue.SimpleQueue()
+    root.addHandler(logging.handlers.QueueHandler(log_queue))
+    _listener = logging.handlers.QueueListener(log_queue, *handlers, respect_handler_level=True)
+    _listener.start()
+    atexit.register(_listener.stop)
+    
+    return next((h for h in handlers if isinstance(h, RingBufferHandler)), None)
@@ -0,0 +1,145 @@
+"""
+Compact domain objects for recipes and hose state.
+
+The loaders in utils build these once per version of the data files and
+hand the same objects to every request, so they are immutable: code that
+changes a recipe or a bottle builds a new one and saves it.
+
+A recipe keeps its ingredients as parallel vectors (names, registry IDs and
+an array of percentages) instead of a dict per recipe, which keeps a large
+catalog small in memory. Recipes still read like the dicts they replace:
+recipe['drink_name'], recipe.get('notes'), recipe.ingredients.items() and
+dict(recipe) all work, so templates and JSON responses use them directly.
+"""
+from array import array
+from collections.abc import Mapping
+
+
+class Recipe(Mapping):
+    """A drink recipe with its ingredients as vectors."""
+    
+    __slots__ = ('drink_id', 'drink_name', 'ingredient_names', 'ingredient_ids', 'percentages', 'notes')
+    
+    FIELDS = ('drink_id', 'drink_name', 'ingredients', 'notes')
+    
+    def __init__(self, drink_id, drink_name, ingredient_names, ingredient_ids, percentages, notes=''):
+        """
+        Args:
+            drink_id (int): Drink ID
+            drink_name (str): Display name
+            ingredient_names (tuple): Canonical ingredient names
+            ingredient_ids (tuple): Registry IDs in the same order, 0 if unknown
+            percentages: Share of each ingredient in percent
+            notes (str): Serving notes
+        """
+        set_slot = object.__setattr__
+        set_slot(self, 'drink_id', drink_id)
+        set_slot(self, 'drink_name', drink_name)
+        set_slot(self, 'ingredient_names', tuple(ingredient_names))
+        set_slot(self, 'ingredient_ids', tuple(ingredient_ids))
+        set_slot(self, 'percentages', array('d', percentages))
+        set_slot(self, 'notes', notes or '')
+    
+    def __setattr__(self, name, value):
+        raise AttributeError("Recipe is immutable; build a new one with replace()")
+    
+    @property
+    def ingredients(self):
+        """
+        {ingredient name: percentage}, built on demand for templates and JSON.
+        
+        Each access builds a new dict, so code that runs per request or per
+        pour reads the vectors instead (utils.recipe_ingredients).
+        """
+        return dict(zip(self.ingredient_names, self.percentages))
+    
+    def replace(self, **changes):
+        """
+        Copy of this recipe with some fields changed.
+        
+        Args:
+            changes: drink_id, drink_name or notes; ingredients must be
+                     changed through utils.make_recipe so IDs are resolved
+        """
+        return Recipe(
+            changes.get('drink_id', self.drink_id),
+            changes.get('drink_name', self.drink_name),
+            self.ingredient_names,
+            self.ingredient_ids,
+            self.percentages,
+            changes.get('notes', self.notes)
+        )
+    
+    def to_dict(self):
+        """Plain dict in the drink_recipes.json format."""
+        return {
+            'drink_id': self.drink_id,
+            'drink_name': self.drink_name,
+            'ingredients': self.ingredients,
+            'notes': self.notes
+        }
+    
+    # Read-only mapping interface, so a recipe can stand in for its dict
+    
+    def __getitem__(self, key):
+        if key not in self.FIELDS:
+            raise KeyError(key)
+        return getattr(self, key)
+    
+    def __iter__(self):
+        return iter(self.FIELDS)
+    
+    def __len__(self):
+        return len(self.FIELDS)
+    
+    def __eq__(self, other):
+        if not isinstance(other, Recipe):
+            return super().__eq__(other)
+        return (self.drink_id == other.drink_id and self.drink_name == other.drink_name
+                and self.ingredient_names == other.ingredient_names
+                and self.percentages == other.percentages and self.notes == other.notes)
+    
+    __hash__ = None
+    
+    def __repr__(self):
+        return f"Recipe({self.drink_id}, {self.drink_name!r})"
+
+
+class BottleVolume:
+    """Size and fill level of the bottle on one hose."""
+    
+    __slots__ = ('total_volume_ml', 'remaining_volume_ml')
+    
+    def __init__(self, total_volume_ml, remaining_volume_ml):
+        object.__setattr__(self, 'total_volume_ml', int(total_volume_ml))
+        object.__setattr__(self, 'remaining_volume_ml', int(remaining_volume_ml))
+    
+    def __setattr__(self, name, value):
+        raise AttributeError("BottleVolume is immutable; use with_remaining()")
+    
+    @property
+    def percent(self):
+        """Fill level in whole percent."""
+        if self.total_volume_ml <= 0:
+            return 0
+        return int(self.remaining_volume_ml / self.total_volume_ml * 100)
+    
+    def with_remaining(self, remaining_volume_ml):
+        """Copy of this bottle with a new fill level."""
+        return BottleVolume(self.total_volume_ml, remaining_volume_ml)
+    
+    def to_dict(self):
+        return {'total_volume_ml': self.total_volume_ml, 'remaining_volume_ml': self.remaining_volume_ml}
+    
+    def __eq__(self, other):
+        return (isinstance(other, BottleVolume) and self.total_volume_ml == other.total_volume_ml
+                and self.remaining_volume_ml == other.remaining_volume_ml)
+    
+    __hash__ = None
+    
+    def __repr__(self):
+        return f"BottleVolume({self.remaining_volume_ml}/{self.total_volume_ml} ml)"
+
+
+# Shared empty bottle for hoses with no volume recorded
+NO_BOTTLE = BottleVolume(0, 0)
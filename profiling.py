@@ -0,0 +1,360 @@
+"""
+On-demand profiling of requests and pours on a running unit.
+
+A run is armed from the settings API for either the next N requests or the
+next pour, in one of two modes:
+
+- 'sample' takes the stack of each profiled thread every few milliseconds.
+  It costs little, so timings stay close to what staff see.
+- 'cprofile' also runs cProfile in each profiled thread, for exact call
+  counts and per-function times at a higher cost.
+
+When the run is over it is saved to the profiles directory as collapsed
+stacks (name.collapsed, one 'frame;frame;frame count' line per stack, the
+input of flamegraph.pl and speedscope), a readable summary (name.txt) and,
+for cProfile, the raw stats (name.prof, for pstats or snakeviz).
+
+Nothing is hooked while no run is armed: the WSGI wrapper and the pump
+listener are only installed for the length of a run.
+"""
+import io
+import os
+import sys
+import time
+import pstats
+import cProfile
+import logging
+import threading
+from collections import Counter
+
+MODES = ('sample', 'cprofile')
+
+# Deepest stack recorded per sample
+MAX_STACK_DEPTH = 200
+
+# Paths never profiled, so polling a run doesn't use it up
+EXCLUDED_PATH_PREFIX = '/api/profiling'
+
+
+def frame_label(code):
+    """Flame graph label of a code object, as 'module:function'."""
+    module = os.path.splitext(os.path.basename(code.co_filename))[0]
+    return f"{module}:{code.co_name}"
+
+def collapse_stack(frame):
+    """A thread's stack as collapsed-stack text, root first."""
+    labels = []
+    while frame is not None and len(labels) < MAX_STACK_DEPTH:
+        labels.append(frame_label(frame.f_code))
+        frame = frame.f_back
+    return ';'.join(reversed(labels))
+
+
+class ProfilingRun:
+    """State of one armed profiling run."""
+    
+    def __init__(self, mode, target, requests=0, interval=0.005):
+        self.mode = mode
+        self.target = target          # 'requests' or 'pour'
+        self.remaining = requests     # Requests still to be profiled
+        self.interval = interval
+        self.started_at = time.time()
+        self.name = time.strftime('%Y%m%d-%H%M%S') + f"-{target}-{mode}"
+        
+        self.in_flight = 0            # Profiled requests running now
+        self.profiled = 0             # Requests or pours profiled so far
+        self.order_id = None          # The pour being profiled
+        self.stopping = False
+        
+        self.threads = set()          # Thread idents being sampled
+        self.profiles = {}            # Thread ident -> running cProfile.Profile
+        self.finished_profiles = []
+        self.stacks = Counter()
+        self.samples = 0
+        self.done = threading.Event()
+    
+    def status(self):
+        return {
+            'name': self.name,
+            'mode': self.mode,
+            'target': self.target,
+            'remaining_requests': self.remaining if self.target == 'requests' else None,
+            'profiled': self.profiled,
+            'in_flight': self.in_flight,
+            'order_id': self.order_id,
+            'samples': self.samples,
+            'running_seconds': round(time.time() - self.started_at, 1)
+        }
+
+
+class Profiler:
+    """Arms profiling runs on a Flask app and saves their results."""
+    
+    def __init__(self, app, output_dir, keep=20, max_requests=1000):
+        """
+        Args:
+            app: Flask app whose requests can be profiled
+            output_dir (str): Directory the results are saved to
+            keep (int): Runs kept; older ones are deleted
+            max_requests (int): Most requests one run may cover
+        """
+        self.app = app
+        self.output_dir = output_dir
+        self.keep = keep
+        self.max_requests = max_requests
+        self.lock = threading.Lock()
+        self.run = None
+        self.last_result = None
+        self._wsgi_app = None
+        self._pumps = None
+    
+    # ---------- Arming ----------
+    
+    def arm(self, mode='sample', requests=None, pumps=None, interval=0.005):
+        """
+        Profile the next requests or the next pour.
+        
+        Args:
+            mode (str): 'sample' or 'cprofile'
+            requests (int): Profile this many requests
+            pumps: In-process PumpController whose next pour is profiled,
+                   when not profiling requests
+            interval (float): Seconds between stack samples
+        
+        Returns:
+            dict: Status of the armed run
+        
+        Raises:
+            ValueError: On a bad mode or target, or while a run is armed
+        """
+        if mode not in MODES:
+            raise ValueError(f"Unknown profiling mode: {mode}")
+        if requests is not None:
+            if not 1 <= requests <= self.max_requests:
+                raise ValueError(f"requests must be between 1 and {self.max_requests}")
+        elif pumps is None:
+            raise ValueError("Profile either a number of requests or the next pour")
+        
+        with self.lock:
+            if self.run is not None:
+                raise ValueError("A profiling run is already armed")
+            run = ProfilingRun(mode, 'requests' if requests is not None else 'pour', requests or 0, interval)
+            self.run = run
+            if run.target == 'requests':
+                self._wsgi_app = self.app.wsgi_app
+                self.app.wsgi_app = self._profiled_wsgi_app
+            else:
+                self._pumps = pumps
+                pumps.add_listener(self._pump_event)
+        
+        threading.Thread(target=self._sample, args=(run,), name="profiler", daemon=True).start()
+        logging.info(f"Profiling armed: {run.mode} for the next "
+                     f"{f'{requests} requests' if run.target == 'requests' else 'pour'}")
+        return run.status()
+    
+    def stop(self):
+        """
+        End the armed run early, keeping what was profiled.
+        
+        Profiles still running finish with their request or pour.
+        
+        Returns:
+            dict: Status of the run, or None if none was armed
+        """
+        with self.lock:
+            run = self.run
+            if run is None:
+                return None
+            run.stopping = True
+            run.remaining = 0
+            finish = not run.threads
+        if finish:
+            self._finish(run)
+        return run.status()
+    
+    def status(self):
+        """The armed run, the last result and the saved runs."""
+        with self.lock:
+            run = self.run.status() if self.run else None
+        return {'armed': run, 'last_result': self.last_result, 'saved': self.saved_runs()}
+    
+    # ---------- Profiling threads ----------
+    
+    def _begin(self, run):
+        """Start profiling the calling thread. Call with the lock held."""
+        ident = threading.get_ident()
+        run.threads.add(ident)
+        if run.mode == 'cprofile':
+            profile = cProfile.Profile()
+            run.profiles[ident] = profile
+            profile.enable()
+    
+    def _end(self, run):
+        """
+        Stop profiling the calling thread.
+        
+        Returns:
+            bool: Whether that was the last profile of the run
+        """
+        ident = threading.get_ident()
+        profile = run.profiles.pop(ident, None)
+        if profile is not None:
+            profile.disable()
+        with self.lock:
+            run.threads.discard(ident)
+            if profile is not None:
+                run.finished_profiles.append(profile)
+            run.profiled += 1
+            return not run.threads and (run.stopping or run.remaining <= 0)
+    
+    def _profiled_wsgi_app(self, environ, start_response):
+        """The app's WSGI callable, profiling requests while the run wants them."""
+        run = self.run
+        with self.lock:
+            take = (run is not None and run.remaining > 0
+                    and not environ.get('PATH_INFO', '').startswith(EXCLUDED_PATH_PREFIX))
+            if take:
+                run.remaining -= 1
+                run.in_flight += 1
+                self._begin(run)
+        if not take:
+            return self._wsgi_app(environ, start_response)
+        
+        try:
+            # Streamed bodies are profiled only up to their first chunk
+            return self._wsgi_app(environ, start_response)
+        finally:
+            last = self._end(run)
+            with self.lock:
+                run.in_flight -= 1
+            if last:
+                self._finish(run)
+    
+    def _pump_event(self, event, data):
+        """Pump listener: profile the first pour that starts, on its own thread."""
+        run = self.run
+        if run is None or not isinstance(data, dict):
+            return
+        if event == 'mixing_start':
+            with self.lock:
+                if run.order_id is not None or run.stopping:
+                    return
+                run.order_id = data.get('order_id')
+                self._begin(run)
+        elif event in ('mixing_complete', 'mixing_error'):
+            if run.order_id is None or data.get('order_id') != run.order_id:
+                return
+            if threading.get_ident() not in run.threads:
+                # mixing_complete after a mixing_error that already ended it
+                return
+            run.stopping = True
+            if self._end(run):
+                self._finish(run)
+    
+    def _sample(self, run):
+        """Sampler thread: count the stacks of the profiled threads until the run ends."""
+        while not run.done.wait(run.interval):
+            if not run.threads:
+                continue
+            frames = sys._current_frames()
+            for ident in list(run.threads):
+                frame = frames.get(ident)
+                if frame is not None:
+                    run.stacks[collapse_stack(frame)] += 1
+                    run.samples += 1
+    
+    # ---------- Results ----------
+    
+    def _finish(self, run):
+        """Unhook the run and save what it collected."""
+        with self.lock:
+            if self.run is not run:
+                return
+            self.run = None
+            if run.target == 'requests':
+                # Requests already past the swap still find the app in self._wsgi_app
+                self.app.wsgi_app = self._wsgi_app
+            else:
+                self._pumps.remove_listener(self._pump_event)
+                self._pumps = None
+        run.done.set()
+        
+        try:
+            self.last_result = self._save(run)
+            logging.info(f"Profiling run {run.name} saved: {run.profiled} profiled, {run.samples} samples")
+        except Exception as e:
+            logging.error(f"Error saving profiling run {run.name}: {e}")
+            self.last_result = {'name': run.name, 'error': str(e)}
+    
+    def _save(self, run):
+        """
+        Write a finished run's results.
+        
+        Returns:
+            dict: Run name, files written and counts
+        """
+        os.makedirs(self.output_dir, exist_ok=True)
+        files = []
+        
+        def path(extension):
+            files.append(run.name + extension)
+            return os.path.join(self.output_dir, run.name + extension)
+        
+        if run.stacks:
+            with open(path('.collapsed'), 'w') as f:
+                for stack, count in run.stacks.most_common():
+                    f.write(f"{stack} {count}\n")
+        
+        summary = io.StringIO()
+        summary.write(f"{run.name}: {run.mode} profile of {run.profiled} "
+                      f"{'request(s)' if run.target == 'requests' else 'pour(s)'}, "
+                      f"{time.time() - run.started_at:.1f}s, {run.samples} samples\n\n")
+        if run.samples:
+            # Where the time went, by the innermost function in each sample
+            own = Counter()
+            for stack, count in run.stacks.items():
+                own[stack.rsplit(';', 1)[-1]] += count
+            summary.write("Samples  Share  Function (innermost)\n")
+            for label, count in own.most_common(40):
+                summary.write(f"{count:7d}  {count / run.samples:5.1%}  {label}\n")
+        if run.finished_profiles:
+            stats = pstats.Stats(run.finished_profiles[0], stream=summary)
+            for profile in run.finished_profiles[1:]:
+                stats.add(profile)
+            stats.dump_stats(path('.prof'))
+            summary.write("\n")
+            stats.sort_stats('cumulative').print_stats(40)
+        with open(path('.txt'), 'w') as f:
+            f.write(summary.getvalue())
+        
+        self._prune()
+        return {
+            'name': run.name,
+            'mode': run.mode,
+            'target': run.target,
+            'profiled': run.profiled,
+            'samples': run.samples,
+            'files': files
+        }
+    
+    def saved_runs(self):
+        """Names of the saved runs with their files, newest first."""
+        try:
+            names = os.listdir(self.output_dir)
+        except OSError:
+            return []
+        runs = {}
+        for name in names:
+            run_name, extension = os.path.splitext(name)
+            if extension in ('.collapsed', '.txt', '.prof'):
+                runs.setdefault(run_name, []).append(name)
+        return [{'name': run_name, 'files': sorted(runs[run_name])} for run_name in sorted(runs, reverse=True)]
+    
+    def _prune(self):
+        """Delete runs beyond the newest self.keep."""
+        for run in self.saved_runs()[self.keep:]:
+            for name in run['files']:
+                try:
+                    os.remove(os.path.join(self.output_dir, name))
+                except OSError:
+                    pass
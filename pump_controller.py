@@ -0,0 +1,1012 @@
+"""
+Pump controller: the single owner of the pump outputs and the pour state.
+
+The web app either runs a PumpController in-process (the default), or,
+when Config.PUMP_CONTROLLER_SOCKET is set, talks to a controller daemon
+through ControllerClient. The daemon serves newline-delimited JSON over a
+Unix socket, so the web tier can run several worker processes while
+hardware access stays in one place:
+
+    PUMP_CONTROLLER_SOCKET=/run/mixer/pumps.sock python pump_controller.py
+"""
+import os
+import copy
+import json
+import time
+import uuid
+import socket
+import logging
+import argparse
+import threading
+import socketserver
+from queue import Queue, Empty
+from collections import OrderedDict
+
+from eta import PourEstimator, forecast
+from admission import IdempotencyCache
+from models import NO_BOTTLE
+from pump_outputs import PumpOutputs
+from utils import (
+    load_hose_assignments, load_pump_calibrations, load_bottle_volumes,
+    update_remaining_volume, update_ingredient_usage, get_pump_run_ratios, record_drink_poured, record_pump_run,
+    get_ingredient_id, get_pumps_by_ingredient, recipe_ingredients
+)
+
+
+class PumpBusyError(Exception):
+    """Raised when a pour is requested while the order queue is full."""
+
+
+class OrderRejected(Exception):
+    """Raised when an order can't be poured at any cup station."""
+
+
+class DuplicateOrder(Exception):
+    """Raised when an order with the same idempotency key is still being placed."""
+
+
+class ControllerError(Exception):
+    """Raised when the pump controller daemon can't be reached or fails."""
+
+
+class CancelToken:
+    """
+    Cancellation flag carried by one order.
+    
+    Pump runs and pauses wait on the token rather than sleeping, so a
+    cancel wakes the pour thread at once instead of after the current step.
+    """
+    
+    def __init__(self):
+        self.event = threading.Event()
+        self.reason = None
+        self.cancelled_at = None
+        # Set once the pour thread has turned its pump off
+        self.stopped = threading.Event()
+    
+    def cancel(self, reason="Pour cancelled"):
+        if self.event.is_set():
+            return
+        self.reason = reason
+        self.cancelled_at = time.monotonic()
+        self.event.set()
+    
+    @property
+    def cancelled(self):
+        return self.event.is_set()
+    
+    def wait(self, seconds):
+        """Sleep up to seconds; returns True if cancelled meanwhile."""
+        return self.event.wait(seconds)
+
+
+class PumpController:
+    """
+    Owns the pump GPIO pins and pours queued orders on background threads.
+    
+    Each cup station has a nozzle group, the set of pumps that reach it.
+    Orders whose pumps don't overlap pour at the same time on different
+    stations; orders that share a pump wait for each other.
+    """
+    
+    # A cancelled pump should be off within this many seconds
+    STOP_LATENCY_BUDGET = 0.005
+    # How long an emergency stop waits for pour threads to confirm
+    STOP_CONFIRM_TIMEOUT = 0.25
+    # Outcomes of finished orders kept for status(), e.g. for a fleet coordinator
+    FINISHED_ORDERS_KEPT = 50
+    
+    def __init__(self, pump_pins, stations=None, queue_limit=10, estimator=None, simulation_speed=1.0,
+                 expanders=None, rate_limiter=None, idempotency_ttl=300.0):
+        self.pump_pins = dict(pump_pins)
+        self.stations = {int(k): set(v) for k, v in (stations or {1: list(self.pump_pins)}).items()}
+        self.queue_limit = queue_limit
+        self.lock = threading.Lock()
+        self.last_error = None
+        self.listeners = []
+        
+        # Orders by ID in arrival order; each is queued or pouring
+        self.orders = OrderedDict()
+        # Recently finished orders by ID: {'order_id', 'state', 'error'}
+        self.finished = OrderedDict()
+        self.active_pumps = set()
+        self.busy_stations = set()
+        if estimator is None:
+            estimator = PourEstimator()
+            estimator.load_history(get_pump_run_ratios())
+        self.estimator = estimator
+        
+        # Manual pump runs (calibration, priming): {(purpose, pump_id): time}
+        self.run_starts = {}
+        self.last_run_times = {}
+        # The running or last automated calibration cycle
+        self.calibration = None
+        
+        # Seconds from a cancel to the pump being off
+        self.stop_latency_count = 0
+        self.stop_latency_total = 0.0
+        self.stop_latency_max = 0.0
+        self.stop_latency_last = None
+        
+        # Admission control lives here rather than in the web workers, so
+        # rate limits and merged double taps hold however many there are
+        self.rate_limiter = rate_limiter
+        self.order_keys = IdempotencyCache()
+        self.idempotency_ttl = idempotency_ttl
+        
+        # Pins on the Pi and on I2C expanders, simulated where there is no driver
+        self.outputs = PumpOutputs(self.pump_pins, expanders)
+        # Simulated pours run this many times faster than real ones, for load tests
+        self.simulation_speed = float(simulation_speed) if self.outputs.simulated else 1.0
+    
+    # ---------- Events ----------
+    
+    def add_listener(self, callback):
+        """Register callback(event, data) for mixing events."""
+        self.listeners.append(callback)
+    
+    def remove_listener(self, callback):
+        if callback in self.listeners:
+            self.listeners.remove(callback)
+    
+    def _emit(self, event, data=None):
+        for callback in list(self.listeners):
+            try:
+                callback(event, data)
+            except Exception:
+                logging.error(f"Error delivering {event} event", exc_info=True)
+    
+    # ---------- Status ----------
+    
+    def status(self):
+        """
+        Get the current pour state.
+        
+        Returns:
+            dict: is_mixing, progress, error, order_id and drink_name of the
+                  oldest order, every queued or pouring order with its
+                  predicted wait and finish, when the queue will be empty,
+                  and the outcome ('done' or 'failed') of recent orders
+        """
+        with self.lock:
+            etas = forecast(list(self.orders.values()), self.stations, time.monotonic())
+            orders = [{
+                'order_id': o['order_id'],
+                'drink_name': o['drink_name'],
+                'state': o['state'],
+                'station': o['station'],
+                'progress': o['progress'],
+                'wait_seconds': round(etas[o['order_id']][0], 1) if o['order_id'] in etas else None,
+                'eta_seconds': round(etas[o['order_id']][1], 1) if o['order_id'] in etas else None
+            } for o in self.orders.values()]
+            finished = [dict(o) for o in self.finished.values()]
+        current = orders[0] if orders else {}
+        return {
+            'is_mixing': bool(orders),
+            'progress': current.get('progress', 0.0),
+            'error': self.last_error,
+            'order_id': current.get('order_id'),
+            'drink_name': current.get('drink_name'),
+            'orders': orders,
+            'finished': finished,
+            'queue_full': sum(1 for o in orders if o['state'] == 'queued') >= self.queue_limit,
+            'queue_eta_seconds': max((o['eta_seconds'] for o in orders if o['eta_seconds'] is not None), default=0.0),
+            'eta_error': self.estimator.metrics(),
+            'stop_latency': self.stop_latency_metrics(),
+            'outputs': self.outputs.status()
+        }
+    
+    def stop_latency_metrics(self):
+        """
+        Get how quickly cancels turned pumps off.
+        
+        Returns:
+            dict: Number of stops measured and the last, mean and worst
+                  latency in milliseconds
+        """
+        with self.lock:
+            count = self.stop_latency_count
+            return {
+                'stops': count,
+                'last_ms': round(self.stop_latency_last * 1000, 3) if self.stop_latency_last is not None else None,
+                'mean_ms': round(self.stop_latency_total / count * 1000, 3) if count else None,
+                'max_ms': round(self.stop_latency_max * 1000, 3) if count else None
+            }
+    
+    def _record_stop_latency(self, seconds):
+        with self.lock:
+            self.stop_latency_count += 1
+            self.stop_latency_total += seconds
+            self.stop_latency_max = max(self.stop_latency_max, seconds)
+            self.stop_latency_last = seconds
+        if seconds > self.STOP_LATENCY_BUDGET:
+            logging.error(f"Pump stop took {seconds * 1000:.1f}ms, over the "
+                          f"{self.STOP_LATENCY_BUDGET * 1000:.0f}ms budget")
+    
+    # ---------- Pouring ----------
+    
+    def admit(self, client, idempotency_key=None):
+        """
+        Check an order before the web tier spends any work on it.
+        
+        Args:
+            client (str): Who is ordering, for the rate limit; None for no limit
+            idempotency_key (str): The key the order will be poured with
+        
+        Returns:
+            dict: order_id already placed with the key, if any, else
+                  retry_after, 0 if the order may go ahead or the seconds
+                  until the client may order again
+        """
+        placed = self.order_keys.get(idempotency_key) if idempotency_key else None
+        if placed:
+            return {'order_id': placed, 'retry_after': 0.0}
+        retry_after = self.rate_limiter.take(client) if self.rate_limiter and client else 0.0
+        return {'order_id': None, 'retry_after': retry_after}
+    
+    def pour(self, recipe, total_volume, order_id=None, idempotency_key=None, key_ttl=None):
+        """
+        Queue a recipe for pouring. It starts as soon as a cup station that
+        reaches all its pumps is free and none of its pumps are in use.
+        
+        An order ID that is already queued, pouring or recently finished,
+        or an idempotency key seen within its TTL, places nothing and
+        answers with the order already placed.
+        
+        Args:
+            recipe (Recipe): Recipe, or its dict, with 'drink_name' and 'ingredients' percentages
+            total_volume (float): Drink size in ml
+            order_id (str): Optional order ID; one is generated if missing
+            idempotency_key (str): Key merging repeats of this order; the
+                                   order ID by default
+            key_ttl (float): Seconds the key is remembered
+            
+        Returns:
+            str: The order ID
+            
+        Raises:
+            PumpBusyError: If the order queue is full
+            OrderRejected: If no cup station reaches all the drink's pumps, or
+                           one of them is on GPIO that failed to initialize
+            DuplicateOrder: If another request is still placing the same key
+        """
+        key = idempotency_key or order_id
+        if not key:
+            return self._place(recipe, total_volume, uuid.uuid4().hex)
+        
+        owner, placed = self.order_keys.begin(key, key_ttl or self.idempotency_ttl)
+        if not owner:
+            if placed:
+                return placed
+            raise DuplicateOrder("This order is already being placed")
+        placed = None
+        try:
+            placed = self._place(recipe, total_volume, order_id or uuid.uuid4().hex)
+            return placed
+        finally:
+            if placed:
+                self.order_keys.finish(key, placed)
+            else:
+                self.order_keys.abort(key)
+    
+    def _place(self, recipe, total_volume, order_id):
+        """Plan and queue an order. Returns its ID."""
+        steps = self.estimator.plan(recipe, float(total_volume), get_pumps_by_ingredient(load_hose_assignments()),
+                                    load_pump_calibrations())
+        pumps = {pump_id for pump_id, _ in steps if pump_id}
+        
+        if not any(pumps <= station_pumps for station_pumps in self.stations.values()):
+            raise OrderRejected(f"No cup station reaches all pumps for {recipe.get('drink_name')}")
+        unavailable = pumps & self.outputs.unavailable
+        if unavailable:
+            raise OrderRejected(f"Pumps {', '.join(map(str, sorted(unavailable)))} are unavailable: "
+                                f"their GPIO failed to initialize")
+        
+        with self.lock:
+            if order_id in self.orders or order_id in self.finished:
+                # Never replace an order: its thread would go on pouring,
+                # and finishing it would no longer release its pumps
+                logging.warning(f"Order {order_id} was already placed")
+                return order_id
+            queued = sum(1 for o in self.orders.values() if o['state'] == 'queued')
+            if queued >= self.queue_limit:
+                raise PumpBusyError("The order queue is full")
+            self.last_error = None
+            self.orders[order_id] = {
+                'order_id': order_id,
+                'drink_name': recipe.get('drink_name'),
+                'recipe': recipe,
+                'total_volume': float(total_volume),
+                'pumps': pumps,
+                'steps': steps,
+                'estimate': self.estimator.estimate(steps),
+                'state': 'queued',
+                'station': None,
+                'started_at': None,
+                'progress': 0.0,
+                'cancel': CancelToken()
+            }
+        
+        self._schedule()
+        return order_id
+    
+    def _schedule(self):
+        """Start every queued order that has a free station and free pumps."""
+        to_start = []
+        with self.lock:
+            # Pumps wanted by older waiting orders are reserved for them, so a
+            # stream of small orders can't starve a drink that shares a pump
+            reserved = set()
+            for order in self.orders.values():
+                if order['state'] != 'queued':
+                    continue
+                station = None
+                if not order['pumps'] & (self.active_pumps | reserved):
+                    station = next((sid for sid, station_pumps in sorted(self.stations.items())
+                                    if sid not in self.busy_stations and order['pumps'] <= station_pumps), None)
+                if station is None:
+                    reserved |= order['pumps']
+                    continue
+                order['state'] = 'pouring'
+                order['station'] = station
+                order['started_at'] = time.monotonic()
+                self.active_pumps |= order['pumps']
+                self.busy_stations.add(station)
+                to_start.append(order)
+        
+        for order in to_start:
+            threading.Thread(target=self._pour, args=(order,),
+                             name=f"pour-{order['order_id'][:8]}").start()
+        self._emit_queue_status()
+    
+    def _emit_queue_status(self):
+        """Tell clients the predicted wait and finish of every order."""
+        status = self.status()
+        self._emit('queue_status', {
+            'orders': [{key: o[key] for key in ('order_id', 'state', 'station', 'wait_seconds', 'eta_seconds')}
+                       for o in status['orders']],
+            'queue_eta_seconds': status['queue_eta_seconds']
+        })
+    
+    def _eta(self, steps_left):
+        """Predicted seconds until a pouring order finishes."""
+        return round(sum(self.estimator.step_seconds(step) for step in steps_left), 1)
+    
+    def _finish(self, order):
+        """Release an order's station and pumps, then start whatever can run."""
+        with self.lock:
+            if self.orders.get(order['order_id']) is order:
+                del self.orders[order['order_id']]
+                self.active_pumps -= order['pumps']
+                self.busy_stations.discard(order['station'])
+            self._record_finished(order['order_id'], order.get('error'))
+        self._schedule()
+    
+    def _record_finished(self, order_id, error=None):
+        """Keep the outcome of an order that left the queue. Call with the lock held."""
+        self.finished[order_id] = {'order_id': order_id, 'state': 'failed' if error else 'done', 'error': error}
+        self.finished.move_to_end(order_id)
+        while len(self.finished) > self.FINISHED_ORDERS_KEPT:
+            self.finished.popitem(last=False)
+    
+    def _pour(self, order):
+        """Thread function to handle the drink mixing process."""
+        recipe = order['recipe']
+        total_volume = order['total_volume']
+        event_data = {'order_id': order['order_id'], 'station': order['station']}
+        # Re-plan with what the estimator learned while the order waited
+        steps = order['steps']
+        order['estimate'] = predicted = self.estimator.estimate(steps)
+        pump_seconds = 0.0
+        cancel = order['cancel']
+        
+        def fail(message):
+            order['error'] = self.last_error = message
+            self._emit('mixing_error', dict(event_data, error=message))
+        
+        try:
+            ingredients = list(recipe_ingredients(recipe)) if recipe else []
+            if not ingredients:
+                fail("Recipe not found or empty")
+                return
+            
+            hose_assignments = load_hose_assignments()
+            calibrations = load_pump_calibrations()
+            bottle_volumes = load_bottle_volumes()
+            
+            total_ingredients = len(ingredients)
+            completed = 0
+            
+            self._emit('mixing_start', dict(event_data, drink_name=recipe['drink_name'],
+                                            eta_seconds=round(predicted, 1)))
+            
+            # Convert percentage to volume for each ingredient, on the pump
+            # planned and reserved when the order was queued
+            for (ingredient, ingredient_id, percentage), (pump_id, _) in zip(ingredients, steps):
+                if cancel.cancelled:
+                    break
+                
+                if not pump_id:
+                    logging.error(f"Ingredient {ingredient} not assigned")
+                    completed += 1
+                    order['progress'] = completed / total_ingredients
+                    self._emit('mixing_progress', dict(event_data, progress=order['progress'],
+                                                       eta_seconds=self._eta(steps[completed:])))
+                    continue
+                
+                if get_ingredient_id(hose_assignments.get(pump_id)) != ingredient_id:
+                    # The hose was reassigned while the order waited; its
+                    # pump now holds another liquid
+                    fail(f"Hose {pump_id} no longer holds {ingredient}. Please order again.")
+                    break
+                
+                required_volume = total_volume * (percentage / 100.0)
+                flow_rate = calibrations.get(pump_id, 10.0)
+                remaining = bottle_volumes.get(pump_id, NO_BOTTLE).remaining_volume_ml
+                
+                if remaining < required_volume:
+                    fail(f"Insufficient volume for {ingredient}. Please refill hose {pump_id}.")
+                    break
+                
+                dispense_time = required_volume / flow_rate
+                
+                # Activate pump and handle potential errors
+                try:
+                    actual_time = self.activate_pump(pump_id, dispense_time, cancel)
+                    pump_seconds += actual_time
+                    if cancel.cancelled:
+                        # Only what ran before the stop left the bottle
+                        dispensed_volume = min(required_volume, actual_time * flow_rate)
+                        update_remaining_volume(pump_id, dispensed_volume)
+                        update_ingredient_usage(pump_id, dispensed_volume, ingredient=ingredient,
+                                                order_id=order['order_id'], planned_seconds=dispense_time,
+                                                actual_seconds=actual_time, cancelled=True)
+                        break
+                    
+                    self.estimator.observe_dispense(pump_id, dispense_time, actual_time)
+                    update_remaining_volume(pump_id, required_volume)
+                    update_ingredient_usage(pump_id, required_volume, ingredient=ingredient,
+                                            order_id=order['order_id'], planned_seconds=dispense_time,
+                                            actual_seconds=actual_time)
+                    
+                    completed += 1
+                    order['progress'] = completed / total_ingredients
+                    self._emit('mixing_progress', dict(event_data, progress=order['progress'],
+                                                       eta_seconds=self._eta(steps[completed:])))
+                    
+                    # Small delay between ingredients
+                    cancel.wait(0.5 / self.simulation_speed)
+                    
+                except Exception as e:
+                    fail(f"Error dispensing {ingredient}: {str(e)}")
+                    logging.error(f"Pump error: {order['error']}")
+                    break
+            
+            if cancel.cancelled:
+                fail(cancel.reason)
+            elif not order.get('error'):
+                self.estimator.record_order(steps, predicted, time.monotonic() - order['started_at'], pump_seconds)
+                if recipe.get('drink_id'):
+                    record_drink_poured(recipe['drink_id'], order['order_id'])
+            self._emit('mixing_complete', event_data)
+            
+        except Exception as e:
+            fail(f"Error mixing {recipe.get('drink_name', 'drink')}: {str(e)}")
+            logging.error(order['error'])
+            
+        finally:
+            cancel.stopped.set()
+            self._finish(order)
+    
+    def activate_pump(self, pump_id, duration, cancel=None):
+        """
+        Activate a pump for a specified duration, or until cancelled.
+        
+        Args:
+            pump_id (int): Pump to run
+            duration (float): Run time in seconds
+            cancel (CancelToken): Stops the run early when cancelled
+            
+        Returns:
+            float: Seconds the pump actually ran
+        """
+        cancel = cancel or CancelToken()
+        if cancel.cancelled:
+            return 0.0
+        
+        if pump_id not in self.pump_pins:
+            logging.error(f"No GPIO pin for pump {pump_id}")
+            return 0.0
+        if self.outputs.simulated:
+            logging.warning(f"Simulating pump {pump_id} for {duration}s")
+        
+        try:
+            self.outputs.set(pump_id, True)
+            started = time.monotonic()
+            # A cancel that landed while the pin went high is caught here too
+            cancelled = cancel.wait(duration / self.simulation_speed)
+            self.outputs.set(pump_id, False)
+            # In simulated pump time, so volumes and ETAs add up at any speed
+            ran = (time.monotonic() - started) * self.simulation_speed
+            if cancelled:
+                self._record_stop_latency(time.monotonic() - cancel.cancelled_at)
+            return ran
+        except Exception as e:
+            # Ensure pump is turned off even if there's an error
+            try:
+                self.outputs.set(pump_id, False)
+            except Exception:
+                pass
+            logging.error(f"GPIO error for pump {pump_id}: {e}")
+            raise
+    
+    def set_pump(self, pump_id, on=True):
+        """Directly activate or deactivate a pump."""
+        if pump_id not in self.pump_pins:
+            logging.error(f"No GPIO pin for pump {pump_id}")
+            return
+        if self.outputs.simulated:
+            logging.warning(f"Simulating pump {pump_id} -> {'ON' if on else 'OFF'}")
+        
+        try:
+            self.outputs.set(pump_id, on)
+        except Exception as e:
+            logging.error(f"GPIO error for pump {pump_id}: {e}")
+            raise
+    
+    # ---------- Manual runs (calibration and priming) ----------
+    
+    def start_run(self, pump_id, purpose):
+        """Turn a pump on and remember when, for calibration or priming."""
+        self.run_starts[(purpose, pump_id)] = time.time()
+        self.set_pump(pump_id, on=True)
+    
+    def stop_run(self, pump_id, purpose):
+        """
+        Turn a pump off after a manual run.
+        
+        Returns:
+            float: Run duration in seconds, or None if the run wasn't started
+        """
+        start_t = self.run_starts.pop((purpose, pump_id), None)
+        try:
+            if start_t is None:
+                return None
+            duration = time.time() - start_t
+            self.last_run_times[(purpose, pump_id)] = duration
+            record_pump_run(pump_id, duration, purpose)
+            return duration
+        finally:
+            # Make sure the pump is off whatever happened
+            self.set_pump(pump_id, on=False)
+    
+    def take_last_run(self, pump_id, purpose):
+        """
+        Get and clear the duration of the last manual run of a pump.
+        
+        Returns:
+            float: Duration in seconds, 0 if none was recorded
+        """
+        return self.last_run_times.pop((purpose, pump_id), 0.0)
+    
+    # ---------- Automated calibration ----------
+    
+    def run_calibration(self, pump_ids, seconds):
+        """
+        Run several pumps at once for the same server-timed duration.
+        
+        All pumps switch on in one write and off in one write, and the run is
+        timed here rather than by a held button, so every pump gets the same
+        exact run time. Each pump's run is then recorded like a manual
+        calibration run, for take_last_run once its volume is measured.
+        
+        Args:
+            pump_ids (list): Pumps to run
+            seconds (float): Run time in seconds
+        
+        Returns:
+            dict: The cycle, as calibration_status() gives it
+        
+        Raises:
+            PumpBusyError: While orders are queued or pouring, or another
+                           cycle is running
+            ValueError: On an unknown or unavailable pump, or a run time that
+                        isn't positive
+        """
+        pump_ids = sorted({int(p) for p in pump_ids})
+        unknown = [p for p in pump_ids if p not in self.pump_pins]
+        if not pump_ids or unknown:
+            raise ValueError(f"Unknown pumps: {unknown}" if unknown else "No pumps selected")
+        unavailable = [p for p in pump_ids if p in self.outputs.unavailable]
+        if unavailable:
+            raise ValueError(f"Pumps {unavailable} are unavailable: their GPIO failed to initialize")
+        seconds = float(seconds)
+        if seconds <= 0:
+            raise ValueError("Calibration run time must be positive")
+        
+        with self.lock:
+            if self.calibration is not None and self.calibration['state'] == 'running':
+                raise PumpBusyError("A calibration cycle is already running")
+            if self.orders or self.active_pumps:
+                raise PumpBusyError("Pumps are busy, calibrate when no drinks are pouring")
+            # Held like an order's pumps, so orders placed meanwhile wait
+            self.active_pumps |= set(pump_ids)
+            self.calibration = {
+                'pumps': pump_ids,
+                'seconds': seconds,
+                'state': 'running',
+                'started_at': time.time(),
+                'ran_seconds': None,
+                'error': None,
+                'cancel': CancelToken()
+            }
+            cycle = self.calibration
+        
+        threading.Thread(target=self._calibrate, args=(cycle,), name="calibration", daemon=True).start()
+        self._emit('calibration_start', self.calibration_status())
+        return self.calibration_status()
+    
+    def calibration_status(self):
+        """
+        Get the running or last calibration cycle.
+        
+        Returns:
+            dict: pumps, requested seconds, state ('running', 'done',
+                  'cancelled' or 'failed'), ran_seconds and error; None if
+                  no cycle has run
+        """
+        with self.lock:
+            if self.calibration is None:
+                return None
+            return {k: v for k, v in self.calibration.items() if k != 'cancel'}
+    
+    def _calibrate(self, cycle):
+        """Thread function for one calibration cycle."""
+        cancel = cycle['cancel']
+        pump_ids = cycle['pumps']
+        if self.outputs.simulated:
+            logging.warning(f"Simulating calibration of pumps {pump_ids} for {cycle['seconds']}s")
+        
+        try:
+            self.outputs.write({pump_id: True for pump_id in pump_ids})
+            started = time.monotonic()
+            cancelled = cancel.wait(cycle['seconds'] / self.simulation_speed)
+            self.outputs.write({pump_id: False for pump_id in pump_ids})
+            ran = (time.monotonic() - started) * self.simulation_speed
+            
+            for pump_id in pump_ids:
+                self.last_run_times[('calibration', pump_id)] = ran
+                record_pump_run(pump_id, ran, 'calibration')
+            cycle['ran_seconds'] = round(ran, 3)
+            if cancelled:
+                cycle['state'] = 'cancelled'
+                cycle['error'] = cancel.reason
+            else:
+                cycle['state'] = 'done'
+        except Exception as e:
+            # Ensure the pumps are off even if there's an error
+            try:
+                self.outputs.write({pump_id: False for pump_id in pump_ids})
+            except Exception:
+                pass
+            cycle['state'] = 'failed'
+            cycle['error'] = str(e)
+            logging.error(f"Error in calibration cycle of pumps {pump_ids}: {e}")
+        finally:
+            cancel.stopped.set()
+            with self.lock:
+                self.active_pumps -= set(pump_ids)
+            self._emit('calibration_complete', self.calibration_status())
+            self._schedule()
+    
+    # ---------- Stopping ----------
+    
+    def cancel(self, order_id, reason="Pour cancelled"):
+        """
+        Cancel a queued or pouring order.
+        
+        A queued order is dropped; a pouring one stops its pump at once and
+        records the volume dispensed so far.
+        
+        Returns:
+            bool: False if there is no such order
+        """
+        with self.lock:
+            order = self.orders.get(order_id)
+            if order is None:
+                return False
+            order['cancel'].cancel(reason)
+            queued = order['state'] == 'queued'
+            if queued:
+                del self.orders[order_id]
+                self._record_finished(order_id, reason)
+        if queued:
+            self._emit('mixing_error', {'order_id': order_id, 'station': None, 'error': reason})
+            self._schedule()
+        return True
+    
+    def emergency_stop(self):
+        """
+        Cancel every order and drive every pump output low.
+        
+        Returns:
+            dict: Orders cancelled and how long the pour threads took to
+                  confirm their pumps were off, in milliseconds
+        """
+        requested = time.monotonic()
+        with self.lock:
+            orders = list(self.orders.values())
+            # Tokens first: a pour thread raising a pin after the loop
+            # below sees its token set and drops it again right away
+            for order in orders:
+                order['cancel'].cancel("Emergency stop activated")
+                if order['state'] == 'queued':
+                    self._record_finished(order['order_id'], "Emergency stop activated")
+            if self.calibration is not None:
+                self.calibration['cancel'].cancel("Emergency stop activated")
+            self.orders.clear()
+            self.active_pumps.clear()
+            self.busy_stations.clear()
+            self.last_error = "Emergency stop activated"
+        
+        try:
+            # One write per device, however many pumps it drives
+            self.outputs.all_off()
+        except Exception as e:
+            logging.error(f"Error turning off pumps: {e}")
+        
+        # Pour threads report their own orders; queued ones would otherwise
+        # leave their progress pages waiting for good
+        for order in orders:
+            if order['state'] == 'queued':
+                self._emit('mixing_error', {'order_id': order['order_id'], 'station': None,
+                                            'error': "Emergency stop activated"})
+        
+        pouring = [o for o in orders if o['state'] == 'pouring']
+        deadline = requested + self.STOP_CONFIRM_TIMEOUT
+        confirmed = all(o['cancel'].stopped.wait(max(0.0, deadline - time.monotonic())) for o in pouring)
+        latency = time.monotonic() - requested
+        if not confirmed:
+            logging.error(f"Pour threads did not confirm the emergency stop within {latency * 1000:.0f}ms")
+        logging.warning(f"Emergency stop: {len(orders)} orders cancelled in {latency * 1000:.1f}ms")
+        return {'cancelled': len(orders), 'confirmed': confirmed, 'latency_ms': round(latency * 1000, 3)}
+    
+    def close(self):
+        """Release the GPIO pins and expanders."""
+        self.outputs.close()
+
+
+# -------------------- Unix socket daemon --------------------
+
+class _ControllerRequestHandler(socketserver.StreamRequestHandler):
+    """Handle one client connection: JSON requests in, JSON responses out."""
+    
+    def handle(self):
+        controller = self.server.controller
+        for line in self.rfile:
+            if not line.strip():
+                continue
+            try:
+                request = json.loads(line)
+                op = request.pop('op')
+                if op == 'events':
+                    self._reply({'ok': True})
+                    self._stream_events(controller)
+                    return
+                result = self._dispatch(controller, op, request)
+                self._reply({'ok': True, 'result': result})
+            except PumpBusyError as e:
+                self._reply({'ok': False, 'busy': True, 'error': str(e)})
+            except OrderRejected as e:
+                self._reply({'ok': False, 'rejected': True, 'error': str(e)})
+            except DuplicateOrder as e:
+                self._reply({'ok': False, 'duplicate': True, 'error': str(e)})
+            except Exception as e:
+                logging.error(f"Pump controller request failed: {e}", exc_info=True)
+                self._reply({'ok': False, 'error': str(e)})
+    
+    def _dispatch(self, controller, op, args):
+        if op == 'status':
+            return controller.status()
+        if op == 'admit':
+            return controller.admit(args.get('client'), args.get('idempotency_key'))
+        if op == 'pour':
+            return controller.pour(args['recipe'], args['total_volume'], args.get('order_id'),
+                                   args.get('idempotency_key'), args.get('key_ttl'))
+        if op == 'emergency_stop':
+            return controller.emergency_stop()
+        if op == 'cancel':
+            return controller.cancel(args['order_id'])
+        if op == 'set_pump':
+            return controller.set_pump(int(args['pump_id']), bool(args['on']))
+        if op == 'start_run':
+            return controller.start_run(int(args['pump_id']), args['purpose'])
+        if op == 'stop_run':
+            return controller.stop_run(int(args['pump_id']), args['purpose'])
+        if op == 'take_last_run':
+            return controller.take_last_run(int(args['pump_id']), args['purpose'])
+        if op == 'run_calibration':
+            return controller.run_calibration(args['pump_ids'], args['seconds'])
+        if op == 'calibration_status':
+            return controller.calibration_status()
+        raise ValueError(f"Unknown operation: {op}")
+    
+    def _reply(self, message):
+        self.wfile.write((json.dumps(message) + '\n').encode('utf-8'))
+        self.wfile.flush()
+    
+    def _stream_events(self, controller):
+        """Forward events to this client until it disconnects."""
+        # The pour thread only enqueues, so a slow client never delays a pump
+        events = Queue(maxsize=1000)
+        
+        def listener(event, data):
+            if not events.full():
+                events.put((event, data))
+        
+        controller.add_listener(listener)
+        try:
+            while True:
+                try:
+                    event, data = events.get(timeout=15)
+                    self._reply({'event': event, 'data': data})
+                except Empty:
+                    self._reply({'event': 'keepalive'})
+        except OSError:
+            pass
+        finally:
+            controller.remove_listener(listener)
+
+
+class ControllerServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    """Serve a PumpController over a Unix socket."""
+    
+    daemon_threads = True
+    
+    def __init__(self, socket_path, controller):
+        if os.path.exists(socket_path):
+            os.remove(socket_path)
+        self.controller = controller
+        super().__init__(socket_path, _ControllerRequestHandler)
+        os.chmod(socket_path, 0o660)
+
+
+class ControllerClient:
+    """Talk to a pump controller daemon; same interface as PumpController."""
+    
+    def __init__(self, socket_path, timeout=5.0):
+        self.socket_path = socket_path
+        self.timeout = timeout
+        self.listeners = []
+        self._event_thread = None
+    
+    def _call(self, op, **args):
+        request = dict(args, op=op)
+        try:
+            with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+                sock.settimeout(self.timeout)
+                sock.connect(self.socket_path)
+                sock.sendall((json.dumps(request) + '\n').encode('utf-8'))
+                with sock.makefile('rb') as f:
+                    line = f.readline()
+        except OSError as e:
+            raise ControllerError(f"Pump controller unavailable: {e}") from e
+        
+        if not line:
+            raise ControllerError("Pump controller closed the connection")
+        response = json.loads(line)
+        if response.get('busy'):
+            raise PumpBusyError(response.get('error'))
+        if response.get('rejected'):
+            raise OrderRejected(response.get('error'))
+        if response.get('duplicate'):
+            raise DuplicateOrder(response.get('error'))
+        if not response.get('ok'):
+            raise ControllerError(response.get('error'))
+        return response.get('result')
+    
+    def status(self):
+        return self._call('status')
+    
+    def admit(self, client, idempotency_key=None):
+        return self._call('admit', client=client, idempotency_key=idempotency_key)
+    
+    def pour(self, recipe, total_volume, order_id=None, idempotency_key=None, key_ttl=None):
+        return self._call('pour', recipe=dict(recipe), total_volume=total_volume, order_id=order_id,
+                          idempotency_key=idempotency_key, key_ttl=key_ttl)
+    
+    def emergency_stop(self):
+        return self._call('emergency_stop')
+    
+    def cancel(self, order_id):
+        return self._call('cancel', order_id=order_id)
+    
+    def set_pump(self, pump_id, on=True):
+        return self._call('set_pump', pump_id=pump_id, on=on)
+    
+    def start_run(self, pump_id, purpose):
+        return self._call('start_run', pump_id=pump_id, purpose=purpose)
+    
+    def stop_run(self, pump_id, purpose):
+        return self._call('stop_run', pump_id=pump_id, purpose=purpose)
+    
+    def take_last_run(self, pump_id, purpose):
+        return self._call('take_last_run', pump_id=pump_id, purpose=purpose)
+    
+    def run_calibration(self, pump_ids, seconds):
+        return self._call('run_calibration', pump_ids=list(pump_ids), seconds=seconds)
+    
+    def calibration_status(self):
+        return self._call('calibration_status')
+    
+    def add_listener(self, callback):
+        """Register callback(event, data); events are relayed from the daemon."""
+        self.listeners.append(callback)
+        if self._event_thread is None:
+            self._event_thread = threading.Thread(target=self._relay_events,
+                                                  name="pump-events", daemon=True)
+            self._event_thread.start()
+    
+    def remove_listener(self, callback):
+        if callback in self.listeners:
+            self.listeners.remove(callback)
+    
+    def _relay_events(self):
+        """Subscribe to the daemon's events, reconnecting if it restarts."""
+        while True:
+            try:
+                with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+                    sock.connect(self.socket_path)
+                    sock.sendall(b'{"op": "events"}\n')
+                    with sock.makefile('rb') as f:
+                        f.readline()  # Subscription acknowledgement
+                        for line in f:
+                            message = json.loads(line)
+                            if message.get('event') == 'keepalive':
+                                continue
+                            for callback in list(self.listeners):
+                                try:
+                                    callback(message['event'], message.get('data'))
+                                except Exception:
+                                    logging.error("Error delivering pump event", exc_info=True)
+            except (OSError, ValueError) as e:
+                logging.warning(f"Pump event stream interrupted: {e}")
+            time.sleep(1)
+    
+    def close(self):
+        pass
+
+
+if __name__ == '__main__':
+    from config import Config
+    from admission import RateLimiter
+    from logging_pipeline import setup_logging
+    from utils import start_usage_compactor
+    
+    parser = argparse.ArgumentParser(description="Pump controller daemon owning the GPIO pins")
+    parser.add_argument('--socket', default=Config.PUMP_CONTROLLER_SOCKET or '/tmp/mixer-pumps.sock',
+                        help="Unix socket path to listen on")
+    args = parser.parse_args()
+    
+    # Log to a file of our own; the web workers rotate app.log
+    logging_config = copy.deepcopy(Config.LOGGING_CONFIG)
+    logging_config['handlers']['file']['filename'] = os.path.join(Config.LOGS_DIR, 'pump_controller.log')
+    os.makedirs(Config.LOGS_DIR, exist_ok=True)
+    setup_logging(logging_config)
+    
+    start_usage_compactor(Config.USAGE_COMPACT_INTERVAL_SECONDS)
+    controller = PumpController(Config.PUMP_GPIO_PINS, Config.CUP_STATIONS, Config.ORDER_QUEUE_LIMIT,
+                                simulation_speed=Config.PUMP_SIMULATION_SPEED, expanders=Config.GPIO_EXPANDERS,
+                                rate_limiter=RateLimiter(Config.MIX_RATE_PER_MINUTE / 60.0, Config.MIX_RATE_BURST),
+                                idempotency_ttl=Config.IDEMPOTENCY_TTL_SECONDS)
+    server = ControllerServer(args.socket, controller)
+    logging.info(f"Pump controller listening on {args.socket}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        controller.emergency_stop()
+        controller.close()
+        server.server_close()
+        os.remove(args.socket)
@@ -0,0 +1,329 @@
+"""
+Pump output pins on the Pi's own GPIO and on I2C GPIO expanders.
+
+The pin map in Config.PUMP_GPIO_PINS decides where each pump is wired:
+
+    PUMP_GPIO_PINS = {1: 17, 2: 18, 9: 'x1:0', 10: 'x1:1'}
+    GPIO_EXPANDERS = {'x1': {'type': 'mcp23017', 'bus': 1, 'address': 0x20}}
+
+An int is a BCM pin on the Pi; 'name:pin' is a pin on an expander. An
+MCP23017 has 16 outputs in two 8-bit ports, so two boards take a unit to
+32 extra pumps. Expander pins are written a whole port at a time from a
+cached output latch, so switching many pumps (an emergency stop) costs one
+I2C transaction per board instead of one per pin.
+
+Devices whose driver is missing (RPi.GPIO or smbus2 off the Pi) are
+simulated, as is any expander configured with type 'simulated'. A device
+whose driver is there but which fails to initialize (wrong address, bus
+fault) is not: its pumps are unavailable, so they can't "pour" nothing
+while the rest of the unit runs on real hardware.
+"""
+import logging
+import threading
+
+try:
+    import RPi.GPIO as GPIO
+except ImportError:
+    # For development environments without GPIO
+    GPIO = None
+
+try:
+    import smbus2
+except ImportError:
+    smbus2 = None
+
+# Expander name used for the Pi's own GPIO pins
+NATIVE = 'gpio'
+
+
+def parse_pin(pin):
+    """
+    Split a pin map entry into device and pin.
+    
+    Args:
+        pin: BCM pin number, or 'expander:pin'
+    
+    Returns:
+        tuple: (device name, pin number)
+    """
+    if isinstance(pin, int):
+        return NATIVE, pin
+    device, _, number = str(pin).partition(':')
+    if not number:
+        return NATIVE, int(device)
+    return device, int(number)
+
+
+class NativePins:
+    """Output pins on the Pi's own GPIO header."""
+    
+    simulated = False
+    
+    def __init__(self, gpio):
+        self.gpio = gpio
+    
+    def setup(self, pins):
+        self.gpio.setmode(self.gpio.BCM)
+        for pin in pins:
+            self.gpio.setup(pin, self.gpio.OUT)
+            self.gpio.output(pin, self.gpio.LOW)
+    
+    def write(self, states):
+        """Drive pins high or low: {pin: on}."""
+        for pin, on in states.items():
+            self.gpio.output(pin, self.gpio.HIGH if on else self.gpio.LOW)
+    
+    def close(self):
+        self.gpio.cleanup()
+
+
+class MCP23017:
+    """16 outputs on an MCP23017 I2C expander, written a port at a time."""
+    
+    simulated = False
+    
+    # Register addresses with IOCON.BANK = 0 (the power-on default), where
+    # each port A register is directly followed by its port B twin
+    IODIRA = 0x00
+    OLATA = 0x14
+    
+    def __init__(self, bus, address):
+        self.address = address
+        self.bus = smbus2.SMBus(bus) if bus is not None else None
+        self.latch = [0, 0]  # Output latch of ports A and B, as last written
+        self.writes = 0      # I2C transactions, for the status page
+    
+    def _write_registers(self, register, values):
+        self.bus.write_i2c_block_data(self.address, register, values)
+        self.writes += 1
+    
+    def setup(self, pins):
+        # Latch low before switching to outputs, so no pump blips on
+        self.latch = [0, 0]
+        self._write_registers(self.OLATA, self.latch)
+        self._write_registers(self.IODIRA, [0x00, 0x00])
+    
+    def write(self, states):
+        """
+        Drive pins high or low: {pin: on}, pins 0-7 on port A and 8-15 on B.
+        
+        Only the ports that change are written, both in one transaction.
+        """
+        latch = list(self.latch)
+        for pin, on in states.items():
+            port, bit = divmod(pin, 8)
+            if on:
+                latch[port] |= 1 << bit
+            else:
+                latch[port] &= ~(1 << bit)
+        if latch == self.latch:
+            return
+        if latch[0] != self.latch[0] and latch[1] != self.latch[1]:
+            self._write_registers(self.OLATA, latch)
+        elif latch[0] != self.latch[0]:
+            self._write_registers(self.OLATA, latch[:1])
+        else:
+            self._write_registers(self.OLATA + 1, latch[1:])
+        self.latch = latch
+    
+    def close(self):
+        if self.bus is not None:
+            self.bus.close()
+
+
+class SimulatedMCP23017(MCP23017):
+    """An MCP23017 that keeps its latch in memory, for tests and development."""
+    
+    simulated = True
+    
+    def __init__(self, address=0x20):
+        super().__init__(None, address)
+        self.registers = {}
+    
+    def _write_registers(self, register, values):
+        for offset, value in enumerate(values):
+            self.registers[register + offset] = value
+        self.writes += 1
+    
+    def is_on(self, pin):
+        port, bit = divmod(pin, 8)
+        return bool(self.latch[port] & (1 << bit))
+
+
+class SimulatedPins:
+    """Stand-in for the Pi's GPIO header off the Pi."""
+    
+    simulated = True
+    
+    def __init__(self):
+        self.states = {}
+    
+    def setup(self, pins):
+        self.states = {pin: False for pin in pins}
+    
+    def write(self, states):
+        self.states.update(states)
+    
+    def close(self):
+        pass
+
+
+class UnavailablePins:
+    """A device that failed to initialize; its pumps can only be switched off."""
+    
+    simulated = False
+    
+    def __init__(self, name, error):
+        self.name = name
+        self.error = error
+    
+    def setup(self, pins):
+        pass
+    
+    def write(self, states):
+        if any(states.values()):
+            raise RuntimeError(f"GPIO {self.name} is unavailable: {self.error}")
+    
+    def close(self):
+        pass
+
+
+EXPANDER_TYPES = {'mcp23017': MCP23017}
+
+
+class PumpOutputs:
+    """Switch pumps by ID, whichever device their pin is on."""
+    
+    def __init__(self, pump_pins, expanders=None):
+        """
+        Args:
+            pump_pins (dict): Pump ID to BCM pin or 'expander:pin'
+            expanders (dict): Expander name to {'type', 'bus', 'address'}
+        
+        Raises:
+            ValueError: On a pin map entry naming an unknown expander, a pin
+                        out of range or a pin used by two pumps
+        """
+        expanders = expanders or {}
+        self.pins = {}  # Pump ID -> (device name, pin)
+        for pump_id, pin in pump_pins.items():
+            device, number = parse_pin(pin)
+            if device != NATIVE:
+                if device not in expanders:
+                    raise ValueError(f"Pump {pump_id} is on unknown expander {device!r}")
+                if not 0 <= number < 16:
+                    raise ValueError(f"Pump {pump_id} is on pin {number} of {device}, which has pins 0-15")
+            if (device, number) in self.pins.values():
+                raise ValueError(f"Pump {pump_id} shares pin {pin} with another pump")
+            self.pins[int(pump_id)] = (device, number)
+        
+        self.devices = {}
+        for device in sorted({device for device, _ in self.pins.values()}):
+            pins = sorted(number for d, number in self.pins.values() if d == device)
+            self.devices[device] = self._open(device, expanders.get(device), pins)
+        
+        # One writer at a time, so two threads can't interleave latch updates
+        self.lock = threading.Lock()
+    
+    def _open(self, name, spec, pins):
+        """
+        Set up one device, falling back to a simulated one without its driver.
+        
+        A device whose driver is present but which fails to open or set up
+        is replaced by UnavailablePins, never by a simulated one.
+        """
+        if name == NATIVE:
+            if GPIO is None:
+                logging.warning("GPIO not available - running in simulation mode")
+                open_device = SimulatedPins
+            else:
+                open_device = lambda: NativePins(GPIO)
+        else:
+            kind = spec.get('type', 'mcp23017')
+            if kind == 'simulated':
+                open_device = lambda: SimulatedMCP23017(spec.get('address', 0x20))
+            elif kind not in EXPANDER_TYPES:
+                raise ValueError(f"Unknown GPIO expander type for {name}: {kind}")
+            elif smbus2 is None:
+                logging.warning(f"smbus2 not available - simulating GPIO expander {name}")
+                open_device = lambda: SimulatedMCP23017(spec.get('address', 0x20))
+            else:
+                open_device = lambda: EXPANDER_TYPES[kind](spec.get('bus', 1), spec['address'])
+        
+        try:
+            device = open_device()
+            device.setup(pins)
+            if not device.simulated:
+                logging.info(f"GPIO {name} initialized with {len(pins)} pump outputs")
+        except Exception as e:
+            logging.error(f"Failed to initialize GPIO {name}, its pumps are unavailable: {e}")
+            device = UnavailablePins(name, e)
+        return device
+    
+    @property
+    def simulated(self):
+        """True when no pump is wired to real hardware."""
+        return all(device.simulated for device in self.devices.values())
+    
+    @property
+    def unavailable(self):
+        """Pumps on devices that failed to initialize."""
+        return {pump_id for pump_id, (device, _) in self.pins.items()
+                if isinstance(self.devices[device], UnavailablePins)}
+    
+    def write(self, states):
+        """
+        Switch several pumps at once, one write per device.
+        
+        Args:
+            states (dict): Pump ID to on (True) or off (False); unknown
+                           pumps are logged and skipped
+        """
+        by_device = {}
+        for pump_id, on in states.items():
+            if pump_id not in self.pins:
+                logging.error(f"No GPIO pin for pump {pump_id}")
+                continue
+            device, pin = self.pins[pump_id]
+            by_device.setdefault(device, {})[pin] = on
+        
+        with self.lock:
+            errors = []
+            # Every device gets its write even if another one fails
+            for device, pins in by_device.items():
+                try:
+                    self.devices[device].write(pins)
+                except Exception as e:
+                    logging.error(f"GPIO error on {device}: {e}")
+                    errors.append(e)
+            if errors:
+                raise errors[0]
+    
+    def set(self, pump_id, on=True):
+        """Switch one pump."""
+        self.write({pump_id: on})
+    
+    def all_off(self):
+        """Drive every pump output low."""
+        self.write({pump_id: False for pump_id in self.pins})
+    
+    def status(self):
+        """Devices with their kind, I2C transaction counts and any initialization error."""
+        return {
+            name: {
+                'type': type(device).__name__,
+                'simulated': device.simulated,
+                'pumps': sorted(p for p, (d, _) in self.pins.items() if d == name),
+                'writes': getattr(device, 'writes', None),
+                'error': str(device.error) if isinstance(device, UnavailablePins) else None
+            }
+            for name, device in self.devices.items()
+        }
+    
+    def close(self):
+        """Release the devices."""
+        for device in self.devices.values():
+            try:
+                device.close()
+            except Exception as e:
+                logging.error(f"Error releasing GPIO: {e}")
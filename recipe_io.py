@@ -0,0 +1,296 @@
+"""
+Bulk recipe import and export as JSON Lines or CSV recipe packs.
+
+Imports stream the pack one row at a time, validate and normalize each
+recipe, then merge everything into the catalog with a single save. Exports
+stream the catalog back out in either format.
+
+JSON Lines: one recipe per line,
+    {"drink_name": "Margarita", "ingredients": {"Tequila": 53, "Triple Sec": 26, "Lime Juice": 21}, "notes": ""}
+
+CSV: a header row with drink_name, ingredients and notes, where ingredients
+is "Tequila=53; Triple Sec=26; Lime Juice=21". The recipe form's
+ingredient_1/percentage_1 ... column pairs are accepted too.
+
+From the command line:
+
+    python recipe_io.py import bar_menu.csv
+    python recipe_io.py export --format jsonl --output recipes.jsonl
+"""
+import io
+import re
+import csv
+import sys
+import json
+import argparse
+from threading import Lock
+
+from utils import load_all_recipes, save_all_recipes, canonical_ingredient_name, make_recipe
+
+FORMATS = ('jsonl', 'csv')
+
+# Recipes whose percentages add up to something in this range are scaled to
+# 100%, the same tolerance the recipe form accepts; anything else is rejected
+PERCENTAGE_TOLERANCE = (95.0, 105.0)
+
+# Errors reported back per import; the rest are only counted
+MAX_REPORTED_ERRORS = 100
+
+# Imports hold this from loading the catalog until it is saved again
+_import_lock = Lock()
+
+
+class RecipeRowError(ValueError):
+    """Raised for a recipe row that can't be imported."""
+
+
+def detect_format(filename, default='jsonl'):
+    """Guess the pack format from a file name."""
+    if filename and filename.lower().endswith('.csv'):
+        return 'csv'
+    if filename and filename.lower().endswith(('.jsonl', '.ndjson', '.json')):
+        return 'jsonl'
+    return default
+
+def _clean_name(value):
+    """Strip and collapse whitespace in a drink or ingredient name."""
+    return re.sub(r'\s+', ' ', str(value or '')).strip()
+
+def _parse_ingredient_list(value):
+    """Parse "Vodka=29; Lime Juice=12" (":" also works) into a dict."""
+    ingredients = {}
+    for part in str(value or '').split(';'):
+        if not part.strip():
+            continue
+        name, sep, percentage = part.rpartition('=')
+        if not sep:
+            name, sep, percentage = part.rpartition(':')
+        if not sep:
+            raise RecipeRowError(f"Ingredient without a percentage: {part.strip()!r}")
+        ingredients[name] = percentage
+    return ingredients
+
+def normalize_recipe(row):
+    """
+    Validate one imported row and turn it into a catalog recipe.
+    
+    Args:
+        row (dict): Parsed JSON object or CSV row
+    
+    Returns:
+        dict: Recipe with drink_name, ingredients and notes; no drink_id
+    
+    Raises:
+        RecipeRowError: If the row isn't a usable recipe
+    """
+    if not isinstance(row, dict):
+        raise RecipeRowError("Row is not an object")
+    
+    drink_name = _clean_name(row.get('drink_name') or row.get('name'))
+    if not drink_name:
+        raise RecipeRowError("Missing drink_name")
+    
+    raw = row.get('ingredients')
+    if isinstance(raw, str):
+        raw = _parse_ingredient_list(raw)
+    elif raw is None:
+        # The recipe form's numbered column pairs
+        raw = {row.get(f'ingredient_{i}'): row.get(f'percentage_{i}')
+               for i in range(1, 100) if row.get(f'ingredient_{i}')}
+    if not isinstance(raw, dict) or not raw:
+        raise RecipeRowError(f"{drink_name}: no ingredients")
+    
+    ingredients = {}
+    for name, percentage in raw.items():
+        name = _clean_name(name)
+        try:
+            percentage = float(percentage)
+        except (TypeError, ValueError):
+            raise RecipeRowError(f"{drink_name}: invalid percentage for {name}: {percentage!r}")
+        if not name or percentage <= 0:
+            raise RecipeRowError(f"{drink_name}: invalid ingredient {name!r} ({percentage})")
+        # "lime juice" and "Lime Juice" are one ingredient, spelled as the registry does
+        name = canonical_ingredient_name(name)
+        ingredients[name] = ingredients.get(name, 0.0) + percentage
+    
+    total = sum(ingredients.values())
+    low, high = PERCENTAGE_TOLERANCE
+    if not low <= total <= high:
+        raise RecipeRowError(f"{drink_name}: ingredients add up to {total:g}%, not 100%")
+    ingredients = {name: round(percentage * 100.0 / total, 2) for name, percentage in ingredients.items()}
+    
+    return {
+        'drink_name': drink_name,
+        'ingredients': ingredients,
+        'notes': _clean_name(row.get('notes'))
+    }
+
+def iter_rows(stream, fmt):
+    """
+    Read rows from a recipe pack one at a time.
+    
+    Args:
+        stream: Text stream of the pack
+        fmt (str): 'jsonl' or 'csv'
+    
+    Yields:
+        tuple: (line number, row dict or RecipeRowError)
+    """
+    if fmt == 'csv':
+        reader = csv.DictReader(stream)
+        for row in reader:
+            yield reader.line_num, row
+        return
+    
+    for line_number, line in enumerate(stream, 1):
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            yield line_number, json.loads(line)
+        except ValueError as e:
+            yield line_number, RecipeRowError(f"Invalid JSON: {e}")
+
+def import_recipes(stream, fmt='jsonl', on_duplicate='update'):
+    """
+    Import a recipe pack into the catalog in one save.
+    
+    A recipe whose name matches an existing drink (ignoring case) replaces
+    its ingredients and notes and keeps its ID; new drinks get IDs after the
+    highest one in use. If the pack names a drink twice, the last row wins.
+    
+    Args:
+        stream: Text stream of the pack
+        fmt (str): 'jsonl' or 'csv'
+        on_duplicate (str): 'update' to overwrite existing drinks, 'skip' to
+                            leave them alone
+    
+    Returns:
+        dict: Counts of added, updated, skipped and invalid rows, plus the
+              first errors as {line, error}
+    """
+    if fmt not in FORMATS:
+        raise ValueError(f"Unknown recipe pack format: {fmt}")
+    if on_duplicate not in ('update', 'skip'):
+        raise ValueError(f"Unknown duplicate handling: {on_duplicate}")
+    
+    incoming = {}
+    errors = []
+    error_count = 0
+    for line_number, row in iter_rows(stream, fmt):
+        try:
+            if isinstance(row, RecipeRowError):
+                raise row
+            recipe = normalize_recipe(row)
+        except RecipeRowError as e:
+            error_count += 1
+            if len(errors) < MAX_REPORTED_ERRORS:
+                errors.append({'line': line_number, 'error': str(e)})
+            continue
+        incoming[recipe['drink_name'].lower()] = recipe
+    
+    added = updated = skipped = 0
+    with _import_lock:
+        recipes = load_all_recipes()
+        by_name = {r['drink_name'].lower(): i for i, r in enumerate(recipes)}
+        next_id = max([r['drink_id'] for r in recipes] + [0]) + 1
+        
+        for key, recipe in incoming.items():
+            index = by_name.get(key)
+            if index is None:
+                recipes.append(make_recipe(next_id, recipe['drink_name'], recipe['ingredients'], recipe['notes']))
+                next_id += 1
+                added += 1
+            elif on_duplicate == 'update':
+                existing = recipes[index]
+                recipes[index] = make_recipe(existing.drink_id, existing.drink_name,
+                                             recipe['ingredients'], recipe['notes'])
+                updated += 1
+            else:
+                skipped += 1
+        
+        if added or updated:
+            save_all_recipes(recipes)
+    
+    return {
+        'added': added,
+        'updated': updated,
+        'skipped': skipped,
+        'invalid': error_count,
+        'errors': errors
+    }
+
+def export_recipes(fmt='jsonl', recipes=None):
+    """
+    Stream the catalog as a recipe pack.
+    
+    Args:
+        fmt (str): 'jsonl' or 'csv'
+        recipes (list): Recipes to export; the whole catalog by default
+    
+    Yields:
+        str: Chunks of the pack, one recipe per chunk after the CSV header
+    """
+    if fmt not in FORMATS:
+        raise ValueError(f"Unknown recipe pack format: {fmt}")
+    if recipes is None:
+        recipes = load_all_recipes()
+    
+    if fmt == 'jsonl':
+        for recipe in recipes:
+            yield json.dumps(dict(recipe)) + '\n'
+        return
+    
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(['drink_id', 'drink_name', 'ingredients', 'notes'])
+    for recipe in recipes:
+        writer.writerow([
+            recipe['drink_id'],
+            recipe['drink_name'],
+            '; '.join(f"{name}={percentage:g}" for name, percentage in recipe['ingredients'].items()),
+            recipe.get('notes', '')
+        ])
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+    # Header only, for an empty catalog
+    if buffer.getvalue():
+        yield buffer.getvalue()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Import or export recipe packs")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    
+    import_parser = subparsers.add_parser('import', help="Merge a recipe pack into the catalog")
+    import_parser.add_argument('path', help="Pack file, or - for stdin")
+    import_parser.add_argument('--format', choices=FORMATS, help="Default: from the file extension")
+    import_parser.add_argument('--skip-existing', action='store_true',
+                               help="Leave drinks that already exist unchanged")
+    
+    export_parser = subparsers.add_parser('export', help="Write the catalog as a recipe pack")
+    export_parser.add_argument('--format', choices=FORMATS, default='jsonl')
+    export_parser.add_argument('--output', default='-', help="Output file, or - for stdout")
+    args = parser.parse_args()
+    
+    if args.command == 'import':
+        fmt = args.format or detect_format(args.path)
+        if args.path == '-':
+            summary = import_recipes(sys.stdin, fmt, 'skip' if args.skip_existing else 'update')
+        else:
+            with open(args.path, 'r', encoding='utf-8-sig', newline='') as f:
+                summary = import_recipes(f, fmt, 'skip' if args.skip_existing else 'update')
+        for error in summary['errors']:
+            print(f"line {error['line']}: {error['error']}", file=sys.stderr)
+        print(f"{summary['added']} added, {summary['updated']} updated, "
+              f"{summary['skipped']} skipped, {summary['invalid']} invalid")
+        sys.exit(1 if summary['invalid'] else 0)
+    else:
+        out = sys.stdout if args.output == '-' else open(args.output, 'w', encoding='utf-8', newline='')
+        try:
+            for chunk in export_recipes(args.format):
+                out.write(chunk)
+        finally:
+            if out is not sys.stdout:
+                out.close()
@@ -0,0 +1,249 @@
+"""
+In-memory search index over the recipe catalog.
+
+Drink names, ingredients and notes are split into tokens. A query token
+matches a recipe token exactly, as a prefix ("marg" finds Margarita), or by
+trigram similarity, which forgives typos ("margerita"). Every query token
+has to match; name matches rank above ingredient matches, which rank above
+notes.
+
+The index follows drink_recipes.json: when the file changes, by this
+process or any other, only the recipes that differ are re-indexed.
+"""
+import os
+import re
+import heapq
+import bisect
+import logging
+import threading
+import unicodedata
+
+from utils import RECIPE_FILE, load_all_recipes, get_available_ingredient_ids, get_ingredient_id
+
+# Weight of a match in each part of a recipe
+FIELD_WEIGHTS = {'name': 3.0, 'ingredient': 2.0, 'notes': 1.0}
+
+# Weight of each kind of match
+EXACT_MATCH = 1.0
+PREFIX_MATCH = 0.8
+FUZZY_MATCH = 0.6
+
+# Least trigram similarity for a fuzzy match
+FUZZY_THRESHOLD = 0.5
+
+
+def tokenize(text):
+    """Lowercase, accent-free word tokens of a text."""
+    text = unicodedata.normalize('NFKD', str(text or '').lower())
+    text = ''.join(c for c in text if not unicodedata.combining(c))
+    return re.findall(r'[a-z0-9]+', text)
+
+def trigrams(token):
+    """Character trigrams of a token, padded so short words have some too."""
+    padded = f"  {token} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+class RecipeSearchIndex:
+    """Token, prefix and trigram index of the recipes."""
+    
+    def __init__(self, recipe_file=RECIPE_FILE):
+        self.recipe_file = recipe_file
+        self.lock = threading.Lock()
+        self.file_version = None
+        
+        self.recipes = {}       # drink_id -> recipe
+        self.doc_tokens = {}    # drink_id -> {token: weight}
+        self.doc_ingredients = {}  # drink_id -> frozenset of the recipe's ingredient_ids
+        self.postings = {}      # token -> {drink_id: weight}
+        self.vocabulary = []    # Sorted tokens, for prefix lookups
+        self.token_trigrams = {}  # trigram -> set of tokens, for fuzzy lookups
+    
+    # ---------- Keeping up to date ----------
+    
+    def _recipe_tokens(self, recipe):
+        weights = {}
+        fields = [('name', recipe['drink_name']), ('notes', recipe.get('notes', ''))]
+        fields += [('ingredient', ingredient) for ingredient in recipe.ingredient_names]
+        for field, text in fields:
+            for token in tokenize(text):
+                weights[token] = max(weights.get(token, 0.0), FIELD_WEIGHTS[field])
+        return weights
+    
+    def _add(self, recipe):
+        drink_id = recipe['drink_id']
+        tokens = self._recipe_tokens(recipe)
+        self.recipes[drink_id] = recipe
+        self.doc_tokens[drink_id] = tokens
+        # The recipe resolved its IDs when it was built; 0 (unknown) stays
+        # in, so a drink with an unknown ingredient is never makeable
+        self.doc_ingredients[drink_id] = frozenset(recipe.ingredient_ids)
+        for token, weight in tokens.items():
+            posting = self.postings.get(token)
+            if posting is None:
+                posting = self.postings[token] = {}
+                bisect.insort(self.vocabulary, token)
+                for trigram in trigrams(token):
+                    self.token_trigrams.setdefault(trigram, set()).add(token)
+            posting[drink_id] = weight
+    
+    def _remove(self, drink_id):
+        self.recipes.pop(drink_id, None)
+        self.doc_ingredients.pop(drink_id, None)
+        for token in self.doc_tokens.pop(drink_id, {}):
+            posting = self.postings[token]
+            posting.pop(drink_id, None)
+            if posting:
+                continue
+            # Last recipe with this token: drop it from the vocabulary too
+            del self.postings[token]
+            del self.vocabulary[bisect.bisect_left(self.vocabulary, token)]
+            for trigram in trigrams(token):
+                tokens = self.token_trigrams[trigram]
+                tokens.discard(token)
+                if not tokens:
+                    del self.token_trigrams[trigram]
+    
+    def upsert(self, recipe):
+        """Index a new or edited recipe."""
+        with self.lock:
+            self._remove(recipe['drink_id'])
+            self._add(recipe)
+    
+    def remove(self, drink_id):
+        """Drop a deleted recipe from the index."""
+        with self.lock:
+            self._remove(drink_id)
+    
+    def sync(self):
+        """
+        Catch up with the recipe file if it changed since the last sync.
+        
+        Only added, edited and deleted recipes are re-indexed, so this is
+        cheap after a single edit even with a large catalog.
+        """
+        try:
+            version = os.stat(self.recipe_file).st_mtime_ns
+        except OSError:
+            version = None
+        if version == self.file_version:
+            return
+        
+        recipes = load_all_recipes()
+        with self.lock:
+            current = {r['drink_id']: r for r in recipes}
+            changed = 0
+            for drink_id in [d for d in self.recipes if d not in current]:
+                self._remove(drink_id)
+                changed += 1
+            for drink_id, recipe in current.items():
+                if self.recipes.get(drink_id) != recipe:
+                    self._remove(drink_id)
+                    self._add(recipe)
+                    changed += 1
+            self.file_version = version
+        if changed:
+            logging.info(f"Recipe search index updated {changed} recipes")
+    
+    def all_recipes(self):
+        """Every recipe, as of the latest sync with the recipe file."""
+        self.sync()
+        with self.lock:
+            return list(self.recipes.values())
+    
+    def reindex_ingredients(self):
+        """
+        Re-index recipes whose ingredients resolve differently after aliases
+        changed; the recipe file itself hasn't, so sync() wouldn't notice.
+        """
+        recipes = load_all_recipes()
+        with self.lock:
+            for recipe in recipes:
+                indexed = self.recipes.get(recipe['drink_id'])
+                # Recipes compare equal on names alone, so check the IDs too
+                if indexed is not None and (indexed != recipe or indexed.ingredient_ids != recipe.ingredient_ids):
+                    self._remove(recipe['drink_id'])
+                    self._add(recipe)
+    
+    def ingredient_ids(self, drink_id):
+        """IDs of a recipe's ingredients."""
+        return self.doc_ingredients.get(drink_id, frozenset())
+    
+    # ---------- Searching ----------
+    
+    def _token_matches(self, query_token):
+        """Recipe tokens matching a query token, with the match weight."""
+        matches = {}
+        if query_token in self.postings:
+            matches[query_token] = EXACT_MATCH
+        
+        i = bisect.bisect_left(self.vocabulary, query_token)
+        while i < len(self.vocabulary) and self.vocabulary[i].startswith(query_token):
+            matches.setdefault(self.vocabulary[i], PREFIX_MATCH)
+            i += 1
+        
+        if len(query_token) >= 3:
+            query_trigrams = trigrams(query_token)
+            shared = {}
+            for trigram in query_trigrams:
+                for token in self.token_trigrams.get(trigram, ()):
+                    shared[token] = shared.get(token, 0) + 1
+            for token, count in shared.items():
+                similarity = count / (len(query_trigrams) + len(trigrams(token)) - count)
+                if similarity >= FUZZY_THRESHOLD and token not in matches:
+                    matches[token] = FUZZY_MATCH * similarity
+        return matches
+    
+    def search(self, query='', makeable=False, contains=None, limit=20):
+        """
+        Find recipes matching a query and filters.
+        
+        Args:
+            query (str): Free text; every word has to match
+            makeable (bool): Only drinks whose ingredients are all available now
+            contains (list): Ingredient names the drink must include
+            limit (int): Maximum number of results
+        
+        Returns:
+            dict: 'total' matching recipes and the best 'results', each a
+                  recipe with its 'score'
+        """
+        self.sync()
+        query_tokens = tokenize(query)
+        contains = [get_ingredient_id(c) for c in (contains or []) if c.strip()]
+        available = get_available_ingredient_ids() if makeable else None
+        
+        with self.lock:
+            if query_tokens:
+                scores = None
+                for query_token in query_tokens:
+                    token_scores = {}
+                    for token, match_weight in self._token_matches(query_token).items():
+                        for drink_id, field_weight in self.postings[token].items():
+                            score = match_weight * field_weight
+                            if score > token_scores.get(drink_id, 0.0):
+                                token_scores[drink_id] = score
+                    if scores is None:
+                        scores = token_scores
+                    else:
+                        scores = {d: s + token_scores[d] for d, s in scores.items() if d in token_scores}
+                    if not scores:
+                        break
+            else:
+                scores = dict.fromkeys(self.recipes, 0.0)
+            
+            ranked = []
+            for drink_id, score in scores.items():
+                recipe = self.recipes[drink_id]
+                ingredients = self.doc_ingredients[drink_id]
+                if contains and not all(c in ingredients for c in contains):
+                    continue
+                if available is not None and not ingredients <= available:
+                    continue
+                ranked.append((-score, recipe['drink_name'].lower(), drink_id))
+            
+            # Only the returned page is sorted in full and copied out
+            top = heapq.nsmallest(limit, ranked)
+            results = [dict(self.recipes[drink_id], score=round(-score, 3)) for score, _, drink_id in top]
+        
+        return {'total': len(ranked), 'results': results}
@@ -0,0 +1,171 @@
+"""
+Self-correcting pump calibration from bottle refills.
+
+When a bottle is set on /bottle_volumes, its level becomes the baseline for
+that pump. At the next refill, staff can enter what was actually left in
+the old bottle. What really left the bottle since the baseline, divided by
+how long the pump ran (pours plus calibration and priming runs), is the
+pump's true flow rate, whatever its calibration said in between.
+
+The drift against the saved calibration decides what happens:
+
+- small drift is noise and changes nothing
+- moderate drift moves the calibration part of the way to the observed rate
+- large drift is more likely a spill, a wrong entry or a failing pump than
+  wear, so the pump is flagged for a manual calibration instead
+"""
+import logging
+from datetime import datetime
+from threading import Lock
+
+from utils import (
+    RECONCILIATION_FILE, load_json, save_json, load_usage_events, load_pump_calibrations,
+    save_pump_calibration, get_pump_run_seconds
+)
+
+# Reconciliations kept in the history
+HISTORY_LIMIT = 200
+
+_reconciliation_lock = Lock()
+
+
+def _load():
+    data = load_json(RECONCILIATION_FILE, {})
+    return {
+        'baselines': data.get('baselines', {}),
+        'flags': data.get('flags', {}),
+        'history': data.get('history', [])
+    }
+
+def set_baseline(pump_id, remaining_ml):
+    """
+    Start tracking a freshly set bottle.
+    
+    Args:
+        pump_id (int): Pump the bottle is on
+        remaining_ml (float): Volume in the bottle now
+    """
+    with _reconciliation_lock:
+        data = _load()
+        data['baselines'][str(pump_id)] = {
+            'ts': datetime.now().isoformat(),
+            'remaining_ml': float(remaining_ml),
+            # The pump's total run time so far; what it ran since is the difference
+            'run_seconds': get_pump_run_seconds(pump_id)
+        }
+        save_json(data, RECONCILIATION_FILE)
+
+def pump_run_seconds(pump_id, baseline):
+    """Seconds a pump ran since its baseline was set, pours and manual runs alike."""
+    if 'run_seconds' in baseline:
+        return get_pump_run_seconds(pump_id) - baseline['run_seconds']
+    
+    # Baselines set before run totals were kept: scan the journal once,
+    # until the next refill sets a new baseline
+    since = baseline['ts']
+    total = 0.0
+    for event in load_usage_events(since=since, kinds=('dispense', 'run')):
+        if event.get('pump') != pump_id:
+            continue
+        seconds = event.get('actual_s')
+        if seconds is None:
+            seconds = event.get('planned_s') or 0.0
+        total += float(seconds)
+    return total
+
+def reconcile(pump_id, predicted_ml, observed_ml, min_volume_ml=250, deadband=0.03, max_adjust=0.25, gain=0.5):
+    """
+    Compare a bottle's predicted and observed level at refill and correct
+    the pump's calibration.
+    
+    Args:
+        pump_id (int): Pump the bottle is on
+        predicted_ml (float): Remaining volume the app had recorded
+        observed_ml (float): Remaining volume staff measured
+        min_volume_ml (float): Least volume dispensed since the baseline for
+                               the result to be trusted
+        deadband (float): Drift (as a fraction) treated as measurement noise
+        max_adjust (float): Largest drift corrected automatically; beyond it
+                            the pump is flagged instead
+        gain (float): Fraction of the drift corrected at a time
+    
+    Returns:
+        dict: The reconciliation record; 'action' is one of 'no_baseline',
+              'insufficient_data', 'ok', 'adjusted' or 'flagged'
+    """
+    with _reconciliation_lock:
+        data = _load()
+        baseline = data['baselines'].get(str(pump_id))
+        calibration = load_pump_calibrations().get(pump_id, 10.0)
+        record = {
+            'ts': datetime.now().isoformat(),
+            'pump': pump_id,
+            'predicted_ml': round(float(predicted_ml), 1),
+            'observed_ml': round(float(observed_ml), 1),
+            'calibration_before': round(calibration, 3),
+            'calibration_after': round(calibration, 3)
+        }
+        
+        if baseline is None:
+            record['action'] = 'no_baseline'
+        else:
+            run_seconds = pump_run_seconds(pump_id, baseline)
+            dispensed_ml = baseline['remaining_ml'] - float(observed_ml)
+            record['baseline_ml'] = baseline['remaining_ml']
+            record['run_seconds'] = round(run_seconds, 2)
+            
+            if dispensed_ml < min_volume_ml or run_seconds <= 0:
+                record['action'] = 'insufficient_data'
+            else:
+                observed_rate = dispensed_ml / run_seconds
+                drift = observed_rate / calibration - 1.0
+                record['observed_rate'] = round(observed_rate, 3)
+                record['drift'] = round(drift, 4)
+                
+                if abs(drift) <= deadband:
+                    record['action'] = 'ok'
+                    data['flags'].pop(str(pump_id), None)
+                elif abs(drift) > max_adjust:
+                    record['action'] = 'flagged'
+                    data['flags'][str(pump_id)] = {'ts': record['ts'], 'drift': record['drift']}
+                else:
+                    new_rate = calibration + gain * (observed_rate - calibration)
+                    save_pump_calibration(pump_id, new_rate)
+                    record['action'] = 'adjusted'
+                    record['calibration_after'] = round(new_rate, 3)
+                    data['flags'].pop(str(pump_id), None)
+        
+        data['history'] = (data['history'] + [record])[-HISTORY_LIMIT:]
+        save_json(data, RECONCILIATION_FILE)
+    
+    if record['action'] == 'adjusted':
+        logging.info(f"Pump {pump_id} drifted {record['drift']:+.1%}, calibration "
+                     f"{record['calibration_before']} -> {record['calibration_after']} ml/s")
+    elif record['action'] == 'flagged':
+        logging.warning(f"Pump {pump_id} drifted {record['drift']:+.1%} at refill, needs a manual calibration")
+    return record
+
+def clear_flag(pump_id):
+    """Clear a pump's drift flag, after it was calibrated by hand."""
+    with _reconciliation_lock:
+        data = _load()
+        if data['flags'].pop(str(pump_id), None) is not None:
+            save_json(data, RECONCILIATION_FILE)
+
+def get_drift_report(pump_id=None, limit=20):
+    """
+    Get the recent reconciliations and the pumps flagged for calibration.
+    
+    Args:
+        pump_id (int): Only this pump's reconciliations
+        limit (int): Most recent records returned
+    
+    Returns:
+        dict: 'flags' by pump ID and 'history', newest first
+    """
+    data = _load()
+    history = [r for r in data['history'] if pump_id is None or r['pump'] == pump_id]
+    return {
+        'flags': {int(k): v for k, v in data['flags'].items()},
+        'history': history[::-1][:limit]
+    }
@@ -0,0 +1,58 @@
+"""
+Cache of rendered HTML fragments.
+
+The main page only changes when the saved state does (the state version
+from utils) or the pour queue does, yet every visitor used to re-render it
+in full. Each fragment is kept with the key it was rendered for, e.g. the
+state version, and served again while the key still matches; a stale key
+means a fresh render. Saves in this process also drop the cache at once
+through utils.add_state_listener, and the version key catches saves made by
+other processes (the pump controller daemon, other workers).
+"""
+import threading
+
+
+class FragmentCache:
+    """Rendered fragments by name, each with the key it was rendered for."""
+    
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.entries = {}  # name -> (key, value)
+        self.hits = 0
+        self.misses = 0
+    
+    def get(self, name, key, render):
+        """
+        Get a fragment, rendering it if the cached one is for another key.
+        
+        Args:
+            name (str): Fragment name
+            key: Everything the fragment depends on, e.g. the state version;
+                 must be hashable and comparable
+            render: Called with no arguments to build the fragment
+        
+        Returns:
+            The cached or freshly rendered fragment
+        """
+        with self.lock:
+            entry = self.entries.get(name)
+            if entry is not None and entry[0] == key:
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+        
+        # Rendered outside the lock; two requests racing here both render,
+        # and either result is right for the key
+        value = render()
+        with self.lock:
+            self.entries[name] = (key, value)
+        return value
+    
+    def invalidate(self, *args):
+        """Drop every fragment. Takes and ignores any arguments, to serve as a listener."""
+        with self.lock:
+            self.entries.clear()
+    
+    def stats(self):
+        with self.lock:
+            return {'fragments': len(self.entries), 'hits': self.hits, 'misses': self.misses}
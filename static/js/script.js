@@ -20,6 +20,10 @@ socket.on('mixing_error', function(data) {
     showErrorMessage(data.error);
 });
 
+socket.on('low_stock', function(data) {
+    showLowStockAlert(data.alerts);
+});
+
 // DOM Ready handler
 document.addEventListener('DOMContentLoaded', function() {
     initPinEntry();
@@ -28,8 +32,76 @@ document.addEventListener('DOMContentLoaded', function() {
     initEmergencyStop();
     initBottleVolumeValidation();
     initHoseStatusPolling();
+    initDrinkListLoading();
+    initOrderKeys();
+    registerServiceWorker();
 });
 
+// Give each order form a key on its first submit, so a double tap or a
+// resubmit of the same form is merged into one order by the server
+function initOrderKeys() {
+    document.addEventListener('submit', function(e) {
+        const form = e.target;
+        if (!form.action) {
+            return;
+        }
+        const path = new URL(form.action, location.href).pathname;
+        if (!path.startsWith('/mix/') && path !== '/mix_with_substitutes') {
+            return;
+        }
+        if (!form.elements.idempotency_key) {
+            const input = document.createElement('input');
+            input.type = 'hidden';
+            input.name = 'idempotency_key';
+            input.value = Date.now().toString(36) + Math.random().toString(36).slice(2);
+            form.appendChild(input);
+        }
+    }, true);
+}
+
+// Service worker for offline-capable kiosk pages
+function registerServiceWorker() {
+    if ('serviceWorker' in navigator) {
+        navigator.serviceWorker.register('/sw.js')
+            .catch(err => console.error('Service worker registration failed:', err));
+    }
+}
+
+// Main page drink list: the first screen comes with the page, the rest is
+// fetched a page at a time as the guest scrolls towards the end
+function initDrinkListLoading() {
+    const sentinel = document.getElementById('drinks-more');
+    const grid = document.getElementById('drinks-grid');
+    if (!sentinel || !grid || !('IntersectionObserver' in window)) return;
+    
+    let loading = false;
+    const observer = new IntersectionObserver(entries => {
+        if (!entries.some(entry => entry.isIntersecting) || loading) return;
+        loading = true;
+        
+        const params = new URLSearchParams({ cursor: sentinel.dataset.cursor });
+        fetch(`${sentinel.dataset.url}?${params}`)
+            .then(response => {
+                if (!response.ok) throw new Error(`HTTP ${response.status}`);
+                const nextCursor = response.headers.get('X-Next-Cursor');
+                return response.text().then(html => ({ html, nextCursor }));
+            })
+            .then(({ html, nextCursor }) => {
+                grid.insertAdjacentHTML('beforeend', html);
+                if (nextCursor) {
+                    sentinel.dataset.cursor = nextCursor;
+                } else {
+                    observer.disconnect();
+                    sentinel.remove();
+                }
+            })
+            .catch(err => console.error('Error loading more drinks:', err))
+            .finally(() => { loading = false; });
+    }, { rootMargin: '600px' });
+    
+    observer.observe(sentinel);
+}
+
 // PIN Entry functionality
 function initPinEntry() {
     // Only initialize if we're on the PIN entry page
@@ -122,11 +194,11 @@ function initBottleVolumeValidation() {
         volumeForm.addEventListener('submit', function(e) {
             let valid = true;
             
-            for (let i = 1; i <= 8; i++) {
-                const total = document.querySelector(`input[name="total_${i}"]`);
-                const remaining = document.querySelector(`input[name="remaining_${i}"]`);
+            for (const total of volumeForm.querySelectorAll('input[name^="total_"]')) {
+                const i = total.name.slice('total_'.length);
+                const remaining = volumeForm.querySelector(`input[name="remaining_${i}"]`);
                 
-                if (total && remaining) {
+                if (remaining) {
                     const totalVal = parseFloat(total.value) || 0;
                     const remainingVal = parseFloat(remaining.value) || 0;
                     
@@ -150,6 +222,8 @@ function initHoseStatusPolling() {
     const hoseStatusContainer = document.querySelector('.hose-status');
     
     if (hoseStatusContainer) {
+        // The page may come from the service worker cache, so catch up right away
+        refreshHoseStatus();
         // Poll every 30 seconds for updates
         setInterval(refreshHoseStatus, 30000);
     }
@@ -159,16 +233,17 @@ function refreshHoseStatus() {
     fetch('/api/hose_status')
         .then(response => response.json())
         .then(data => {
-            for (let i = 1; i <= 8; i++) {
-                const hoseItem = document.querySelector(`.hose-item:nth-child(${i})`);
-                if (hoseItem && data[i]) {
+            for (const i of Object.keys(data)) {
+                const hoseItem = document.querySelector(`.hose-item[data-hose="${i}"]`);
+                if (hoseItem) {
                     const percentElem = hoseItem.querySelector('.percentage');
                     if (percentElem) {
                         percentElem.textContent = `${data[i].percent}%`;
                     }
                     
-                    // Update low class if needed
-                    if (data[i].percent < 20) {
+                    // Update low class if needed; a hose drawn from fast is low early
+                    const emptySoon = data[i].empty_in_seconds !== null && data[i].empty_in_seconds < 1800;
+                    if (data[i].percent < 20 || emptySoon) {
                         hoseItem.classList.add('low');
                     } else {
                         hoseItem.classList.remove('low');
@@ -300,6 +375,32 @@ function showErrorMessage(errorText) {
     }, 10);
 }
 
+// Low stock banner for the bar staff; stays until dismissed
+function showLowStockAlert(alerts) {
+    if (!alerts || !alerts.length) return;
+    
+    let banner = document.getElementById('low-stock-alert');
+    if (!banner) {
+        banner = document.createElement('div');
+        banner.id = 'low-stock-alert';
+        banner.className = 'low-stock-alert';
+        banner.addEventListener('click', () => banner.remove());
+        document.body.appendChild(banner);
+    }
+    
+    // Ingredient names are typed in by staff, so they go in as text
+    const title = document.createElement('strong');
+    title.textContent = 'Low stock';
+    banner.replaceChildren(title);
+    alerts.forEach(alert => {
+        const minutes = alert.empty_in_seconds !== null ? Math.round(alert.empty_in_seconds / 60) : null;
+        const when = minutes !== null ? `empty in ~${minutes} min` : `${alert.drinks_left} pours left`;
+        const line = document.createElement('p');
+        line.textContent = `Hose ${alert.hose} (${alert.ingredient || 'unassigned'}): ${alert.remaining} ml, ${when}`;
+        banner.appendChild(line);
+    });
+}
+
 function hideErrorMessage() {
     const message = document.querySelector('.error-message-popup');
     
@@ -449,16 +550,13 @@ function selectPump(pump) {
     }
     
     // Update selected pump box
-    for(let i = 1; i <= 8; i++){
-        let box = document.getElementById('pumpBox' + i);
-        if (box) {
-            if(i === pump){
-                box.classList.add('selected');
-            } else {
-                box.classList.remove('selected');
-            }
+    document.querySelectorAll('.pump-box').forEach(function(box) {
+        if(box.id === 'pumpBox' + pump){
+            box.classList.add('selected');
+        } else {
+            box.classList.remove('selected');
         }
-    }
+    });
 }
 
 // Add to your CSS (this will be appended to style.css)
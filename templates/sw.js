@@ -0,0 +1,71 @@
+// Service worker for the kiosk tablets. Versioned assets are served from
+// cache, and the last drink list page is kept so the UI can render at once
+// when the Pi is slow to answer or the tablet is briefly offline.
+const SHELL_CACHE = 'shell-{{ version }}';
+const PAGE_CACHE = 'pages';
+const SHELL_ASSETS = {{ shell_assets|tojson }};
+const NETWORK_TIMEOUT_MS = 2000;
+
+self.addEventListener('install', function(event) {
+    event.waitUntil(
+        caches.open(SHELL_CACHE)
+            .then(cache => cache.addAll(SHELL_ASSETS))
+            .then(() => self.skipWaiting())
+    );
+});
+
+self.addEventListener('activate', function(event) {
+    event.waitUntil(
+        caches.keys()
+            .then(keys => Promise.all(keys
+                .filter(key => key !== SHELL_CACHE && key !== PAGE_CACHE)
+                .map(key => caches.delete(key))))
+            .then(() => self.clients.claim())
+    );
+});
+
+self.addEventListener('fetch', function(event) {
+    const request = event.request;
+    if (request.method !== 'GET') return;
+    
+    const url = new URL(request.url);
+    if (url.origin !== self.location.origin) return;
+    
+    if (url.pathname.startsWith('/assets/')) {
+        // Hashed asset URLs never change content, so the cache is always right
+        event.respondWith(cacheFirst(request));
+    } else if (request.mode === 'navigate' && url.pathname === '/') {
+        event.respondWith(drinkListPage(request));
+    }
+    // Everything else (API polls, forms, settings) goes to the network as usual
+});
+
+function cacheFirst(request) {
+    return caches.match(request).then(cached => {
+        if (cached) return cached;
+        return fetch(request).then(response => {
+            if (response.ok) {
+                const copy = response.clone();
+                caches.open(SHELL_CACHE).then(cache => cache.put(request, copy));
+            }
+            return response;
+        });
+    });
+}
+
+function drinkListPage(request) {
+    return caches.open(PAGE_CACHE).then(cache => {
+        const network = fetch(request).then(response => {
+            // Pages with flash messages carry no ETag and must not be replayed
+            if (response.ok && !response.redirected && response.headers.get('ETag')) {
+                cache.put('/', response.clone());
+            }
+            return response;
+        });
+        const timeout = new Promise(resolve => setTimeout(resolve, NETWORK_TIMEOUT_MS));
+        
+        return Promise.race([network, timeout.then(() => cache.match('/'))])
+            .then(response => response || network)
+            .catch(() => cache.match('/').then(cached => cached || Response.error()));
+    });
+}
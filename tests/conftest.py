@@ -0,0 +1,47 @@
+"""
+Test setup: every test session works on a scratch copy of the data directory.
+
+The modules read MIXER_DATA_DIR and MIXER_LOGS_DIR when they are imported,
+so both are set here, before any test imports them.
+"""
+import os
+import sys
+import shutil
+import tempfile
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+_scratch = tempfile.mkdtemp(prefix='mixer-tests-')
+shutil.copytree(os.path.join(ROOT, 'data'), os.path.join(_scratch, 'data'))
+os.environ['MIXER_DATA_DIR'] = os.path.join(_scratch, 'data')
+os.environ['MIXER_LOGS_DIR'] = os.path.join(_scratch, 'logs')
+
+
+def pytest_sessionfinish(session, exitstatus):
+    shutil.rmtree(_scratch, ignore_errors=True)
+
+
+@pytest.fixture
+def catalog():
+    """
+    Save recipes into the catalog, restoring the original one afterwards.
+    
+    Each save gets a later file time than the last, so caches keyed on the
+    file's mtime see every save even within one clock tick.
+    """
+    import utils  # Only now that the data directory is set
+    
+    original = utils.load_all_recipes()
+    saves = []
+    
+    def save(recipes):
+        utils.save_all_recipes(recipes)
+        saves.append(None)
+        mtime = os.stat(utils.RECIPE_FILE).st_mtime_ns + len(saves) * 1_000_000
+        os.utime(utils.RECIPE_FILE, ns=(mtime, mtime))
+    
+    yield save
+    save(original)
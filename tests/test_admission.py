@@ -0,0 +1,106 @@
+"""Token bucket rate limiter and idempotency cache."""
+import threading
+
+from admission import RateLimiter, IdempotencyCache
+
+
+def test_burst_then_steady_rate():
+    limiter = RateLimiter(rate=0.5, burst=2)
+    assert limiter.take('a', now=0.0) == 0.0
+    assert limiter.take('a', now=0.0) == 0.0
+    # Empty: one token comes back every 2 seconds
+    assert limiter.take('a', now=0.0) == 2.0
+    assert limiter.take('a', now=1.0) == 1.0
+    assert limiter.take('a', now=2.0) == 0.0
+
+
+def test_refused_requests_cost_nothing():
+    limiter = RateLimiter(rate=1.0, burst=1)
+    assert limiter.take('a', now=0.0) == 0.0
+    for _ in range(5):
+        assert limiter.take('a', now=0.5) == 0.5
+    assert limiter.take('a', now=1.0) == 0.0
+
+
+def test_bucket_refills_only_up_to_burst():
+    limiter = RateLimiter(rate=1.0, burst=2)
+    limiter.take('a', now=0.0)
+    assert [limiter.take('a', now=100.0) for _ in range(3)] == [0.0, 0.0, 1.0]
+
+
+def test_clients_have_their_own_buckets():
+    limiter = RateLimiter(rate=0.1, burst=1)
+    assert limiter.take('a', now=0.0) == 0.0
+    assert limiter.take('a', now=0.0) > 0
+    assert limiter.take('b', now=0.0) == 0.0
+
+
+def test_least_recently_used_clients_are_forgotten():
+    limiter = RateLimiter(rate=0.1, burst=1, max_clients=2)
+    limiter.take('a', now=0.0)
+    limiter.take('b', now=0.0)
+    limiter.take('c', now=0.0)
+    assert list(limiter.buckets) == ['b', 'c']
+    # A forgotten client starts over with a full bucket
+    assert limiter.take('a', now=0.0) == 0.0
+
+
+def test_first_request_owns_a_key():
+    cache = IdempotencyCache()
+    assert cache.begin('k', ttl=60) == (True, None)
+    cache.finish('k', 'order-1')
+    assert cache.begin('k', ttl=60, wait=0) == (False, 'order-1')
+    assert cache.get('k') == 'order-1'
+
+
+def test_aborted_key_can_be_claimed_again():
+    cache = IdempotencyCache()
+    cache.begin('k', ttl=60)
+    cache.abort('k')
+    assert cache.get('k') is None
+    assert cache.begin('k', ttl=60) == (True, None)
+
+
+def test_expired_key_is_claimed_anew():
+    cache = IdempotencyCache()
+    cache.begin('k', ttl=0)
+    cache.finish('k', 'order-1')
+    assert cache.get('k') is None
+    assert cache.begin('k', ttl=60) == (True, None)
+
+
+def test_repeat_waits_for_the_request_placing_the_key():
+    cache = IdempotencyCache()
+    cache.begin('k', ttl=60)
+    results = []
+    waiter = threading.Thread(target=lambda: results.append(cache.begin('k', ttl=60, wait=2.0)))
+    waiter.start()
+    cache.finish('k', 'order-1')
+    waiter.join()
+    assert results == [(False, 'order-1')]
+
+
+def test_repeat_gives_up_waiting_without_a_result():
+    cache = IdempotencyCache()
+    cache.begin('k', ttl=60)
+    assert cache.begin('k', ttl=60, wait=0.01) == (False, None)
+
+
+def test_repeat_takes_over_when_the_first_request_aborts():
+    cache = IdempotencyCache()
+    cache.begin('k', ttl=60)
+    results = []
+    waiter = threading.Thread(target=lambda: results.append(cache.begin('k', ttl=60, wait=2.0)))
+    waiter.start()
+    cache.abort('k')
+    waiter.join()
+    assert results == [(True, None)]
+
+
+def test_cache_is_bounded():
+    cache = IdempotencyCache(max_entries=3)
+    for i in range(5):
+        cache.begin(f"k{i}", ttl=60)
+        cache.finish(f"k{i}", i)
+    assert len(cache.entries) <= 3
+    assert cache.get('k4') == 4
@@ -0,0 +1,105 @@
+"""Fleet coordinator routing, with units faked at the HTTP layer."""
+import time
+
+import pytest
+
+from coordinator import Coordinator
+
+
+class FakeFleet(Coordinator):
+    """A coordinator whose units answer from memory instead of over HTTP."""
+    
+    def __init__(self, stations, **kwargs):
+        urls = [f"http://unit{i}" for i in range(len(stations))]
+        super().__init__(urls, **kwargs)
+        self.fake = {url: {'online': True, 'stations': n, 'orders': {}} for url, n in zip(urls, stations)}
+    
+    def _request(self, unit, path, payload=None, etag=None):
+        fake = self.fake[unit.url]
+        if not fake['online']:
+            raise OSError("Connection refused")
+        if path == '/api/unit_status':
+            return 200, {
+                'is_mixing': bool(fake['orders']),
+                'stations': fake['stations'],
+                'queue_full': False,
+                'available_drinks': [1],
+                'orders': [{'order_id': o, 'state': s, 'error': None} for o, s in fake['orders'].items()]
+            }, None
+        fake['orders'][payload['order_id']] = 'queued'
+        return 202, {'order_id': payload['order_id']}, None
+    
+    def units_of(self, orders):
+        return [self.get_order(o['order_id'])['unit'] for o in orders]
+
+
+def test_orders_fill_every_station_of_the_least_loaded_unit():
+    fleet = FakeFleet([2, 2])
+    fleet.fake['http://unit0']['orders'] = {'local': 'pouring'}
+    fleet.poll_once()
+    
+    orders = [fleet.submit(1, 200) for _ in range(4)]
+    
+    # unit1 is idle, so it takes the first; then both have one order each
+    assert fleet.units_of(orders) == ['http://unit1', 'http://unit0', 'http://unit1', None]
+    assert fleet.get_order(orders[3]['order_id'])['status'] == 'queued'
+    
+    fleet.fake['http://unit1']['orders'][orders[0]['order_id']] = 'done'
+    fleet.poll_once()
+    assert fleet.get_order(orders[0]['order_id'])['status'] == 'done'
+    assert fleet.get_order(orders[3]['order_id'])['unit'] == 'http://unit1'
+
+
+def test_orders_on_a_unit_that_stops_answering_time_out():
+    fleet = FakeFleet([1, 1], order_timeout=0.05)
+    fleet.poll_once()
+    order = fleet.submit(1, 200)
+    unit = next(u for u in fleet.units if u.url == order['unit'])
+    
+    fleet.fake[unit.url]['online'] = False
+    fleet.poll_once()
+    assert fleet.get_order(order['order_id'])['status'] == 'dispatched'
+    time.sleep(0.1)
+    fleet.poll_once()
+    
+    assert fleet.get_order(order['order_id'])['status'] == 'failed'
+    assert not unit.in_flight and not unit.is_mixing
+
+
+def test_history_is_trimmed_past_an_open_order():
+    fleet = FakeFleet([6], history=3)
+    fleet.poll_once()
+    stuck = fleet.submit(1, 200)
+    finished = []
+    for _ in range(5):
+        order = fleet.submit(1, 200)
+        with fleet.lock:
+            fleet._finish(fleet.orders[order['order_id']], fleet.units[0], 'done')
+        finished.append(order['order_id'])
+    
+    assert len(fleet.orders) == 3
+    assert stuck['order_id'] in fleet.orders
+    assert finished[0] not in fleet.orders
+
+
+def test_unanswered_order_is_resent_to_the_same_unit():
+    fleet = FakeFleet([1, 1])
+    fleet.poll_once()
+    send = fleet._request
+    
+    def drop_first_dispatch(unit, path, payload=None, etag=None):
+        if payload is not None and not fleet.fake[unit.url].get('dropped'):
+            fleet.fake[unit.url]['dropped'] = True
+            raise OSError("Timed out")
+        return send(unit, path, payload, etag)
+    
+    fleet._request = drop_first_dispatch
+    order = fleet.submit(1, 200)
+    assert fleet.get_order(order['order_id'])['status'] == 'unknown'
+    
+    fleet.poll_once()
+    
+    placed = fleet.get_order(order['order_id'])
+    assert placed['status'] == 'dispatched'
+    assert placed['unit'] == order['unit']
+    assert order['order_id'] in fleet.fake[order['unit']]['orders']
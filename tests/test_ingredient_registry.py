@@ -0,0 +1,49 @@
+"""Ingredient registry writes: batched on save paths, none on read paths."""
+import utils
+
+
+def registry_writes(monkeypatch):
+    writes = []
+    save_json = utils.save_json
+    
+    def counting_save_json(data, path):
+        if path == utils.INGREDIENTS_FILE:
+            writes.append(path)
+        return save_json(data, path)
+    
+    monkeypatch.setattr(utils, 'save_json', counting_save_json)
+    return writes
+
+
+def test_saving_recipes_registers_new_ingredients_at_once(monkeypatch):
+    recipes = utils.load_all_recipes()
+    try:
+        new = [{'drink_id': 9000 + i, 'drink_name': f"Test Drink {i}",
+                'ingredients': {f"Test Syrup {i}a": 50, f"Test Syrup {i}b": 50}} for i in range(20)]
+        writes = registry_writes(monkeypatch)
+        utils.save_all_recipes(list(recipes) + new)
+        
+        assert len(writes) == 1
+        assert utils.get_ingredient_id('Test Syrup 7b') is not None
+    finally:
+        monkeypatch.undo()
+        utils.save_all_recipes(recipes)
+
+
+def test_known_ingredients_write_nothing(monkeypatch):
+    writes = registry_writes(monkeypatch)
+    utils.save_all_recipes(utils.load_all_recipes())
+    assert writes == []
+
+
+def test_density_lookup_never_writes_the_registry(monkeypatch):
+    densities = utils.load_json(utils.DENSITY_FILE, utils.DEFAULT_DENSITIES)
+    utils.save_json(dict(densities, **{'Unregistered Cordial': 1.3}), utils.DENSITY_FILE)
+    try:
+        writes = registry_writes(monkeypatch)
+        assert utils.get_density('Vodka') > 0
+        assert utils.get_ingredient_id('Unregistered Cordial') is None
+        assert writes == []
+    finally:
+        monkeypatch.undo()
+        utils.save_json(densities, utils.DENSITY_FILE)
@@ -0,0 +1,62 @@
+"""Maintenance history: archived on overflow, paged newest first across pumps."""
+import os
+import shutil
+from datetime import datetime, timedelta
+
+import pytest
+
+import utils
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    """Maintenance dates one day apart, from the start of 2024."""
+    times = iter(datetime(2024, 1, 1) + timedelta(days=i) for i in range(1000))
+    
+    class Clock(datetime):
+        @classmethod
+        def now(cls, tz=None):
+            return next(times)
+    
+    if os.path.exists(utils.MAINTENANCE_LOG_FILE):
+        os.remove(utils.MAINTENANCE_LOG_FILE)
+    shutil.rmtree(utils.MAINTENANCE_ARCHIVE_DIR, ignore_errors=True)
+    monkeypatch.setattr(utils, 'datetime', Clock)
+
+
+def test_pages_merge_log_and_archive_by_date(clock):
+    utils.save_maintenance_log(2, "quiet pump", history_limit=2)
+    for i in range(5):
+        utils.save_maintenance_log(1, f"busy {i}", history_limit=2)
+    
+    page = utils.get_maintenance_history_page(1, per_page=3)
+    
+    # busy 2 is archived but newer than the quiet pump's only entry
+    assert [e['notes'] for e in page['entries']] == ["busy 4", "busy 3", "busy 2"]
+    assert page['has_more']
+    rest = utils.get_maintenance_history_page(2, per_page=3)['entries']
+    assert [e['notes'] for e in rest] == ["busy 1", "busy 0", "quiet pump"]
+
+
+def test_archive_is_not_read_when_the_log_fills_the_page(clock, monkeypatch):
+    for i in range(6):
+        utils.save_maintenance_log(1, f"entry {i}", history_limit=4)
+    # Opening this segment would fail the page
+    missing = os.path.join(utils.MAINTENANCE_ARCHIVE_DIR, 'maintenance-999999.jsonl')
+    monkeypatch.setattr(utils, '_maintenance_segments', lambda: [missing])
+    
+    page = utils.get_maintenance_history_page(1, per_page=3)
+    
+    assert [e['notes'] for e in page['entries']] == ["entry 5", "entry 4", "entry 3"]
+
+
+def test_failed_archive_write_keeps_entries_in_the_log(clock, monkeypatch):
+    def fail(*args):
+        raise OSError("disk full")
+    
+    monkeypatch.setattr(utils, '_archive_maintenance_entries', fail)
+    for i in range(3):
+        utils.save_maintenance_log(1, f"entry {i}", history_limit=2)
+    
+    history = utils.load_maintenance_log()['1']['maintenance_history']
+    assert [e['notes'] for e in history] == ["entry 0", "entry 1", "entry 2"]
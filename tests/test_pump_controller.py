@@ -0,0 +1,218 @@
+"""Station scheduler of PumpController: which orders pour together and which wait."""
+import time
+import threading
+from collections import defaultdict
+
+import pytest
+
+from config import Config
+from eta import PourEstimator
+from admission import RateLimiter
+from pump_controller import PumpController, PumpBusyError
+
+# Pumps as assigned in the sample data: 1 Vodka, 2 Soda water, 5 Lime juice, 6 Triple sec
+VODKA_SODA = {'drink_name': 'Vodka Soda', 'ingredients': {'Vodka': 30, 'Soda water': 70}}
+VODKA = {'drink_name': 'Vodka', 'ingredients': {'Vodka': 100}}
+LIME_SEC = {'drink_name': 'Lime Sec', 'ingredients': {'Lime juice': 50, 'Triple sec': 50}}
+
+
+class GatedController(PumpController):
+    """A controller whose pours run until the test releases them."""
+    
+    def __init__(self):
+        super().__init__(Config.PUMP_GPIO_PINS, stations={1: [1, 2, 3, 4], 2: [5, 6, 7, 8]},
+                         estimator=PourEstimator())
+        self.gates = defaultdict(threading.Event)
+        self.overlaps = []
+        self.started = []
+    
+    def _pour(self, order):
+        with self.lock:
+            others = [o for o in self.orders.values() if o is not order and o['state'] == 'pouring']
+            self.overlaps += [(order['order_id'], o['order_id']) for o in others if o['pumps'] & order['pumps']]
+            self.started.append(order['order_id'])
+        while not self.gates[order['order_id']].wait(0.01):
+            if order['cancel'].cancelled:
+                break
+        order['cancel'].stopped.set()
+        self._finish(order)
+    
+    def release(self, order_id):
+        self.gates[order_id].set()
+
+
+def wait_for(condition, timeout=2.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            raise AssertionError("Timed out waiting for the controller")
+        time.sleep(0.01)
+
+
+def state(controller, order_id):
+    with controller.lock:
+        order = controller.orders.get(order_id)
+        return order['state'] if order else None
+
+
+@pytest.fixture
+def controller():
+    controller = GatedController()
+    yield controller
+    controller.emergency_stop()
+    controller.close()
+
+
+def test_orders_on_separate_pumps_pour_together(controller):
+    a = controller.pour(VODKA_SODA, 200)
+    b = controller.pour(LIME_SEC, 200)
+    wait_for(lambda: len(controller.started) == 2)
+    
+    assert state(controller, a) == state(controller, b) == 'pouring'
+    assert {controller.orders[a]['station'], controller.orders[b]['station']} == {1, 2}
+    assert controller.active_pumps == {1, 2, 5, 6}
+    assert controller.overlaps == []
+
+
+def test_orders_sharing_a_pump_wait_for_each_other(controller):
+    a = controller.pour(VODKA_SODA, 200)
+    b = controller.pour(VODKA, 50)
+    wait_for(lambda: a in controller.started)
+    time.sleep(0.05)
+    assert state(controller, b) == 'queued'
+    
+    controller.release(a)
+    wait_for(lambda: b in controller.started)
+    assert state(controller, a) is None
+    assert controller.overlaps == []
+
+
+def test_waiting_order_reserves_its_pumps(controller):
+    a = controller.pour(VODKA_SODA, 200)
+    b = controller.pour(VODKA, 50)
+    wait_for(lambda: a in controller.started)
+    # Station 1 is busy, but the Lime Sec can't take pump 1 from the waiting Vodka
+    c = controller.pour(LIME_SEC, 200)
+    wait_for(lambda: c in controller.started)
+    assert state(controller, b) == 'queued'
+    assert controller.overlaps == []
+
+
+def test_finish_releases_pumps_and_station(controller):
+    a = controller.pour(VODKA_SODA, 200)
+    wait_for(lambda: a in controller.started)
+    controller.release(a)
+    wait_for(lambda: state(controller, a) is None)
+    
+    assert controller.active_pumps == set()
+    assert controller.busy_stations == set()
+
+
+def test_cancel_releases_reservations(controller):
+    a = controller.pour(VODKA_SODA, 200)
+    b = controller.pour(VODKA, 50)
+    wait_for(lambda: a in controller.started)
+    
+    # A queued order is dropped at once
+    assert controller.cancel(b)
+    assert state(controller, b) is None
+    # A pouring one releases its pumps when its thread stops
+    assert controller.cancel(a)
+    wait_for(lambda: state(controller, a) is None)
+    assert controller.active_pumps == set()
+    assert controller.busy_stations == set()
+    assert b not in controller.started
+
+
+def test_emergency_stop_reports_every_dropped_order(controller):
+    errors = []
+    controller.add_listener(lambda event, data: errors.append(data['order_id']) if event == 'mixing_error' else None)
+    a = controller.pour(VODKA_SODA, 200)
+    b = controller.pour(VODKA, 50)
+    wait_for(lambda: a in controller.started)
+    
+    controller.emergency_stop()
+    # The gated pour thread reports nothing itself; the queued order must be reported
+    assert errors == [b]
+    finished = {o['order_id']: o for o in controller.status()['finished']}
+    assert finished[b]['state'] == 'failed'
+
+
+def test_full_queue_is_refused(controller):
+    controller.queue_limit = 1
+    a = controller.pour(VODKA_SODA, 200)
+    wait_for(lambda: a in controller.started)
+    controller.pour(VODKA, 50)
+    with pytest.raises(PumpBusyError):
+        controller.pour(VODKA, 50)
+
+
+def test_duplicate_order_id_never_replaces_an_order(controller):
+    a = controller.pour(VODKA_SODA, 200, order_id='order-1')
+    wait_for(lambda: a in controller.started)
+    pouring = controller.orders[a]
+    
+    assert controller.pour(VODKA, 50, order_id='order-1') == 'order-1'
+    assert controller.orders[a] is pouring
+    assert len(controller.orders) == 1
+    
+    # The reservation is still released when the original finishes
+    controller.release(a)
+    wait_for(lambda: state(controller, a) is None)
+    assert controller.active_pumps == set()
+    # A retry after it finished places nothing either
+    assert controller.pour(VODKA_SODA, 200, order_id='order-1') == 'order-1'
+    assert controller.orders == {}
+
+
+def test_idempotency_key_merges_repeats(controller):
+    a = controller.pour(VODKA_SODA, 200, idempotency_key='tablet-1:tap', key_ttl=60)
+    b = controller.pour(VODKA_SODA, 200, idempotency_key='tablet-1:tap', key_ttl=60)
+    assert a == b
+    assert len(controller.orders) == 1
+    assert controller.admit('tablet-1', 'tablet-1:tap') == {'order_id': a, 'retry_after': 0.0}
+
+
+def test_admit_limits_each_client(controller):
+    controller.rate_limiter = RateLimiter(rate=0.01, burst=2)
+    assert controller.admit('tablet-1')['retry_after'] == 0.0
+    assert controller.admit('tablet-1')['retry_after'] == 0.0
+    assert controller.admit('tablet-1')['retry_after'] > 0
+    assert controller.admit('tablet-2')['retry_after'] == 0.0
+
+
+def test_pour_uses_the_pumps_planned_at_queue_time():
+    from utils import load_hose_assignments, save_hose_assignments
+    
+    class RecordingController(PumpController):
+        def __init__(self):
+            super().__init__(Config.PUMP_GPIO_PINS, estimator=PourEstimator(), simulation_speed=1000)
+            self.gate = threading.Event()
+            self.ran = []
+        
+        def activate_pump(self, pump_id, duration, cancel=None):
+            self.ran.append(pump_id)
+            self.gate.wait(2)
+            return duration
+    
+    controller = RecordingController()
+    errors = []
+    controller.add_listener(lambda event, data: errors.append(data['error']) if event == 'mixing_error' else None)
+    assignments = load_hose_assignments()
+    try:
+        a = controller.pour(VODKA, 50)
+        wait_for(lambda: controller.ran == [1])
+        b = controller.pour(VODKA_SODA, 200)
+        assert state(controller, b) == 'queued'
+        
+        # Soda water moves from pump 2 to pump 3 while the Vodka Soda waits
+        save_hose_assignments({**assignments, 2: 'Gin', 3: 'Soda water'})
+        controller.gate.set()
+        wait_for(lambda: state(controller, a) is None and state(controller, b) is None)
+        
+        assert 3 not in controller.ran
+        assert any('no longer holds Soda water' in error for error in errors)
+        assert controller.active_pumps == set()
+    finally:
+        save_hose_assignments(assignments)
+        controller.close()
@@ -0,0 +1,47 @@
+import pytest
+
+import pump_outputs
+from config import Config
+from eta import PourEstimator
+from pump_controller import PumpController, OrderRejected
+from pump_outputs import PumpOutputs
+
+
+class FailingBus:
+    """An I2C bus with nothing answering at any address."""
+    
+    def __init__(self, bus):
+        pass
+    
+    def write_i2c_block_data(self, address, register, values):
+        raise OSError(121, "Remote I/O error")
+
+
+@pytest.fixture
+def broken_expander(monkeypatch):
+    monkeypatch.setattr(pump_outputs, 'smbus2', type('smbus2', (), {'SMBus': FailingBus}))
+    return {'board': {'type': 'mcp23017', 'bus': 1, 'address': 0x27}}
+
+
+def test_failed_expander_is_unavailable_not_simulated(broken_expander):
+    outputs = PumpOutputs({1: 17, 2: 'board:0', 3: 'board:1'}, broken_expander)
+    
+    assert outputs.unavailable == {2, 3}
+    assert not outputs.simulated
+    assert outputs.status()['board']['error']
+    with pytest.raises(RuntimeError):
+        outputs.write({2: True})
+    outputs.all_off()
+
+
+def test_controller_refuses_pumps_on_failed_expander(broken_expander):
+    pins = {**Config.PUMP_GPIO_PINS, 2: 'board:0'}
+    controller = PumpController(pins, expanders=broken_expander, estimator=PourEstimator())
+    try:
+        with pytest.raises(OrderRejected):
+            controller.pour({'drink_name': 'Vodka Soda', 'ingredients': {'Vodka': 30, 'Soda water': 70}}, 200)
+        with pytest.raises(ValueError):
+            controller.run_calibration([2], 5)
+        assert not controller.orders
+    finally:
+        controller.close()
@@ -0,0 +1,88 @@
+"""Recipe pack parsing and import."""
+import io
+import json
+
+import pytest
+
+import recipe_io
+import utils
+from recipe_io import normalize_recipe, import_recipes, RecipeRowError
+
+
+def saved_catalog():
+    """The recipe file as saved, bypassing the loader's cache."""
+    return {r['drink_name']: r for r in utils.load_json(utils.RECIPE_FILE, [])}
+
+
+def test_percentages_within_tolerance_are_scaled_to_100():
+    recipe = normalize_recipe({'drink_name': ' Gin  Fizz ', 'ingredients': {'Gin': 49, 'Soda water': 49}})
+    
+    assert recipe['drink_name'] == 'Gin Fizz'
+    assert sorted(recipe['ingredients'].values()) == [50.0, 50.0]
+
+
+@pytest.mark.parametrize('ingredients', [{'Gin': 45, 'Soda water': 45}, {'Gin': 60, 'Soda water': 50}])
+def test_percentages_outside_tolerance_are_rejected(ingredients):
+    with pytest.raises(RecipeRowError, match="add up to"):
+        normalize_recipe({'drink_name': 'Gin Fizz', 'ingredients': ingredients})
+
+
+def test_csv_ingredient_list_is_parsed():
+    recipe = normalize_recipe({'drink_name': 'Mule', 'ingredients': 'Vodka=30; Lime juice: 10;Soda water=60;'})
+    
+    assert list(recipe['ingredients'].values()) == [30.0, 10.0, 60.0]
+    with pytest.raises(RecipeRowError, match="without a percentage"):
+        normalize_recipe({'drink_name': 'Mule', 'ingredients': 'Vodka=30; Lime juice'})
+
+
+def test_numbered_columns_are_the_fallback():
+    row = {'drink_name': 'Screwdriver', 'ingredient_1': 'Vodka', 'percentage_1': '40',
+           'ingredient_2': 'Orange juice', 'percentage_2': '60', 'ingredient_3': ''}
+    
+    recipe = normalize_recipe(row)
+    
+    assert len(recipe['ingredients']) == 2
+    assert sorted(recipe['ingredients'].values()) == [40.0, 60.0]
+
+
+def test_spellings_of_one_ingredient_are_merged():
+    recipe = normalize_recipe({'drink_name': 'Sour', 'ingredients': 'lime juice=20; Lime  Juice=20; Gin=60'})
+    
+    assert len(recipe['ingredients']) == 2
+
+
+def test_import_updates_by_name_and_adds_with_new_ids(catalog, monkeypatch):
+    before = saved_catalog()
+    saves = []
+    save_all_recipes = recipe_io.save_all_recipes
+    monkeypatch.setattr(recipe_io, 'save_all_recipes', lambda recipes: (saves.append(1), save_all_recipes(recipes)))
+    pack = '\n'.join([
+        json.dumps({'drink_name': 'margarita', 'ingredients': {'Tequila': 60, 'Lime juice': 40}, 'notes': 'Up'}),
+        '{not json',
+        json.dumps({'drink_name': 'Cantarito', 'ingredients': {'Tequila': 40, 'Grapefruit soda': 60}}),
+        json.dumps({'drink_name': 'Empty', 'ingredients': {}}),
+        json.dumps({'drink_name': 'Batanga', 'ingredients': {'Tequila': 30, 'Cola': 70}})
+    ])
+    
+    result = import_recipes(io.StringIO(pack))
+    
+    assert (result['added'], result['updated'], result['invalid']) == (2, 1, 2)
+    assert [e['line'] for e in result['errors']] == [2, 4]
+    assert len(saves) == 1
+    after = saved_catalog()
+    assert after['Margarita']['drink_id'] == before['Margarita']['drink_id']
+    assert after['Margarita']['notes'] == 'Up'
+    highest = max(r['drink_id'] for r in before.values())
+    assert [after['Cantarito']['drink_id'], after['Batanga']['drink_id']] == [highest + 1, highest + 2]
+
+
+def test_import_can_skip_existing_drinks(catalog):
+    before = saved_catalog()
+    pack = "drink_name,ingredients,notes\nMargarita,Tequila=50; Lime juice=50,\nTommy's,Tequila=60; Lime juice=40,\n"
+    
+    result = import_recipes(io.StringIO(pack), fmt='csv', on_duplicate='skip')
+    
+    assert (result['added'], result['updated'], result['skipped']) == (1, 0, 1)
+    after = saved_catalog()
+    assert after['Margarita'] == before['Margarita']
+    assert "Tommy's" in after
@@ -0,0 +1,65 @@
+"""Recipe search: token, prefix and typo matching, filters and incremental sync."""
+import pytest
+
+import utils
+from recipe_search import RecipeSearchIndex
+
+
+@pytest.fixture
+def index():
+    index = RecipeSearchIndex()
+    index.sync()
+    return index
+
+
+def names(result):
+    return [r['drink_name'] for r in result['results']]
+
+
+def test_prefix_matches_a_name(index):
+    assert names(index.search('marg'))[0] == 'Margarita'
+
+
+def test_trigram_match_forgives_a_typo(index):
+    assert 'Margarita' in names(index.search('margerita'))
+    assert names(index.search('xqzv')) == []
+
+
+def test_every_query_word_has_to_match(index):
+    result = names(index.search('vodka lime', limit=100))
+    
+    assert 'Moscow Mule' in result
+    assert 'Screwdriver' not in result
+
+
+def test_makeable_keeps_drinks_whose_ingredients_are_all_on_hand(index):
+    result = index.search(makeable=True, limit=100)
+    
+    assert {r['drink_id'] for r in result['results']} == {r['drink_id'] for r in utils.get_available_drinks()}
+    assert 'Vodka Red Bull' not in names(result)
+
+
+def test_contains_keeps_drinks_with_every_named_ingredient(index):
+    result = index.search(contains=['vodka', 'Red Bull'], limit=100)
+    
+    assert names(result) == ['Vodka Red Bull']
+
+
+def test_sync_reindexes_only_changed_recipes(index, catalog, monkeypatch):
+    recipes = utils.load_all_recipes()
+    highest = max(r['drink_id'] for r in recipes)
+    edited = [r.replace(notes="Smoky mezcal float") if r['drink_name'] == 'Margarita' else r
+              for r in recipes if r['drink_name'] != 'Paloma']
+    added = utils.make_recipe(highest + 1, "Zephyr Cooler", {'Gin': 40, 'Soda water': 60})
+    catalog(edited + [added])
+    
+    reindexed = []
+    add = index._add
+    monkeypatch.setattr(index, '_add', lambda recipe: (reindexed.append(recipe['drink_name']), add(recipe)))
+    index.sync()
+    
+    assert sorted(reindexed) == ['Margarita', 'Zephyr Cooler']
+    assert names(index.search('mezcal')) == ['Margarita']
+    assert names(index.search('zephyr')) == ['Zephyr Cooler']
+    assert 'Paloma' not in names(index.search('paloma'))
+    assert 'paloma' not in index.postings
@@ -0,0 +1,61 @@
+"""Usage journal aggregates: startup replays only the tail after the snapshot."""
+import os
+
+import pytest
+
+import reconciliation
+import utils
+
+
+def restart():
+    """Forget the in-memory aggregates, as a fresh process would."""
+    utils._usage_stats = None
+    utils._drink_counts = None
+    utils._usage_journal_offset = 0
+
+
+@pytest.fixture
+def journal(tmp_path, monkeypatch):
+    for path in (utils.USAGE_JOURNAL_FILE, utils.USAGE_STATS_FILE):
+        if os.path.exists(path):
+            os.remove(path)
+    monkeypatch.setattr(reconciliation, 'RECONCILIATION_FILE', str(tmp_path / 'reconciliation.json'))
+    restart()
+    yield utils.USAGE_JOURNAL_FILE
+    restart()
+
+
+def test_run_ratios_and_times_come_from_snapshot_and_tail(journal):
+    for actual in (11.0, 12.0, 30.0):
+        utils.update_ingredient_usage(1, 100, 'Vodka', planned_seconds=10.0, actual_seconds=actual)
+    utils.update_ingredient_usage(1, 20, 'Vodka', planned_seconds=10.0, actual_seconds=2.0, cancelled=True)
+    utils.record_pump_run(1, 5.0, 'prime')
+    utils.compact_usage_journal()
+    ratios = utils.get_pump_run_ratios()
+    
+    # Startup must not read what the snapshot already covers
+    with open(journal, 'r+b') as f:
+        head = len(f.read())
+        f.seek(0)
+        f.write(b'x' * (head - 1) + b'\n')
+    utils.update_ingredient_usage(1, 100, 'Vodka', planned_seconds=10.0, actual_seconds=13.0)
+    restart()
+    
+    # 30s of 10 planned is a stall and the cancelled run was cut short
+    assert ratios[1] == pytest.approx(1.1 + 0.2 * (1.2 - 1.1))
+    assert utils.get_pump_run_ratios()[1] == pytest.approx(ratios[1] + 0.2 * (1.3 - ratios[1]))
+    assert utils.get_pump_run_seconds(1) == pytest.approx(11 + 12 + 30 + 2 + 5 + 13)
+
+
+def test_reconcile_counts_run_time_since_the_baseline(journal, monkeypatch):
+    saved = []
+    monkeypatch.setattr(reconciliation, 'save_pump_calibration', lambda pump_id, rate: saved.append(rate))
+    monkeypatch.setattr(reconciliation, 'load_pump_calibrations', lambda: {1: 10.0})
+    
+    utils.record_pump_run(1, 50.0, 'calibration')
+    reconciliation.set_baseline(1, 700.0)
+    utils.update_ingredient_usage(1, 500, 'Vodka', planned_seconds=50.0, actual_seconds=50.0)
+    record = reconciliation.reconcile(1, 200.0, 200.0)
+    
+    assert record['run_seconds'] == pytest.approx(50.0)
+    assert record['action'] == 'ok'
@@ -0,0 +1,237 @@
+"""
+Time-series store of pours with minute, hour and day rollups.
+
+The usage journal stays the write path: pours append to it as before, and
+this store follows it into SQLite (data/usage.db) by byte offset, the same
+way the usage aggregates do. Each sync is one transaction that adds the
+raw events, bumps the rollups and moves the offset, so an event is counted
+exactly once even if several processes sync.
+
+Rollups are kept per pump (ml and dispenses) and per drink (orders) at
+three resolutions. Buckets start at local minute, hour and day boundaries.
+Raw events and fine rollups are pruned after a while; day rollups are kept,
+so a season of queries reads a few hundred rows per drink or pump.
+"""
+import os
+import time
+import sqlite3
+import logging
+import threading
+from datetime import datetime
+
+from utils import USAGE_DB_FILE, USAGE_JOURNAL_FILE, read_usage_journal
+
+RESOLUTIONS = {'minute': 60, 'hour': 3600, 'day': 86400}
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value INTEGER NOT NULL);
+CREATE TABLE IF NOT EXISTS dispenses (ts INTEGER NOT NULL, pump INTEGER NOT NULL, ml REAL NOT NULL, order_id TEXT);
+CREATE INDEX IF NOT EXISTS dispenses_ts ON dispenses (ts);
+CREATE TABLE IF NOT EXISTS orders (ts INTEGER NOT NULL, drink_id INTEGER NOT NULL, order_id TEXT);
+CREATE INDEX IF NOT EXISTS orders_ts ON orders (ts);
+CREATE TABLE IF NOT EXISTS pump_rollups (
+    resolution INTEGER NOT NULL, bucket INTEGER NOT NULL, pump INTEGER NOT NULL,
+    ml REAL NOT NULL, dispenses INTEGER NOT NULL,
+    PRIMARY KEY (resolution, bucket, pump)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS drink_rollups (
+    resolution INTEGER NOT NULL, bucket INTEGER NOT NULL, drink_id INTEGER NOT NULL,
+    orders INTEGER NOT NULL,
+    PRIMARY KEY (resolution, bucket, drink_id)
+) WITHOUT ROWID;
+"""
+
+
+def bucket_start(ts, resolution):
+    """Start of the local-time bucket holding an epoch timestamp."""
+    offset = time.localtime(ts).tm_gmtoff
+    local = ts + offset
+    return local - local % resolution - offset
+
+def pick_resolution(start, end):
+    """The coarsest resolution that still charts a range in useful detail."""
+    span = end - start
+    if span <= 6 * 3600:
+        return 'minute'
+    if span <= 14 * 86400:
+        return 'hour'
+    return 'day'
+
+
+class UsageStore:
+    """SQLite time series of dispenses and orders, fed from the usage journal."""
+    
+    def __init__(self, db_path=USAGE_DB_FILE, raw_retention_days=30, minute_retention_days=14,
+                 hour_retention_days=400):
+        self.db_path = db_path
+        self.retention = {
+            'raw': raw_retention_days * 86400,
+            'minute': minute_retention_days * 86400,
+            'hour': hour_retention_days * 86400
+        }
+        self.lock = threading.Lock()
+        self.last_prune = 0.0
+        # Journal size at the last sync, so queries skip the write when nothing is new
+        self.synced_size = None
+        
+        self.db = sqlite3.connect(db_path, check_same_thread=False, timeout=10)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.executescript(SCHEMA)
+    
+    # ---------- Feeding ----------
+    
+    def _add_rollups(self, sql, rows):
+        for resolution in RESOLUTIONS.values():
+            self.db.executemany(sql, [(resolution, bucket_start(row[0], resolution)) + row[1:] for row in rows])
+    
+    def sync(self):
+        """
+        Copy journal events written since the last sync into the store.
+        
+        Returns:
+            int: Number of events added
+        """
+        try:
+            size = os.path.getsize(USAGE_JOURNAL_FILE)
+        except OSError:
+            return 0
+        if size == self.synced_size:
+            return 0
+        
+        with self.lock:
+            with self.db:
+                # Taking the write lock first keeps another process from
+                # reading the same offset and counting the same events
+                self.db.execute("BEGIN IMMEDIATE")
+                row = self.db.execute("SELECT value FROM meta WHERE key = 'journal_offset'").fetchone()
+                events, offset = read_usage_journal(row[0] if row else 0, kinds=('dispense', 'order'))
+                
+                dispenses, orders = [], []
+                for event in events:
+                    try:
+                        ts = int(datetime.fromisoformat(event['ts']).timestamp())
+                        if event['event'] == 'order':
+                            orders.append((ts, int(event['drink']), event.get('order')))
+                        else:
+                            dispenses.append((ts, int(event['pump']), float(event['ml']), event.get('order')))
+                    except (KeyError, TypeError, ValueError):
+                        continue
+                
+                self.db.executemany("INSERT INTO dispenses VALUES (?, ?, ?, ?)", dispenses)
+                self.db.executemany("INSERT INTO orders VALUES (?, ?, ?)", orders)
+                self._add_rollups(
+                    "INSERT INTO pump_rollups VALUES (?, ?, ?, ?, 1) ON CONFLICT DO UPDATE SET "
+                    "ml = ml + excluded.ml, dispenses = dispenses + 1",
+                    [(ts, pump, ml) for ts, pump, ml, _ in dispenses])
+                self._add_rollups(
+                    "INSERT INTO drink_rollups VALUES (?, ?, ?, 1) ON CONFLICT DO UPDATE SET orders = orders + 1",
+                    [(ts, drink_id) for ts, drink_id, _ in orders])
+                self.db.execute("INSERT OR REPLACE INTO meta VALUES ('journal_offset', ?)", (offset,))
+            self.synced_size = offset
+            
+            if time.time() - self.last_prune > 3600:
+                self._prune()
+        
+        if len(events) > 1000:
+            logging.info(f"Usage store caught up on {len(events)} journal events")
+        return len(events)
+    
+    def _prune(self):
+        """Drop raw events and fine rollups past their retention."""
+        now = time.time()
+        with self.db:
+            self.db.execute("DELETE FROM dispenses WHERE ts < ?", (now - self.retention['raw'],))
+            self.db.execute("DELETE FROM orders WHERE ts < ?", (now - self.retention['raw'],))
+            for name in ('minute', 'hour'):
+                for table in ('pump_rollups', 'drink_rollups'):
+                    self.db.execute(f"DELETE FROM {table} WHERE resolution = ? AND bucket < ?",
+                                    (RESOLUTIONS[name], now - self.retention[name]))
+        self.last_prune = now
+    
+    def start_sync(self, interval_seconds=60):
+        """Catch up with the journal now and then keep following it in the background."""
+        def follow():
+            while True:
+                try:
+                    self.sync()
+                except Exception:
+                    logging.error("Error syncing the usage store", exc_info=True)
+                time.sleep(interval_seconds)
+        
+        threading.Thread(target=follow, name="usage-store", daemon=True).start()
+    
+    # ---------- Queries ----------
+    
+    def series(self, start, end, resolution=None, metric='orders', pump=None, drink_id=None):
+        """
+        Usage per bucket over a time range.
+        
+        Args:
+            start (float): Range start, epoch seconds
+            end (float): Range end, epoch seconds
+            resolution (str): 'minute', 'hour' or 'day'; picked from the
+                              range length if missing
+            metric (str): 'orders' (drinks poured) or 'ml' (volume dispensed)
+            pump (int): Only this pump, for 'ml'
+            drink_id (int): Only this drink, for 'orders'
+        
+        Returns:
+            dict: resolution, the buckets as [{'ts', 'value'}] in time order
+                  (empty buckets left out), the total and the peak bucket
+        """
+        resolution = resolution or pick_resolution(start, end)
+        if resolution not in RESOLUTIONS:
+            raise ValueError(f"Unknown resolution: {resolution}")
+        if metric not in ('orders', 'ml'):
+            raise ValueError(f"Unknown metric: {metric}")
+        
+        width = RESOLUTIONS[resolution]
+        params = [width, bucket_start(int(start), width), end]
+        if metric == 'orders':
+            sql = "SELECT bucket, SUM(orders) FROM drink_rollups WHERE resolution = ? AND bucket >= ? AND bucket < ?"
+            if drink_id is not None:
+                sql += " AND drink_id = ?"
+                params.append(drink_id)
+        else:
+            sql = "SELECT bucket, SUM(ml) FROM pump_rollups WHERE resolution = ? AND bucket >= ? AND bucket < ?"
+            if pump is not None:
+                sql += " AND pump = ?"
+                params.append(pump)
+        sql += " GROUP BY bucket ORDER BY bucket"
+        
+        self.sync()
+        with self.lock:
+            rows = self.db.execute(sql, params).fetchall()
+        points = [{'ts': bucket, 'value': round(value, 1)} for bucket, value in rows]
+        peak = max(points, key=lambda p: p['value'], default=None)
+        return {
+            'resolution': resolution,
+            'metric': metric,
+            'points': points,
+            'total': round(sum(p['value'] for p in points), 1),
+            'peak': peak
+        }
+    
+    def top_drinks(self, start, end, limit=10):
+        """
+        Most poured drinks over a time range.
+        
+        Ranges longer than two weeks are counted in whole days.
+        
+        Returns:
+            list: (drink_id, orders), most orders first
+        """
+        resolution = RESOLUTIONS['day' if end - start > 14 * 86400 else 'hour']
+        self.sync()
+        with self.lock:
+            return self.db.execute(
+                "SELECT drink_id, SUM(orders) AS n FROM drink_rollups "
+                "WHERE resolution = ? AND bucket >= ? AND bucket < ? "
+                "GROUP BY drink_id ORDER BY n DESC, drink_id LIMIT ?",
+                (resolution, bucket_start(int(start), resolution), end, limit)
+            ).fetchall()
+    
+    def close(self):
+        with self.lock:
+            self.db.close()
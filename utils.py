@@ -1,10 +1,15 @@
 import os
 import json
+import time
+import fcntl
 import logging
-from threading import Lock
+import unicodedata
+from threading import Lock, Thread
 from datetime import datetime
 
-DATA_DIR = os.path.join(os.path.dirname(__file__), 'data')
+from models import Recipe, BottleVolume, NO_BOTTLE
+
+DATA_DIR = os.environ.get('MIXER_DATA_DIR') or os.path.join(os.path.dirname(__file__), 'data')
 os.makedirs(DATA_DIR, exist_ok=True)
 
 # File paths
@@ -14,8 +19,14 @@ HOSE_STATUSES_FILE = os.path.join(DATA_DIR, 'hose_statuses.json')
 BOTTLE_VOLUMES_FILE = os.path.join(DATA_DIR, 'bottle_volumes.json')
 RECIPE_FILE = os.path.join(DATA_DIR, 'drink_recipes.json')
 DENSITY_FILE = os.path.join(DATA_DIR, 'densities.json')
+INGREDIENTS_FILE = os.path.join(DATA_DIR, 'ingredients.json')
 USAGE_STATS_FILE = os.path.join(DATA_DIR, 'usage_stats.json')
 MAINTENANCE_LOG_FILE = os.path.join(DATA_DIR, 'maintenance_log.json')
+USAGE_JOURNAL_FILE = os.path.join(DATA_DIR, 'usage_journal.jsonl')
+MAINTENANCE_ARCHIVE_DIR = os.path.join(DATA_DIR, 'maintenance_archive')
+STATE_VERSION_FILE = os.path.join(DATA_DIR, '.state_version')
+RECONCILIATION_FILE = os.path.join(DATA_DIR, 'reconciliation.json')
+USAGE_DB_FILE = os.path.join(DATA_DIR, 'usage.db')
 
 # Create separate locks for each file to avoid contention
 file_locks = {
@@ -26,9 +37,16 @@ file_locks = {
     RECIPE_FILE: Lock(),
     DENSITY_FILE: Lock(),
     USAGE_STATS_FILE: Lock(),
-    MAINTENANCE_LOG_FILE: Lock()
+    MAINTENANCE_LOG_FILE: Lock(),
+    USAGE_JOURNAL_FILE: Lock(),
+    MAINTENANCE_ARCHIVE_DIR: Lock(),
+    INGREDIENTS_FILE: Lock(),
+    RECONCILIATION_FILE: Lock()
 }
 
+# Pours at different cup stations update bottle volumes concurrently
+_bottle_volume_update_lock = Lock()
+
 DEFAULT_DENSITIES = {
     "vodka": 0.95, "gin": 0.95, "whiskey": 0.95, "tequila": 0.95, "rum": 0.95,
     "cachaca": 0.95, "triple sec": 1.00, "soda water": 1.00, "cranberry juice": 1.05,
@@ -42,6 +60,59 @@ DEFAULT_DENSITIES = {
     "bourbon": 0.96, "sour mix": 1.10, "simple syrup": 1.20
 }
 
+# Other names bars use for the same ingredient: {alias: canonical name}
+DEFAULT_INGREDIENT_ALIASES = {
+    "club soda": "Soda Water", "sparkling water": "Soda Water", "whisky": "Whiskey",
+    "cointreau": "Triple Sec", "oj": "Orange Juice"
+}
+
+# State version, bumped after every save so responses derived from the
+# saved state can be cached and validated against it. The version is the
+# mtime (in ns) of STATE_VERSION_FILE, so web workers and the pump
+# controller process all see each other's saves with a single stat().
+_state_version_lock = Lock()
+
+# Callbacks run after every save made by this process, e.g. to drop caches
+_state_listeners = []
+
+def add_state_listener(callback):
+    """Call callback(version) after every state change saved by this process."""
+    _state_listeners.append(callback)
+
+def bump_state_version():
+    """
+    Increment the global state version.
+    
+    Returns:
+        int: The new state version
+    """
+    with _state_version_lock:
+        with open(STATE_VERSION_FILE, 'a') as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                version = max(time.time_ns(), os.fstat(f.fileno()).st_mtime_ns + 1)
+                os.utime(f.fileno(), ns=(version, version))
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+    for callback in list(_state_listeners):
+        try:
+            callback(version)
+        except Exception as e:
+            logging.error(f"Error in state listener: {e}")
+    return version
+
+def get_state_version():
+    """
+    Get the global state version.
+    
+    Returns:
+        int: Current state version
+    """
+    try:
+        return os.stat(STATE_VERSION_FILE).st_mtime_ns
+    except OSError:
+        return 0
+
 def load_json(file_path, default):
     """
     Load JSON data from a file with locking for thread safety.
@@ -85,6 +156,267 @@ def save_json(data, file_path):
                 json.dump(data, f, indent=4)
         except Exception as e:
             logging.error(f"Error saving {file_path}: {e}")
+        finally:
+            bump_state_version()
+
+# Ingredient registry
+#
+# Every ingredient has a stable integer ID and one canonical name; other
+# spellings and aliases resolve to the same ID. Recipes, hose assignments,
+# densities and substitutes store canonical names, and code that matches
+# ingredients compares IDs. The registry lives in INGREDIENTS_FILE and is
+# seeded from the recipes, hoses and densities the first time it's needed.
+
+_ingredient_registry = None
+_ingredient_registry_version = None
+_ingredient_registry_checked = 0.0
+_ingredient_registry_lock = Lock()
+
+# Lookups are on hot paths; look for changes by other processes at most this often
+INGREDIENT_REGISTRY_CHECK_SECONDS = 1.0
+
+def ingredient_key(name):
+    """
+    Matching key of an ingredient name: lowercase, accents removed and
+    whitespace collapsed, so "Lime juice" and "lime  JUICE" are the same.
+    """
+    name = unicodedata.normalize('NFKD', str(name or '').lower())
+    name = ''.join(c for c in name if not unicodedata.combining(c))
+    return ' '.join(name.split())
+
+def _display_name(name):
+    """Canonical spelling for a new ingredient; all-lowercase names get capitalized words."""
+    name = ' '.join(str(name).split())
+    return name.title() if name == name.lower() else name
+
+def _index_ingredient_registry(data):
+    """Build the in-memory lookups from the registry file contents."""
+    by_id = {}
+    by_key = {}
+    for id_str, entry in data.get('ingredients', {}).items():
+        ingredient_id = int(id_str)
+        by_id[ingredient_id] = entry
+        by_key[ingredient_key(entry['name'])] = ingredient_id
+        for alias in entry.get('aliases', []):
+            by_key.setdefault(ingredient_key(alias), ingredient_id)
+    return {
+        'next_id': int(data.get('next_id', max(by_id, default=0) + 1)),
+        'by_id': by_id,
+        'by_key': by_key,
+        'canonical': {}  # Raw spelling -> canonical name, filled as names are seen
+    }
+
+def _ingredient_registry_data(registry):
+    return {
+        'next_id': registry['next_id'],
+        'ingredients': {str(k): v for k, v in sorted(registry['by_id'].items())}
+    }
+
+def _seed_ingredient_registry():
+    """First registry: every ingredient the recipes, hoses and densities mention."""
+    registry = _index_ingredient_registry({'next_id': 1})
+    names = [name for r in load_json(RECIPE_FILE, []) for name in r.get('ingredients', {})]
+    names += list(load_json(HOSE_ASSIGNMENTS_FILE, {}).values())
+    names += list(load_json(DENSITY_FILE, DEFAULT_DENSITIES).keys())
+    names += list(DEFAULT_INGREDIENT_ALIASES.values())
+    for name in names:
+        if name and ingredient_key(name) not in registry['by_key']:
+            _register_ingredient(registry, name)
+    for alias, name in DEFAULT_INGREDIENT_ALIASES.items():
+        if ingredient_key(alias) not in registry['by_key']:
+            ingredient_id = registry['by_key'][ingredient_key(name)]
+            registry['by_id'][ingredient_id]['aliases'].append(alias)
+            registry['by_key'][ingredient_key(alias)] = ingredient_id
+    return registry
+
+def _register_ingredient(registry, name):
+    ingredient_id = registry['next_id']
+    registry['next_id'] += 1
+    registry['by_id'][ingredient_id] = {'name': _display_name(name), 'aliases': []}
+    registry['by_key'][ingredient_key(name)] = ingredient_id
+    return ingredient_id
+
+def _get_ingredient_registry():
+    """The registry, reloaded if another process changed the file."""
+    global _ingredient_registry, _ingredient_registry_version, _ingredient_registry_checked
+    
+    now = time.monotonic()
+    if _ingredient_registry is not None and now - _ingredient_registry_checked < INGREDIENT_REGISTRY_CHECK_SECONDS:
+        return _ingredient_registry
+    _ingredient_registry_checked = now
+    try:
+        version = os.stat(INGREDIENTS_FILE).st_mtime_ns
+    except OSError:
+        version = None
+    if _ingredient_registry is not None and version == _ingredient_registry_version:
+        return _ingredient_registry
+    
+    with _ingredient_registry_lock:
+        if version is None:
+            registry = _seed_ingredient_registry()
+            save_json(_ingredient_registry_data(registry), INGREDIENTS_FILE)
+            logging.info(f"Created ingredient registry with {len(registry['by_id'])} ingredients")
+            version = os.stat(INGREDIENTS_FILE).st_mtime_ns
+        else:
+            registry = _index_ingredient_registry(load_json(INGREDIENTS_FILE, {}))
+        _ingredient_registry = registry
+        _ingredient_registry_version = version
+        return registry
+
+def get_ingredient_id(name, create=False):
+    """
+    Look up the ID of an ingredient by name or alias.
+    
+    Args:
+        name (str): Ingredient name in any spelling
+        create (bool): Register the ingredient if it is unknown
+        
+    Returns:
+        int: Ingredient ID, or None if unknown and create is False
+    """
+    if not name:
+        return None
+    registry = _get_ingredient_registry()
+    ingredient_id = registry['by_key'].get(ingredient_key(name))
+    if ingredient_id is not None or not create:
+        return ingredient_id
+    return register_ingredients([name])[name]
+
+def register_ingredients(names):
+    """
+    Register every unknown ingredient among names, saving the registry once.
+    
+    Args:
+        names: Ingredient names in any spelling
+        
+    Returns:
+        dict: {name: ingredient_id} for every non-empty name
+    """
+    global _ingredient_registry_version
+    registry = _get_ingredient_registry()
+    ids = {}
+    with _ingredient_registry_lock:
+        added = []
+        for name in names:
+            if not name or name in ids:
+                continue
+            ingredient_id = registry['by_key'].get(ingredient_key(name))
+            if ingredient_id is None:
+                ingredient_id = _register_ingredient(registry, name)
+                added.append(ingredient_id)
+            ids[name] = ingredient_id
+        if added:
+            save_json(_ingredient_registry_data(registry), INGREDIENTS_FILE)
+            _ingredient_registry_version = os.stat(INGREDIENTS_FILE).st_mtime_ns
+            logging.info(f"Registered {len(added)} ingredient(s): "
+                         f"{', '.join(registry['by_id'][i]['name'] for i in added[:10])}"
+                         f"{'...' if len(added) > 10 else ''}")
+    return ids
+
+def get_ingredient_name(ingredient_id):
+    """
+    Get the canonical name of an ingredient.
+    
+    Args:
+        ingredient_id (int): Ingredient ID
+        
+    Returns:
+        str: Canonical name, or None if the ID is unknown
+    """
+    entry = _get_ingredient_registry()['by_id'].get(ingredient_id)
+    return entry['name'] if entry else None
+
+def canonical_ingredient_name(name):
+    """
+    Get the canonical spelling of an ingredient name.
+    
+    Args:
+        name (str): Ingredient name in any spelling
+        
+    Returns:
+        str: Canonical name; unknown ingredients come back with whitespace cleaned up
+    """
+    registry = _get_ingredient_registry()
+    canonical = registry['canonical'].get(name)
+    if canonical is None:
+        ingredient_id = registry['by_key'].get(ingredient_key(name))
+        canonical = registry['by_id'][ingredient_id]['name'] if ingredient_id else ' '.join(str(name).split())
+        registry['canonical'][name] = canonical
+    return canonical
+
+def get_ingredient_ids(names):
+    """
+    Get the IDs of several ingredients.
+    
+    Args:
+        names: Ingredient names in any spelling
+        
+    Returns:
+        frozenset: IDs of the known ingredients
+    """
+    registry = _get_ingredient_registry()
+    ids = set()
+    for name in names:
+        ingredient_id = registry['by_key'].get(ingredient_key(name))
+        if ingredient_id is not None:
+            ids.add(ingredient_id)
+    return frozenset(ids)
+
+def add_ingredient_alias(ingredient_id, alias):
+    """
+    Make another name resolve to an ingredient.
+    
+    Args:
+        ingredient_id (int): Ingredient ID
+        alias (str): Other name for it
+        
+    Raises:
+        ValueError: If the ID is unknown or the alias names another ingredient
+    """
+    global _ingredient_registry_version
+    registry = _get_ingredient_registry()
+    with _ingredient_registry_lock:
+        entry = registry['by_id'].get(ingredient_id)
+        if entry is None:
+            raise ValueError(f"Unknown ingredient {ingredient_id}")
+        existing = registry['by_key'].get(ingredient_key(alias))
+        if existing == ingredient_id:
+            return
+        if existing is not None:
+            raise ValueError(f"{alias} is already {registry['by_id'][existing]['name']}")
+        entry['aliases'].append(' '.join(alias.split()))
+        registry['by_key'][ingredient_key(alias)] = ingredient_id
+        registry['canonical'].clear()
+        save_json(_ingredient_registry_data(registry), INGREDIENTS_FILE)
+        _ingredient_registry_version = os.stat(INGREDIENTS_FILE).st_mtime_ns
+
+def get_ingredient_registry():
+    """
+    Get every registered ingredient.
+    
+    Returns:
+        list: {id, name, aliases} dictionaries ordered by ID
+    """
+    registry = _get_ingredient_registry()
+    return [{'id': ingredient_id, 'name': entry['name'], 'aliases': list(entry.get('aliases', []))}
+            for ingredient_id, entry in sorted(registry['by_id'].items())]
+
+def get_pumps_by_ingredient(hose_assignments):
+    """
+    Map ingredient IDs to the pump they are assigned to.
+    
+    Args:
+        hose_assignments (dict): {hose_id: ingredient_name}
+        
+    Returns:
+        dict: {ingredient_id: pump_id}
+    """
+    pumps = {}
+    for hose_id, name in sorted(hose_assignments.items()):
+        ingredient_id = get_ingredient_id(name)
+        if ingredient_id is not None:
+            pumps.setdefault(ingredient_id, hose_id)
+    return pumps
 
 # Hose assignments
 def load_hose_assignments():
@@ -95,7 +427,7 @@ def load_hose_assignments():
         dict: {hose_id: ingredient_name}
     """
     data = load_json(HOSE_ASSIGNMENTS_FILE, {})
-    return {int(k): str(v) for k, v in data.items()}
+    return {int(k): canonical_ingredient_name(str(v)) if v else '' for k, v in data.items()}
 
 def save_hose_assignments(assignments):
     """
@@ -104,7 +436,9 @@ def save_hose_assignments(assignments):
     Args:
         assignments (dict): {hose_id: ingredient_name}
     """
-    save_json({str(k): v for k, v in assignments.items()}, HOSE_ASSIGNMENTS_FILE)
+    register_ingredients(assignments.values())
+    save_json({str(k): canonical_ingredient_name(v) if v else '' for k, v in assignments.items()},
+              HOSE_ASSIGNMENTS_FILE)
 
 # Pump calibrations
 def load_pump_calibrations():
@@ -129,6 +463,17 @@ def save_pump_calibration(pump_id, flow_rate):
     calibrations[pump_id] = float(flow_rate)
     save_json({str(k): v for k, v in calibrations.items()}, PUMP_CALIBRATIONS_FILE)
 
+def save_pump_calibrations(flow_rates):
+    """
+    Save several pumps' calibrations to JSON file in one write.
+    
+    Args:
+        flow_rates (dict): {pump_id: flow_rate_ml_per_second}
+    """
+    calibrations = load_pump_calibrations()
+    calibrations.update({int(k): float(v) for k, v in flow_rates.items()})
+    save_json({str(k): v for k, v in calibrations.items()}, PUMP_CALIBRATIONS_FILE)
+
 # Hose statuses
 def load_hose_statuses():
     """
@@ -155,21 +500,28 @@ def load_bottle_volumes():
     Load bottle volume information from JSON file.
     
     Returns:
-        dict: {hose_id: {'total_volume_ml': int, 'remaining_volume_ml': int}}
+        dict: {hose_id: BottleVolume}; hoses without a bottle are missing,
+              get(hose_id, NO_BOTTLE) gives an empty one
     """
-    data = load_json(BOTTLE_VOLUMES_FILE, {})
-    return {int(k): {'total_volume_ml': int(v['total_volume_ml']), 
-                    'remaining_volume_ml': int(v['remaining_volume_ml'])} 
-            for k, v in data.items()}
+    global _bottle_volumes_cache
+    
+    version = _file_version(BOTTLE_VOLUMES_FILE)
+    if _bottle_volumes_cache is None or _bottle_volumes_cache[0] != version:
+        data = load_json(BOTTLE_VOLUMES_FILE, {})
+        volumes = {int(k): BottleVolume(v['total_volume_ml'], v['remaining_volume_ml']) 
+                   for k, v in data.items()}
+        _bottle_volumes_cache = (version, volumes)
+    # The bottles are shared and immutable; only the dict is the caller's
+    return dict(_bottle_volumes_cache[1])
 
 def save_bottle_volumes(volumes):
     """
     Save bottle volume information to JSON file.
     
     Args:
-        volumes (dict): {hose_id: {'total_volume_ml': int, 'remaining_volume_ml': int}}
+        volumes (dict): {hose_id: BottleVolume}
     """
-    save_json({str(k): v for k, v in volumes.items()}, BOTTLE_VOLUMES_FILE)
+    save_json({str(k): v.to_dict() for k, v in volumes.items()}, BOTTLE_VOLUMES_FILE)
 
 def update_remaining_volume(hose_id, dispensed_volume):
     """
@@ -179,36 +531,103 @@ def update_remaining_volume(hose_id, dispensed_volume):
         hose_id (int): Hose ID
         dispensed_volume (float): Volume dispensed in ml
     """
-    volumes = load_bottle_volumes()
-    if hose_id in volumes:
-        volumes[hose_id]['remaining_volume_ml'] = max(0, 
-            volumes[hose_id]['remaining_volume_ml'] - dispensed_volume)
-    save_bottle_volumes(volumes)
+    with _bottle_volume_update_lock:
+        volumes = load_bottle_volumes()
+        if hose_id in volumes:
+            bottle = volumes[hose_id]
+            volumes[hose_id] = bottle.with_remaining(max(0, bottle.remaining_volume_ml - dispensed_volume))
+        save_bottle_volumes(volumes)
 
 # Recipes
+def make_recipe(drink_id, drink_name, ingredients, notes=''):
+    """
+    Build a Recipe from plain values.
+    
+    Args:
+        drink_id (int): Drink ID
+        drink_name (str): Display name
+        ingredients (dict): {ingredient name: percentage}; spellings of the
+                            same ingredient are merged under its canonical name
+        notes (str): Serving notes
+        
+    Returns:
+        Recipe: The recipe
+    """
+    canonical = {}
+    for name, percentage in ingredients.items():
+        name = canonical_ingredient_name(name)
+        # JSON doesn't guarantee numeric types
+        canonical[name] = canonical.get(name, 0.0) + float(percentage)
+    return Recipe(drink_id, drink_name, canonical.keys(),
+                  [get_ingredient_id(name) or 0 for name in canonical], canonical.values(), notes)
+
+def recipe_ingredients(recipe):
+    """
+    The ingredients of a recipe without building its ingredients dict.
+    
+    A Recipe's vectors are read directly. A plain recipe dict, as sent to
+    the pump controller daemon, has its names looked up.
+    
+    Args:
+        recipe: Recipe or recipe dict
+        
+    Returns:
+        iterable: (name, ingredient ID or 0 if unknown, percentage) per ingredient
+    """
+    if isinstance(recipe, Recipe):
+        return zip(recipe.ingredient_names, recipe.ingredient_ids, recipe.percentages)
+    return [(name, get_ingredient_id(name) or 0, float(percentage))
+            for name, percentage in recipe.get('ingredients', {}).items()]
+
+def _file_version(file_path):
+    try:
+        return os.stat(file_path).st_mtime_ns
+    except OSError:
+        return None
+
+# Recipes and bottles are built once per version of their file; {version, objects}
+_recipes_cache = None
+_bottle_volumes_cache = None
+
+def _load_recipes():
+    """The cached recipes and their index by ID, rebuilt if the files changed."""
+    global _recipes_cache
+    
+    # Canonical names come from the registry, so its version counts too
+    _get_ingredient_registry()
+    version = (_file_version(RECIPE_FILE), _ingredient_registry_version)
+    if _recipes_cache is None or _recipes_cache[0] != version:
+        recipes = tuple(make_recipe(r['drink_id'], r['drink_name'], r['ingredients'], r.get('notes', ''))
+                        for r in load_json(RECIPE_FILE, []))
+        _recipes_cache = (version, recipes, {r.drink_id: r for r in recipes})
+    return _recipes_cache
+
 def load_all_recipes():
     """
     Load all drink recipes from JSON file.
     
     Returns:
-        list: List of recipe dictionaries
+        list: Recipe objects; the list is the caller's, the recipes are shared
     """
-    recipes = load_json(RECIPE_FILE, [])
-    # Convert percentages to floats since JSON doesn't guarantee numeric types
-    return [{'drink_id': r['drink_id'], 
-             'drink_name': r['drink_name'], 
-             'ingredients': {k: float(v) for k, v in r['ingredients'].items()}, 
-             'notes': r.get('notes', '')} 
-            for r in recipes]
+    return list(_load_recipes()[1])
 
 def save_all_recipes(recipes):
     """
     Save all drink recipes to JSON file.
     
     Args:
-        recipes (list): List of recipe dictionaries
+        recipes (list): Recipe objects or recipe dictionaries
     """
-    save_json(recipes, RECIPE_FILE)
+    recipes = list(recipes)
+    # One registry save for all new ingredients, not one per ingredient
+    register_ingredients(name for recipe in recipes for name in recipe['ingredients'])
+    data = []
+    for recipe in recipes:
+        if not isinstance(recipe, Recipe):
+            recipe = make_recipe(recipe['drink_id'], recipe['drink_name'], recipe['ingredients'],
+                                 recipe.get('notes', ''))
+        data.append(recipe.to_dict())
+    save_json(data, RECIPE_FILE)
 
 def get_recipe_by_id(drink_id):
     """
@@ -218,9 +637,9 @@ def get_recipe_by_id(drink_id):
         drink_id (int): Drink ID to look up
         
     Returns:
-        dict: Recipe dictionary or None if not found
+        Recipe: The recipe or None if not found
     """
-    return next((r for r in load_all_recipes() if r['drink_id'] == drink_id), None)
+    return _load_recipes()[2].get(drink_id)
 
 # Availability
 def is_ingredient_available(ingredient):
@@ -233,19 +652,23 @@ def is_ingredient_available(ingredient):
     Returns:
         bool: True if ingredient is available, False otherwise
     """
+    return get_ingredient_id(ingredient) in get_available_ingredient_ids()
+
+def get_available_ingredient_ids():
+    """
+    Get every ingredient that is currently available in some hose.
+    
+    Returns:
+        frozenset: IDs of ingredients on a hose that isn't empty (status
+                   False) and has remaining volume
+    """
     hose_assignments = load_hose_assignments()
     hose_statuses = load_hose_statuses()
     bottle_volumes = load_bottle_volumes()
     
-    for hose_id, bev in hose_assignments.items():
-        if bev.lower() == ingredient.lower():
-            # Check if hose is not empty (status False) and has remaining volume
-            if not hose_statuses.get(hose_id, True):
-                if hose_id in bottle_volumes:
-                    remaining = bottle_volumes[hose_id].get('remaining_volume_ml', 0)
-                    if remaining > 0:
-                        return True
-    return False
+    return get_ingredient_ids(bev for hose_id, bev in hose_assignments.items()
+                              if bev and not hose_statuses.get(hose_id, True)
+                              and bottle_volumes.get(hose_id, NO_BOTTLE).remaining_volume_ml > 0)
 
 def get_available_drinks():
     """
@@ -255,8 +678,9 @@ def get_available_drinks():
         list: List of recipe dictionaries for available drinks
     """
     recipes = load_all_recipes()
-    # A drink is available if ALL its ingredients are available
-    return [r for r in recipes if all(is_ingredient_available(ing) for ing in r['ingredients'])]
+    available = get_available_ingredient_ids()
+    # A drink is available if ALL its ingredients are; an unknown one (ID 0) never is
+    return [r for r in recipes if all(ingredient_id in available for ingredient_id in r.ingredient_ids)]
 
 # Density
 def get_density(liquid_name):
@@ -270,7 +694,19 @@ def get_density(liquid_name):
         float: Density of the liquid (g/ml)
     """
     densities = load_json(DENSITY_FILE, DEFAULT_DENSITIES)
-    return densities.get(liquid_name.lower(), 1.0) if liquid_name else densities
+    if not liquid_name:
+        return densities
+    return _densities_by_id(densities).get(get_ingredient_id(liquid_name), 1.0)
+
+def _densities_by_id(densities):
+    """Densities keyed by ingredient ID instead of name."""
+    # A read path: unknown names are skipped, not registered
+    by_id = {}
+    for name, density in densities.items():
+        ingredient_id = get_ingredient_id(name)
+        if ingredient_id is not None:
+            by_id[ingredient_id] = float(density)
+    return by_id
 
 def add_density(liquid_name, density):
     """
@@ -281,7 +717,10 @@ def add_density(liquid_name, density):
         density (float): Density value (g/ml)
     """
     densities = load_json(DENSITY_FILE, DEFAULT_DENSITIES)
-    densities[liquid_name.lower()] = float(density)
+    ingredient_id = get_ingredient_id(liquid_name, create=True)
+    # One entry per ingredient, whatever spelling it was saved under before
+    densities = {name: value for name, value in densities.items() if get_ingredient_id(name) != ingredient_id}
+    densities[get_ingredient_name(ingredient_id).lower()] = float(density)
     save_json(densities, DENSITY_FILE)
     
 # Ingredients
@@ -290,13 +729,9 @@ def get_all_ingredients():
     Get a list of all defined ingredients.
     
     Returns:
-        list: Sorted list of ingredient names (capitalized)
+        list: Sorted list of canonical ingredient names
     """
-    densities = load_json(DENSITY_FILE, DEFAULT_DENSITIES)
-    # Return capitalized ingredient names for display
-    ingredients = [key.capitalize() for key in densities.keys()]
-    ingredients.sort()
-    return ingredients
+    return sorted((entry['name'] for entry in get_ingredient_registry()), key=str.lower)
 
 # Suggest substitutes based on density similarity
 def suggest_substitutes(ingredient):
@@ -309,39 +744,249 @@ def suggest_substitutes(ingredient):
     Returns:
         list: Up to 3 suggested substitutes (ingredient names)
     """
-    densities = load_json(DENSITY_FILE, DEFAULT_DENSITIES)
-    target_density = densities.get(ingredient.lower(), 1.0)
+    densities = _densities_by_id(load_json(DENSITY_FILE, DEFAULT_DENSITIES))
+    ingredient_id = get_ingredient_id(ingredient)
+    target_density = densities.get(ingredient_id, 1.0)
     
     # First check what ingredients are currently available
-    available_ingredients = []
-    hose_assignments = load_hose_assignments()
-    hose_statuses = load_hose_statuses()
-    bottle_volumes = load_bottle_volumes()
-    
-    for hose_id, assigned_ingredient in hose_assignments.items():
-        if (not hose_statuses.get(hose_id, True) and 
-            assigned_ingredient.lower() != ingredient.lower() and
-            assigned_ingredient and
-            bottle_volumes.get(hose_id, {}).get('remaining_volume_ml', 0) > 0):
-            available_ingredients.append(assigned_ingredient.lower())
+    available_ingredients = get_available_ingredient_ids() - {ingredient_id}
     
     # Sort all ingredients by density similarity
     similar = sorted(
-        [(name, abs(density - target_density)) 
-         for name, density in densities.items()
-         if name != ingredient.lower()],
+        [(other_id, abs(density - target_density)) 
+         for other_id, density in densities.items()
+         if other_id != ingredient_id],
         key=lambda x: x[1]  # Sort by density difference
     )
     
     # Prioritize available ingredients
-    available_substitutes = [name for name, _ in similar if name in available_ingredients][:3]
+    available_substitutes = [other_id for other_id, _ in similar if other_id in available_ingredients][:3]
     
     # If we don't have 3 available substitutes, add other close matches
-    other_substitutes = [name for name, _ in similar if name not in available_ingredients]
+    other_substitutes = [other_id for other_id, _ in similar if other_id not in available_ingredients]
     
-    return available_substitutes + other_substitutes[:3 - len(available_substitutes)]
+    substitutes = available_substitutes + other_substitutes[:3 - len(available_substitutes)]
+    return [get_ingredient_name(other_id) for other_id in substitutes]
 
 # Usage statistics and maintenance tracking
+#
+# Every dispense and every finished order is appended as one JSON line to
+# USAGE_JOURNAL_FILE, and the per-pump totals and per-drink order counts are
+# kept in memory. USAGE_STATS_FILE is only a snapshot of those totals plus
+# the journal offset they cover, written by the compactor. At startup the
+# totals are rebuilt from the snapshot and the journal tail.
+#
+# The totals include what the pour estimator and bottle reconciliation learn
+# from the journal (each pump's run ratio and its total run time), so neither
+# has to read the whole journal either.
+
+_usage_stats = None
+_drink_counts = None
+_usage_journal_offset = 0
+
+# Weight of the newest dispense in a pump's run ratio moving average
+RUN_RATIO_SMOOTHING = 0.2
+
+def fold_run_ratio(ratio, planned_seconds, actual_seconds, smoothing=RUN_RATIO_SMOOTHING):
+    """
+    Update a pump's observed / planned run time ratio with one dispense.
+    
+    Args:
+        ratio (float): Moving average so far, or None
+        planned_seconds (float): Planned pump run time
+        actual_seconds (float): Measured pump run time
+        smoothing (float): Weight of this dispense
+        
+    Returns:
+        float: The new moving average; unchanged for a run that says
+               nothing about the pump (no plan, cut short or stalled)
+    """
+    if not planned_seconds or actual_seconds is None or planned_seconds <= 0:
+        return ratio
+    observed = actual_seconds / planned_seconds
+    if not 0.5 <= observed <= 2.0:
+        return ratio
+    return observed if ratio is None else ratio + smoothing * (observed - ratio)
+
+def _apply_usage_event(stats, drinks, event):
+    """
+    Fold a single journal event into the aggregate usage statistics.
+    
+    Args:
+        stats (dict): Aggregates by pump ID string (modified in place)
+        drinks (dict): Orders poured by drink ID string (modified in place)
+        event (dict): Journal event
+    """
+    if event.get('event') == 'order':
+        drink_str = str(event.get('drink'))
+        drinks[drink_str] = drinks.get(drink_str, 0) + 1
+        return
+    
+    pump_str = str(event.get('pump'))
+    pump_stats = stats.setdefault(pump_str, {
+        "volume_dispensed": 0,
+        "dispense_count": 0,
+        "last_used": None,
+    })
+    
+    if event.get('event') == 'reset':
+        pump_stats["volume_dispensed"] = 0
+        return
+    
+    # Pours and manual runs alike draw from the bottle, for reconciliation
+    seconds = event.get('actual_s')
+    if seconds is None:
+        seconds = event.get('planned_s') or 0.0
+    pump_stats["run_seconds"] = pump_stats.get("run_seconds", 0.0) + float(seconds)
+    if event.get('event') == 'run':
+        # Manual runs only matter to bottle reconciliation
+        return
+    
+    pump_stats["volume_dispensed"] = pump_stats.get("volume_dispensed", 0) + float(event.get('ml', 0))
+    pump_stats["dispense_count"] = pump_stats.get("dispense_count", 0) + 1
+    pump_stats["last_used"] = event.get('ts')
+    # A cancelled run says nothing about how long a full one takes
+    if not event.get('cancelled'):
+        ratio = fold_run_ratio(pump_stats.get("run_ratio"), event.get('planned_s'), event.get('actual_s'))
+        if ratio is not None:
+            pump_stats["run_ratio"] = ratio
+
+def _rebuild_usage_stats():
+    """
+    Rebuild aggregates from the last snapshot plus the journal tail.
+    Must be called with the journal lock held.
+    """
+    global _usage_stats, _drink_counts, _usage_journal_offset
+    
+    snapshot = load_json(USAGE_STATS_FILE, {})
+    if 'pumps' in snapshot and 'journal_offset' in snapshot:
+        stats = snapshot['pumps']
+        drinks = snapshot.get('drinks', {})
+        offset = int(snapshot['journal_offset'])
+    else:
+        # Pre-journal usage_stats.json holds the totals directly
+        stats = snapshot
+        drinks = {}
+        offset = 0
+    
+    if os.path.exists(USAGE_JOURNAL_FILE):
+        if offset > os.path.getsize(USAGE_JOURNAL_FILE):
+            logging.warning("Usage snapshot is ahead of the journal, replaying from the start")
+            stats, drinks, offset = {}, {}, 0
+        with open(USAGE_JOURNAL_FILE, 'rb') as f:
+            f.seek(offset)
+            for line in f:
+                if not line.endswith(b'\n'):
+                    # Torn write from a crash; the next append starts a new line
+                    break
+                offset += len(line)
+                if not line.strip():
+                    continue
+                try:
+                    _apply_usage_event(stats, drinks, json.loads(line))
+                except ValueError:
+                    logging.warning(f"Skipping malformed usage journal line at offset {offset}")
+    
+    _usage_stats = stats
+    _drink_counts = drinks
+    _usage_journal_offset = offset
+
+def _catch_up_usage_stats():
+    """
+    Make sure the aggregates are loaded and include events appended to the
+    journal by other processes. Must be called with the journal lock held.
+    """
+    global _usage_journal_offset
+    
+    if _usage_stats is None:
+        _rebuild_usage_stats()
+        return
+    
+    try:
+        size = os.path.getsize(USAGE_JOURNAL_FILE)
+    except OSError:
+        return
+    if size <= _usage_journal_offset:
+        return
+    
+    with open(USAGE_JOURNAL_FILE, 'rb') as f:
+        f.seek(_usage_journal_offset)
+        for line in f:
+            if not line.endswith(b'\n'):
+                break
+            _usage_journal_offset += len(line)
+            if not line.strip():
+                continue
+            try:
+                _apply_usage_event(_usage_stats, _drink_counts, json.loads(line))
+            except ValueError:
+                logging.warning(f"Skipping malformed usage journal line at offset {_usage_journal_offset}")
+
+def _append_usage_event(event):
+    """
+    Append an event to the usage journal and fold it into the aggregates.
+    
+    Args:
+        event (dict): Journal event
+    """
+    global _usage_journal_offset
+    
+    line = (json.dumps(event) + '\n').encode('utf-8')
+    with file_locks[USAGE_JOURNAL_FILE]:
+        with open(USAGE_JOURNAL_FILE, 'ab') as f:
+            # Other processes (web workers, pump controller) append too
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                _catch_up_usage_stats()
+                if f.seek(0, os.SEEK_END) != _usage_journal_offset:
+                    # Terminate a torn line left behind by a crash
+                    line = b'\n' + line
+                f.write(line)
+                f.flush()
+                _usage_journal_offset = f.tell()
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+        _apply_usage_event(_usage_stats, _drink_counts, event)
+    bump_state_version()
+
+def compact_usage_journal():
+    """
+    Write a snapshot of the aggregated usage statistics and the journal
+    offset they cover, so startup only has to replay the journal tail.
+    """
+    with file_locks[USAGE_JOURNAL_FILE]:
+        _catch_up_usage_stats()
+        snapshot = {
+            'journal_offset': _usage_journal_offset,
+            'pumps': json.loads(json.dumps(_usage_stats)),
+            'drinks': dict(_drink_counts)
+        }
+    save_json(snapshot, USAGE_STATS_FILE)
+
+def start_usage_compactor(interval_seconds=300):
+    """
+    Rebuild the usage aggregates and start a background thread that
+    periodically compacts the usage journal into a snapshot.
+    
+    Args:
+        interval_seconds (float): Time between compactions
+    """
+    with file_locks[USAGE_JOURNAL_FILE]:
+        _rebuild_usage_stats()
+    
+    def compactor():
+        last_offset = None
+        while True:
+            time.sleep(interval_seconds)
+            try:
+                if _usage_journal_offset != last_offset:
+                    compact_usage_journal()
+                    last_offset = _usage_journal_offset
+            except Exception:
+                logging.error("Error compacting usage journal", exc_info=True)
+    
+    Thread(target=compactor, name="usage-compactor", daemon=True).start()
+
 def get_ingredient_usage_stats():
     """
     Get usage statistics for ingredients.
@@ -350,39 +995,189 @@ def get_ingredient_usage_stats():
         dict: Usage statistics by pump ID
     """
     try:
-        return load_json(USAGE_STATS_FILE, {})
+        with file_locks[USAGE_JOURNAL_FILE]:
+            _catch_up_usage_stats()
+            return {k: dict(v) for k, v in _usage_stats.items()}
     except Exception:
         logging.error("Error loading usage stats", exc_info=True)
         return {}
 
-def update_ingredient_usage(pump_id, volume_ml):
+def get_pump_run_ratios():
+    """
+    Get each pump's observed / planned run time ratio over its past pours.
+    
+    Returns:
+        dict: Run ratio by pump ID, for pumps with usable dispenses
+    """
+    try:
+        with file_locks[USAGE_JOURNAL_FILE]:
+            _catch_up_usage_stats()
+            return {int(k): v['run_ratio'] for k, v in _usage_stats.items() if v.get('run_ratio') is not None}
+    except Exception:
+        logging.error("Error loading pump run ratios", exc_info=True)
+        return {}
+
+def get_pump_run_seconds(pump_id):
+    """
+    Get the total time a pump has run, pours and manual runs alike.
+    
+    Args:
+        pump_id (int): Pump ID
+        
+    Returns:
+        float: Run time in seconds over the whole journal
+    """
+    with file_locks[USAGE_JOURNAL_FILE]:
+        _catch_up_usage_stats()
+        return float(_usage_stats.get(str(pump_id), {}).get('run_seconds', 0.0))
+
+def get_drink_popularity():
+    """
+    Get how often each drink has been poured.
+    
+    Returns:
+        dict: Completed order count by drink ID
+    """
+    try:
+        with file_locks[USAGE_JOURNAL_FILE]:
+            _catch_up_usage_stats()
+            return {int(k): v for k, v in _drink_counts.items()}
+    except Exception:
+        logging.error("Error loading drink popularity", exc_info=True)
+        return {}
+
+def record_drink_poured(drink_id, order_id=None):
+    """
+    Record a completed order in the usage journal.
+    
+    Args:
+        drink_id (int): Drink that was poured
+        order_id (str): ID of the order
+    """
+    try:
+        _append_usage_event({
+            'event': 'order',
+            'ts': datetime.now().isoformat(),
+            'order': order_id,
+            'drink': int(drink_id)
+        })
+    except Exception:
+        logging.error(f"Error recording order for drink {drink_id}", exc_info=True)
+
+def update_ingredient_usage(pump_id, volume_ml, ingredient=None, order_id=None,
+                            planned_seconds=None, actual_seconds=None, cancelled=False):
     """
-    Update usage statistics for an ingredient.
+    Record a dispense event in the usage journal.
     
     Args:
         pump_id (int): Pump ID
         volume_ml (float): Volume dispensed in ml
+        ingredient (str): Ingredient dispensed
+        order_id (str): ID of the order the dispense belongs to
+        planned_seconds (float): Planned pump run time
+        actual_seconds (float): Measured pump run time
+        cancelled (bool): The run was cut short by a cancel; volume_ml is
+                          the part dispensed before it
     """
+    event = {
+        'event': 'dispense',
+        'ts': datetime.now().isoformat(),
+        'order': order_id,
+        'pump': int(pump_id),
+        'ingredient': ingredient,
+        'ml': float(volume_ml),
+        'planned_s': planned_seconds,
+        'actual_s': actual_seconds
+    }
+    if cancelled:
+        event['cancelled'] = True
     try:
-        usage_stats = get_ingredient_usage_stats()
-        pump_str = str(pump_id)
-        
-        if pump_str not in usage_stats:
-            usage_stats[pump_str] = {
-                "volume_dispensed": 0,
-                "dispense_count": 0,
-                "last_used": None,
-            }
-        
-        # Update stats
-        usage_stats[pump_str]["volume_dispensed"] = usage_stats[pump_str].get("volume_dispensed", 0) + float(volume_ml)
-        usage_stats[pump_str]["dispense_count"] = usage_stats[pump_str].get("dispense_count", 0) + 1
-        usage_stats[pump_str]["last_used"] = datetime.now().isoformat()
-        
-        save_json(usage_stats, USAGE_STATS_FILE)
+        _append_usage_event(event)
     except Exception:
         logging.error(f"Error updating ingredient usage for pump {pump_id}", exc_info=True)
 
+def record_pump_run(pump_id, seconds, purpose):
+    """
+    Record a manual pump run (calibration or priming) in the usage journal.
+    
+    These draw from the bottle without being a pour, so they count towards
+    the pump time when a refill is reconciled but not towards usage stats.
+    
+    Args:
+        pump_id (int): Pump ID
+        seconds (float): Run time
+        purpose (str): 'calibration' or 'prime'
+    """
+    try:
+        _append_usage_event({
+            'event': 'run',
+            'ts': datetime.now().isoformat(),
+            'pump': int(pump_id),
+            'purpose': purpose,
+            'actual_s': float(seconds)
+        })
+    except Exception:
+        logging.error(f"Error recording {purpose} run of pump {pump_id}", exc_info=True)
+
+def load_usage_events(since=None, kinds=('dispense',)):
+    """
+    Read events from the usage journal.
+    
+    Args:
+        since (str): Optional ISO timestamp; only newer events are returned
+        kinds (tuple): Event types to return
+        
+    Returns:
+        list: Event dictionaries in journal order
+    """
+    events = []
+    if not os.path.exists(USAGE_JOURNAL_FILE):
+        return events
+    with open(USAGE_JOURNAL_FILE, 'r') as f:
+        for line in f:
+            try:
+                event = json.loads(line)
+            except ValueError:
+                continue
+            if event.get('event') not in kinds:
+                continue
+            if since and event.get('ts', '') <= since:
+                continue
+            events.append(event)
+    return events
+
+def read_usage_journal(offset=0, kinds=('dispense',)):
+    """
+    Read the events appended to the usage journal since a byte offset.
+    
+    Args:
+        offset (int): Where the previous read stopped; 0 for the whole journal
+        kinds (tuple): Event types to return
+        
+    Returns:
+        tuple: (events in journal order, offset to continue from)
+    """
+    events = []
+    try:
+        if offset > os.path.getsize(USAGE_JOURNAL_FILE):
+            offset = 0
+        with open(USAGE_JOURNAL_FILE, 'rb') as f:
+            f.seek(offset)
+            for line in f:
+                if not line.endswith(b'\n'):
+                    # Still being written; picked up by the next read
+                    break
+                offset += len(line)
+                try:
+                    event = json.loads(line)
+                except ValueError:
+                    continue
+                if event.get('event') in kinds:
+                    events.append(event)
+    except OSError:
+        pass
+    return events, offset
+
 def load_maintenance_log():
     """
     Load maintenance log.
@@ -396,13 +1191,62 @@ def load_maintenance_log():
         logging.error("Error loading maintenance log", exc_info=True)
         return {}
 
-def save_maintenance_log(pump_id, notes=""):
+def _maintenance_segments():
+    """
+    List archived maintenance history segments, oldest first.
+    
+    Returns:
+        list: Segment file paths
+    """
+    if not os.path.isdir(MAINTENANCE_ARCHIVE_DIR):
+        return []
+    names = sorted(n for n in os.listdir(MAINTENANCE_ARCHIVE_DIR)
+                   if n.startswith('maintenance-') and n.endswith('.jsonl'))
+    return [os.path.join(MAINTENANCE_ARCHIVE_DIR, n) for n in names]
+
+def _archive_maintenance_entries(entries, segment_size, segments_kept):
+    """
+    Append maintenance history entries to the current archive segment,
+    rotating to a new segment when it is full and dropping the oldest
+    segments beyond the retention limit.
+    
+    Args:
+        entries (list): Entry dictionaries including their pump ID
+        segment_size (int): Maximum entries per segment file
+        segments_kept (int): Maximum number of segment files retained
+    """
+    with file_locks[MAINTENANCE_ARCHIVE_DIR]:
+        os.makedirs(MAINTENANCE_ARCHIVE_DIR, exist_ok=True)
+        segments = _maintenance_segments()
+        
+        for entry in entries:
+            current = segments[-1] if segments else None
+            if current is not None:
+                with open(current, 'r') as f:
+                    count = sum(1 for _ in f)
+            if current is None or count >= segment_size:
+                number = int(os.path.basename(current)[12:-6]) + 1 if current else 1
+                current = os.path.join(MAINTENANCE_ARCHIVE_DIR, f'maintenance-{number:06d}.jsonl')
+                segments.append(current)
+            with open(current, 'a') as f:
+                f.write(json.dumps(entry) + '\n')
+        
+        while len(segments) > segments_kept:
+            os.remove(segments.pop(0))
+
+def save_maintenance_log(pump_id, notes="", history_limit=20, segment_size=500, segments_kept=20):
     """
     Log a maintenance event and reset usage statistics.
     
+    Only the most recent history_limit entries per pump are kept in the
+    maintenance log; older entries are moved into archive segments.
+    
     Args:
         pump_id (str or int): Pump ID
         notes (str): Maintenance notes
+        history_limit (int): Entries kept per pump in the maintenance log
+        segment_size (int): Maximum entries per archive segment file
+        segments_kept (int): Maximum number of archive segment files retained
     """
     try:
         pump_str = str(pump_id)
@@ -421,16 +1265,94 @@ def save_maintenance_log(pump_id, notes=""):
             "notes": notes
         })
         
+        # Move entries beyond the retention limit into the archive. They
+        # leave the log only once archived, so a failed write loses nothing
+        # and the next save tries again.
+        history = maintenance_log[pump_str]["maintenance_history"]
+        if len(history) > history_limit:
+            overflow = history[:len(history) - history_limit]
+            archived_at = datetime.now().isoformat()
+            try:
+                _archive_maintenance_entries(
+                    [dict(entry, pump_id=pump_str, archived=archived_at) for entry in overflow],
+                    segment_size, segments_kept)
+                maintenance_log[pump_str]["maintenance_history"] = history[len(overflow):]
+            except Exception:
+                logging.error(f"Error archiving maintenance history for pump {pump_id}", exc_info=True)
+        
         # Save maintenance log
         save_json(maintenance_log, MAINTENANCE_LOG_FILE)
         
         # Reset usage statistics for this pump
         try:
-            usage_stats = get_ingredient_usage_stats()
-            if pump_str in usage_stats:
-                usage_stats[pump_str]["volume_dispensed"] = 0
-                save_json(usage_stats, USAGE_STATS_FILE)
+            _append_usage_event({
+                'event': 'reset',
+                'ts': datetime.now().isoformat(),
+                'pump': int(pump_id)
+            })
         except Exception:
             logging.error(f"Error resetting usage stats for pump {pump_id}", exc_info=True)
     except Exception:
-        logging.error(f"Error saving maintenance log for pump {pump_id}", exc_info=True)
\ No newline at end of file
+        logging.error(f"Error saving maintenance log for pump {pump_id}", exc_info=True)
+
+def get_maintenance_history_page(page=1, per_page=20, pump_id=None, maintenance_log=None):
+    """
+    Get one page of maintenance history, newest first.
+    
+    Log and archive entries are merged by date, so a pump with little
+    maintenance doesn't put old entries ahead of newer archived ones from a
+    busy pump. Archive segments are read newest first, and only until no
+    unread entry can be dated late enough to make the page.
+    
+    Args:
+        page (int): 1-based page number
+        per_page (int): Entries per page
+        pump_id (str or int): Optional pump ID to filter on
+        maintenance_log (dict): Already loaded maintenance log, if available
+        
+    Returns:
+        dict: {'entries': list, 'page': int, 'per_page': int, 'has_more': bool}
+    """
+    page = max(1, int(page))
+    per_page = max(1, int(per_page))
+    pump_str = str(pump_id) if pump_id is not None else None
+    needed = page * per_page + 1  # One extra entry tells us if there is a next page
+    
+    if maintenance_log is None:
+        maintenance_log = load_maintenance_log()
+    
+    entries = []
+    # No unread archived entry is dated after this; None while unknown.
+    # A pump's archived entries are all older than its oldest logged one.
+    bound = None
+    for log_pump, data in maintenance_log.items():
+        if (pump_str and log_pump != pump_str) or not isinstance(data, dict):
+            continue
+        history = data.get("maintenance_history", [])
+        for entry in history:
+            entries.append(dict(entry, pump_id=log_pump))
+        if history:
+            oldest = min(entry.get('date', '') for entry in history)
+            bound = oldest if bound is None else max(bound, oldest)
+    
+    with file_locks[MAINTENANCE_ARCHIVE_DIR]:
+        for segment in reversed(_maintenance_segments()):
+            if bound is not None and sum(1 for e in entries if e.get('date', '') >= bound) >= needed:
+                break
+            with open(segment, 'r') as f:
+                archived = [json.loads(line) for line in f if line.strip()]
+            entries.extend(e for e in archived if not pump_str or e.get('pump_id') == pump_str)
+            # Older segments were archived earlier, and entries are archived
+            # after they were made
+            if archived and archived[0].get('archived'):
+                first = archived[0]['archived']
+                bound = first if bound is None else min(bound, first)
+    entries.sort(key=lambda e: e.get('date', ''), reverse=True)
+    
+    start = (page - 1) * per_page
+    return {
+        'entries': entries[start:start + per_page],
+        'page': page,
+        'per_page': per_page,
+        'has_more': len(entries) > start + per_page
+    }